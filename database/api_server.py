@@ -1,9 +1,29 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
+import csv
+import io
 import json
 import logging
-from datetime import datetime
-from data_handler import UserDataHandler
+import math
+import os
+import atexit
+import threading
+import hashlib
+import time
+from datetime import date, datetime, timedelta
+from data_handler import (
+    DATA_MAPPING, DATE_UNIT, EXPORT_COLUMNS, EXPORT_TABLES, ROLLUP_PERIODS, HistoryCompactor, StaffSync, UserDataHandler,
+    decode_export_cursor, encode_export_cursor, parse_date_range
+)
+from cache import LRUCache
+from change_feed import ChangeFeed, UserEventStream, parse_event_id
+from metrics import end_trace, normalize_route, registry, sql_query_name, start_trace
+from rag_search import DEFAULT_CORPUS_DIR, DEFAULT_INDEX_DIR
+from rag_service import RagService, SEARCH_MODES
+from rag_context import build_candidates, format_profile, normalize_query, pack_context
+from write_behind import WriteBehindQueue
+from db_writer import RemoteWriteHandler
+from sharding import ShardedUserDataHandler
 
 app = Flask(__name__)
 CORS(app)
@@ -11,7 +31,400 @@ CORS(app)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-db_handler = UserDataHandler()
+db_options = {
+    'db_path': os.getenv('DB_PATH', 'user_data.db'),
+    'pool_size': int(os.getenv('DB_POOL_SIZE', '8')),
+    'busy_timeout': int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+}
+DB_SHARDS = int(os.getenv('DB_SHARDS', '1'))
+DB_SHARD_PATHS = [path for path in os.getenv('DB_SHARD_PATHS', '').split(',') if path]
+# 依 user_id 分散到多個 SQLite 檔案 (見 sharding.py)；DB_SHARD_PATHS 可把各分片放在不同磁碟
+if DB_SHARDS > 1 or len(DB_SHARD_PATHS) > 1:
+    db_handler = ShardedUserDataHandler(
+        shards=DB_SHARDS,
+        paths=DB_SHARD_PATHS or None,
+        threads=int(os.getenv('DB_SHARD_THREADS', '0')) or None,
+        **db_options
+    )
+# 由 serve.py 以多個 worker 啟動時，寫入交給單一 writer process，本機只讀取
+elif os.getenv('DB_WRITER_ADDRESS'):
+    db_handler = RemoteWriteHandler(
+        os.environ['DB_WRITER_ADDRESS'],
+        bytes.fromhex(os.environ['DB_WRITER_AUTHKEY']),
+        timeout=float(os.getenv('DB_WRITER_TIMEOUT', '30')),
+        **db_options
+    )
+else:
+    db_handler = UserDataHandler(**db_options)
+atexit.register(db_handler.close)
+
+# 前端輪詢用的使用者資料/摘要快取，寫入時由 db_handler 通知失效
+profile_cache = LRUCache(
+    maxsize=int(os.getenv('PROFILE_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('PROFILE_CACHE_TTL', '0'))
+)
+# 員工資料 + 目前資料的合併結果，員工資料匯入或使用者資料寫入時失效
+staff_profile_cache = LRUCache(
+    maxsize=int(os.getenv('PROFILE_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('PROFILE_CACHE_TTL', '0'))
+)
+
+def invalidate_user(user_id):
+    profile_cache.invalidate(user_id)
+    staff_profile_cache.invalidate(user_id)
+
+db_handler.add_write_listener(lambda user_id, changed_fields: invalidate_user(user_id))
+
+# SSE 變更推送：commit 後喚醒該使用者的連線；SSE_POLL_INTERVAL 秒沒有通知時也會查一次變更紀錄
+# (涵蓋其他 worker process 的寫入) 並送出 keepalive
+change_feed = ChangeFeed(buffer_size=int(os.getenv('SSE_BUFFER_SIZE', '64')))
+db_handler.add_change_listener(change_feed.publish)
+SSE_POLL_INTERVAL = float(os.getenv('SSE_POLL_INTERVAL', '5'))
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+# WRITE_BEHIND=1 時 LLM 回調寫入 journal 後即回應，背景合併同一使用者的更新再批次寫入
+write_queue = None
+if os.getenv('WRITE_BEHIND', '0') == '1':
+    write_queue = WriteBehindQueue(
+        db_handler,
+        journal_dir=os.getenv('WRITE_BEHIND_DIR', 'write_behind_journal'),
+        max_batch=int(os.getenv('WRITE_BEHIND_MAX_BATCH', '500')),
+        flush_interval=float(os.getenv('WRITE_BEHIND_INTERVAL_MS', '1000')) / 1000,
+        fsync=os.getenv('WRITE_BEHIND_FSYNC', '0') == '1',
+        max_attempts=int(os.getenv('WRITE_BEHIND_MAX_ATTEMPTS', '5')),
+        logger=logger
+    )
+    # atexit 後註冊的先執行：關閉資料庫前先寫完佇列
+    atexit.register(write_queue.close)
+
+# 歷史紀錄保留天數；> 0 時每 HISTORY_COMPACT_INTERVAL 秒把更舊的紀錄壓縮成每日 / 每月彙總
+HISTORY_RETENTION_DAYS = int(os.getenv('HISTORY_RETENTION_DAYS', '0'))
+HISTORY_DAY_RETENTION_DAYS = int(os.getenv('HISTORY_DAY_RETENTION_DAYS', '400'))
+HISTORY_COMPACT_BATCH = int(os.getenv('HISTORY_COMPACT_BATCH', '1000'))
+HISTORY_COMPACT_MAX_BATCHES = 100
+CHANGE_LOG_RETENTION_DAYS = int(os.getenv('CHANGE_LOG_RETENTION_DAYS', '7'))
+history_compactor = None
+if HISTORY_RETENTION_DAYS > 0:
+    history_compactor = HistoryCompactor(
+        db_handler,
+        interval=float(os.getenv('HISTORY_COMPACT_INTERVAL', '3600')),
+        logger=logger,
+        retention_days=HISTORY_RETENTION_DAYS,
+        day_retention_days=HISTORY_DAY_RETENTION_DAYS,
+        batch_size=HISTORY_COMPACT_BATCH,
+        max_batches=HISTORY_COMPACT_MAX_BATCHES,
+        change_retention_days=CHANGE_LOG_RETENTION_DAYS
+    ).start()
+    atexit.register(history_compactor.stop)
+
+# 員工資料來源 (db.js 建立的 company.db)；每 STAFF_SYNC_INTERVAL 秒檢查是否有變，0 表示不自動匯入
+STAFF_DB_PATH = os.getenv('STAFF_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'company.db'))
+STAFF_SYNC_INTERVAL = float(os.getenv('STAFF_SYNC_INTERVAL', '60'))
+staff_sync = StaffSync(db_handler, STAFF_DB_PATH, interval=STAFF_SYNC_INTERVAL, logger=logger)
+if STAFF_SYNC_INTERVAL > 0:
+    staff_sync.start()
+    atexit.register(staff_sync.stop)
+
+# 批次接口的上限
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '10000'))
+BATCH_CHUNK_SIZE = int(os.getenv('BATCH_CHUNK_SIZE', '500'))
+BULK_MAX_IDS = int(os.getenv('BULK_MAX_IDS', '1000'))
+AGGREGATE_MAX_UPCOMING = 50
+# 日期範圍查詢：可查詢的欄位與上限
+DATE_DATA_TYPES = sorted(data_type for data_type, unit, _ in DATA_MAPPING.values() if unit == DATE_UNIT)
+UPCOMING_MAX_DAYS = 366
+UPCOMING_MAX_LIMIT = int(os.getenv('UPCOMING_MAX_LIMIT', '10000'))
+LEAVE_HISTORY_MAX_LIMIT = 500
+EXPORT_PAGE_SIZE = int(os.getenv('EXPORT_PAGE_SIZE', '1000'))
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+RAG_MAX_K = 50
+RAG_BATCH_MAX_QUERIES = int(os.getenv('RAG_BATCH_MAX_QUERIES', '100'))
+
+# 福利文件的本機檢索 (第一次查詢時載入索引；RAG_WATCH_INTERVAL > 0 時監看文件變動並增量重建)
+rag_service = RagService(
+    corpus_dir=os.getenv('RAG_CORPUS_DIR', DEFAULT_CORPUS_DIR),
+    index_dir=os.getenv('RAG_INDEX_DIR', DEFAULT_INDEX_DIR),
+    watch_interval=float(os.getenv('RAG_WATCH_INTERVAL', '0')),
+    logger=logger
+)
+atexit.register(rag_service.close)
+
+# grounding context 的候選段落快取，key 含語料版本，重建索引後舊項目自然淘汰
+rag_context_cache = LRUCache(maxsize=int(os.getenv('RAG_CONTEXT_CACHE_SIZE', '512')))
+RAG_CONTEXT_CANDIDATES = 20
+RAG_CONTEXT_DEFAULT_TOKENS = 1000
+RAG_CONTEXT_MAX_TOKENS = int(os.getenv('RAG_CONTEXT_MAX_TOKENS', '8000'))
+
+# 執行方式，顯示在 /health；main.py 以 ASGI 啟動時會更新
+SERVER_INFO = {'server': 'flask'}
+
+# 超過這個時間 (毫秒) 的請求會記錄最慢的 SQL 與其 EXPLAIN QUERY PLAN
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '500'))
+SLOW_REQUEST_QUERIES = 3
+EXPLAIN_VERBS = ('select', 'insert', 'upsert', 'update', 'delete', 'with')
+
+
+# === Metrics ===
+registry.describe('http_requests_total', 'HTTP requests by method, route and status')
+registry.describe('http_request_duration_seconds', 'HTTP request latency by method and route')
+registry.describe('db_query_duration_seconds', 'SQL statement latency by query name')
+registry.describe('slow_requests_total', 'Requests slower than SLOW_REQUEST_MS')
+registry.describe('export_rows_total', 'Rows streamed by the export endpoint')
+registry.describe('write_behind_submitted_total', 'Callbacks accepted into the write-behind queue')
+registry.describe('write_behind_coalesced_total', 'Queued fields overwritten by a newer value before flushing')
+registry.describe('write_behind_flushes_total', 'Write-behind flushes by trigger and status')
+registry.describe('write_behind_flush_duration_seconds', 'Write-behind flush transaction latency by trigger')
+registry.describe('write_behind_item_failures_total', 'Queued users whose write failed during a flush')
+registry.describe('write_behind_dead_lettered_total', 'Queued users moved to the dead letter file after max attempts')
+
+
+def collect_db_metrics():
+    stats = db_handler.pool.stats()
+    for state in ('open', 'idle', 'in_use'):
+        yield 'db_connections', 'gauge', 'Pooled SQLite connections by state', {'state': state}, stats[state]
+    yield ('db_connections_created_total', 'counter', 'SQLite connections opened', {},
+           stats['connections_created'])
+    yield ('db_connection_acquires_total', 'counter', 'Connections borrowed from the pool', {},
+           stats['acquired'])
+    for outcome, key in (('commit', 'commits'), ('rollback', 'rollbacks')):
+        yield 'db_transactions_total', 'counter', 'Outer transactions by outcome', {'outcome': outcome}, stats[key]
+    for outcome, key in (('release', 'savepoints'), ('rollback', 'savepoint_rollbacks')):
+        value = stats[key] - stats['savepoint_rollbacks'] if outcome == 'release' else stats[key]
+        yield 'db_savepoints_total', 'counter', 'Nested transactions by outcome', {'outcome': outcome}, value
+
+
+def collect_cache_metrics():
+    caches = {'profile': profile_cache, 'staff_profile': staff_profile_cache, 'rag_context': rag_context_cache}
+    for name, cache in caches.items():
+        stats = cache.stats()
+        labels = {'cache': name}
+        yield 'cache_hits_total', 'counter', 'Cache hits', labels, stats['hits']
+        yield 'cache_misses_total', 'counter', 'Cache misses', labels, stats['misses']
+        yield 'cache_evictions_total', 'counter', 'Entries evicted by size', labels, stats['evictions']
+        yield 'cache_invalidations_total', 'counter', 'Entries invalidated by writes', labels, stats['invalidations']
+        yield 'cache_hit_ratio', 'gauge', 'Hits / (hits + misses) since start', labels, stats['hit_ratio']
+        yield 'cache_entries', 'gauge', 'Entries currently cached', labels, stats['size']
+    rag = rag_service.stats()
+    yield 'rag_index_chunks', 'gauge', 'Chunks in the loaded benefits index', {}, rag['chunks']
+
+
+def collect_write_behind_metrics():
+    if write_queue is None:
+        return
+    stats = write_queue.stats()
+    yield 'write_behind_pending_rows', 'gauge', 'Fields waiting in the write-behind queue', {}, stats['pending_rows']
+    yield 'write_behind_pending_users', 'gauge', 'Users with queued writes', {}, stats['pending_users']
+    yield ('write_behind_oldest_pending_seconds', 'gauge', 'Age of the oldest queued write', {},
+           stats['oldest_pending_seconds'])
+
+
+def collect_change_feed_metrics():
+    stats = change_feed.stats()
+    yield 'sse_subscribers', 'gauge', 'Open change-feed (SSE) connections', {}, stats['subscribers']
+    yield ('sse_buffer_overflows_total', 'counter',
+           'Subscriber buffers that overflowed and caught up from SQLite', {}, stats['overflows'])
+
+
+registry.add_collector(collect_db_metrics)
+registry.add_collector(collect_change_feed_metrics)
+registry.add_collector(collect_cache_metrics)
+registry.add_collector(collect_write_behind_metrics)
+
+
+def compact_sql(sql, limit=300):
+    sql = ' '.join(sql.split())
+    return sql if len(sql) <= limit else sql[:limit] + '...'
+
+
+def log_slow_request(method, route, elapsed_ms, trace):
+    """記錄慢請求與其中最慢的幾個 SQL (不含參數值)，並附上 EXPLAIN QUERY PLAN"""
+    registry.inc('slow_requests_total', {'method': method, 'route': route})
+    lines = [
+        f"Slow request {method} {route}: {elapsed_ms:.1f} ms "
+        f"({trace.query_count} queries, {trace.query_seconds * 1000:.1f} ms in SQL)"
+    ]
+    for sql, params, seconds in trace.slowest(SLOW_REQUEST_QUERIES):
+        name = sql_query_name(sql)
+        lines.append(f"  {seconds * 1000:8.2f} ms  {name}: {compact_sql(sql)}")
+        if name.split(':')[0] in EXPLAIN_VERBS:
+            try:
+                for detail in db_handler.explain(sql, params):
+                    lines.append(f"              plan: {detail}")
+            except Exception as e:
+                lines.append(f"              plan unavailable: {e}")
+    logger.warning('\n'.join(lines))
+
+
+def record_request(method, route, status, elapsed_seconds, trace):
+    route = normalize_route(route)
+    registry.inc('http_requests_total', {'method': method, 'route': route, 'status': status})
+    registry.observe('http_request_duration_seconds', {'method': method, 'route': route}, elapsed_seconds)
+    if trace is not None and elapsed_seconds * 1000 >= SLOW_REQUEST_MS:
+        log_slow_request(method, route, elapsed_seconds * 1000, trace)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.trace, g.trace_token = start_trace()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        trace = g.get('trace')
+        record_request(request.method, route, response.status_code, elapsed, trace)
+        response.headers['Server-Timing'] = (
+            f'db;dur={trace.query_seconds * 1000:.2f}, total;dur={elapsed * 1000:.2f}'
+        )
+    return response
+
+@app.teardown_request
+def end_request_trace(error=None):
+    token = g.pop('trace_token', None)
+    if token is not None:
+        end_trace(token)
+
+
+def build_summary(user_data, last_updated):
+    """建立前端友善的摘要格式"""
+    return {
+        'work_status': {
+            'leave_days': user_data.get('leave', {}).get('value', 0),
+            'overtime_hours': user_data.get('overtime', {}).get('value', 0),
+            'next_bonus_date': user_data.get('bonus', {}).get('value', '')
+        },
+        'financial': {
+            'salary': user_data.get('salary', {}).get('value', 0),
+            'meal_allowance': user_data.get('meal', {}).get('value', 0)
+        },
+        'last_updated': last_updated
+    }
+
+
+def build_profile_entry(user_data):
+    """把查詢結果整理成快取項目：完整資料、摘要與最後更新時間"""
+    last_updated = max(
+        info.get('updated_at', '') for info in user_data.values()
+    ) if user_data else ''
+    return {
+        'data': user_data,
+        'summary': build_summary(user_data, last_updated) if user_data else {},
+        'last_updated': last_updated
+    }
+
+
+def get_profile_entry(user_id):
+    return profile_cache.get_or_load(
+        user_id, lambda: build_profile_entry(db_handler.get_user_data(user_id))
+    )
+
+
+def build_staff_profile_entry(profile):
+    """員工資料 + 目前資料的快取項目；last_updated 取兩者中較新的時間"""
+    entry = build_profile_entry(profile['data'])
+    entry['staff'] = profile['staff']
+    if profile['staff']:
+        entry['last_updated'] = max(entry['last_updated'], profile['staff']['synced_at'])
+    return entry
+
+
+def get_staff_profile_entry(user_id):
+    return staff_profile_cache.get_or_load(
+        user_id, lambda: build_staff_profile_entry(db_handler.get_profile(user_id))
+    )
+
+
+def get_profile_entries(user_ids):
+    def load(missing):
+        users_data = db_handler.get_users_data(missing)
+        return {uid: build_profile_entry(users_data.get(uid, {})) for uid in missing}
+    return profile_cache.get_many_or_load(user_ids, load)
+
+
+def parse_ids(raw_values):
+    """解析 ?ids=a,b,c (也接受重複的 ids 參數)"""
+    ids = []
+    for raw in raw_values:
+        ids.extend(part.strip() for part in raw.split(',') if part.strip())
+    return list(dict.fromkeys(ids))
+
+
+def parse_ids_arg():
+    return parse_ids(request.args.getlist('ids'))
+
+
+def profile_etag(user_id, last_updated, variant):
+    return hashlib.sha1(f'{user_id}|{last_updated}|{variant}'.encode('utf-8')).hexdigest()
+
+
+def conditional_response(payload, user_id, last_updated, variant):
+    """
+    依最後更新時間加上 ETag / Last-Modified
+    客戶端帶 If-None-Match 或 If-Modified-Since 且資料未變時回傳 304
+    """
+    response = jsonify(payload)
+    if last_updated:
+        response.set_etag(profile_etag(user_id, last_updated, variant), weak=True)
+        try:
+            response.last_modified = datetime.fromisoformat(last_updated).astimezone()
+        except ValueError:
+            pass
+        response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+def ingest_callback(user_id, extracted_data):
+    """
+    寫入一筆 LLM 回調，回傳 (回應內容, 狀態碼)
+    write-behind 模式只寫入佇列 (202)，current_data 已包含佇列中尚未寫入的值
+    """
+    if write_queue is None:
+        result = db_handler.ingest_backend_data(user_id, extracted_data)
+        return {
+            'message': 'Data updated successfully',
+            'updated_count': result['updated_count'],
+            'changed_fields': result['changed_fields'],
+            'current_data': result['current_data']
+        }, 200
+    ack = write_queue.submit(user_id, extracted_data)
+    invalidate_user(user_id)
+    return {
+        'message': 'Data queued',
+        'queued': True,
+        'updated_count': ack['updated_count'],
+        'queued_fields': ack['queued_fields'],
+        'current_data': db_handler.get_user_data(user_id)
+    }, 202
+
+def ingest_callback_batch(items, chunk_size):
+    """批次版：write-behind 模式逐筆放進佇列，每筆各自回報驗證結果"""
+    if write_queue is None:
+        return db_handler.ingest_backend_batch(items, chunk_size=chunk_size)
+    results = []
+    for index, item in enumerate(items):
+        user_id = item.get('user_id') if isinstance(item, dict) else None
+        try:
+            ack = write_queue.submit(user_id, item.get('extracted_data') if isinstance(item, dict) else None)
+        except ValueError as e:
+            results.append({'index': index, 'user_id': user_id, 'success': False, 'error': str(e)})
+            continue
+        invalidate_user(user_id)
+        results.append({
+            'index': index,
+            'user_id': user_id,
+            'success': True,
+            'queued': True,
+            'updated_count': ack['updated_count'],
+            'queued_fields': ack['queued_fields']
+        })
+    return results
+
+def flush_pending_writes():
+    """直接修改資料的操作 (例如扣除特休) 之前先寫完佇列，避免之後被較舊的佇列值覆蓋"""
+    if write_queue is not None:
+        write_queue.flush('write')
 
 @app.route('/api/llm/callback', methods=['POST'])
 def llm_callback():
@@ -20,9 +433,9 @@ def llm_callback():
     LLM 分析完對話後，會把提取的使用者資料發送到這裡
     """
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
         
-        if not data or 'user_id' not in data or 'extracted_data' not in data:
+        if not isinstance(data, dict) or 'user_id' not in data or 'extracted_data' not in data:
             return jsonify({
                 'success': False,
                 'error': 'Invalid data format. Required: user_id, extracted_data'
@@ -31,26 +444,27 @@ def llm_callback():
         user_id = data['user_id']
         extracted_data = data['extracted_data']
         
-        logger.info(f"LLM callback - User: {user_id}, Data: {extracted_data}")
+        logger.debug(f"LLM callback - User: {user_id}, Data: {extracted_data}")
         
-        # 儲存資料到資料庫
-        updated_count = db_handler.process_backend_data(user_id, extracted_data)
-        
-        # 獲取更新後的完整資料
-        user_data = db_handler.get_user_data(user_id)
+        # 單一交易內寫入資料並取回更新後的完整資料 (write-behind 模式則放進佇列)
+        result, status = ingest_callback(user_id, extracted_data)
+        updated_count = result['updated_count']
         
         response = {
             'success': True,
-            'message': f'Data updated successfully',
             'user_id': user_id,
-            'updated_count': updated_count,
-            'current_data': user_data,
+            **result,
             'timestamp': datetime.now().isoformat()
         }
         
-        logger.info(f"LLM callback success - Updated {updated_count} records for {user_id}")
-        return jsonify(response)
+        logger.info(f"LLM callback success - {result['message']}: {updated_count} records for {user_id}")
+        return jsonify(response), status
         
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         logger.error(f"LLM callback error: {e}")
         return jsonify({
@@ -59,6 +473,56 @@ def llm_callback():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+@app.route('/api/llm/callback/batch', methods=['POST'])
+def llm_callback_batch():
+    """
+    批次版 LLM 回調接口，一次送入多位使用者的資料
+    每筆資料各自回報成功或錯誤，單筆錯誤不會讓整批失敗
+    """
+    try:
+        data = request.get_json(silent=True)
+        items = data.get('items') if isinstance(data, dict) else None
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid data format. Required: items (list of {user_id, extracted_data})'
+            }), 400
+        
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({
+                'success': False,
+                'error': f'Too many items (max {BATCH_MAX_ITEMS})'
+            }), 400
+        
+        chunk_size = data.get('chunk_size', BATCH_CHUNK_SIZE)
+        if not isinstance(chunk_size, int) or chunk_size <= 0:
+            return jsonify({
+                'success': False,
+                'error': 'chunk_size must be a positive integer'
+            }), 400
+        
+        results = ingest_callback_batch(items, chunk_size)
+        succeeded = sum(1 for result in results if result['success'])
+        
+        logger.info(f"LLM batch callback - {succeeded}/{len(results)} items succeeded")
+        return jsonify({
+            'success': True,
+            'total': len(results),
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': results,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"LLM batch callback error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
 # === 請假記錄接口 ===
 @app.route('/api/leave/record', methods=['POST'])
 def record_leave():
@@ -67,7 +531,12 @@ def record_leave():
     前端會把已經確認的請假資料發送過來，我們只需要記錄即可
     """
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({
+                'success': False,
+                'error': 'Invalid JSON body'
+            }), 400
         
         # 檢查必要欄位
         required_fields = ['user_id', 'leave_type', 'start_date', 'end_date', 'days']
@@ -82,55 +551,49 @@ def record_leave():
         user_id = data['user_id']
         days_used = data['days']
         
-        # 驗證天數不能為負數
+        # 驗證天數是數字且不能為負數 (JSON 的 NaN / Infinity 也不接受)
+        if isinstance(days_used, bool) or not isinstance(days_used, (int, float)) or not math.isfinite(days_used):
+            return jsonify({
+                'success': False,
+                'error': 'Days must be a number'
+            }), 400
         if days_used < 0:
             return jsonify({
                 'success': False,
                 'error': 'Days cannot be negative'
             }), 400
         
-        logger.info(f"Recording leave for user {user_id}: {days_used} days, {data['start_date']} to {data['end_date']}")
+        # 日期必須是 YYYY-MM-DD，且開始日期不能晚於結束日期
+        try:
+            start_date, end_date = parse_date_range(data['start_date'], data['end_date'], required=True)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
         
-        current_data = db_handler.get_user_data(user_id, 'leave')
-        current_leave_days = current_data.get('value', 0) if current_data else 0
+        logger.debug(f"Recording leave for user {user_id}: {days_used} days, {start_date} to {end_date}")
         
-        # 根據請假類型決定是否扣除特休
+        # 請假紀錄與特休扣除在同一個交易內完成
         leave_type = data['leave_type']
-        updated_count = 0
+        flush_pending_writes()
+        leave_record = db_handler.record_leave(
+            user_id,
+            leave_type,
+            start_date,
+            end_date,
+            days_used,
+            reason=data.get('reason', ''),
+            approved_by=data.get('approved_by', 'system'),
+            approved_at=data.get('approved_at')
+        )
+        updated = leave_record.pop('database_updated')
         
         if leave_type == 'annual_leave':  # 只有特休假才扣除特休天數
-            # 扣除請假天數
-            new_leave_days = max(0, current_leave_days - days_used)
-            
-            # 更新資料庫中的特休天數
-            updated_count = db_handler.process_backend_data(user_id, {
-                'leave_days': new_leave_days
-            })
-            
-            logger.info(f"Annual leave deducted: {days_used} days from {user_id}, remaining: {new_leave_days}")
+            logger.info(f"Annual leave deducted: {days_used} days from {user_id}, remaining: {leave_record['remaining_leave_days']}")
         else:
-            # 其他假別不扣除特休，只記錄
-            new_leave_days = current_leave_days  # 不變動
             logger.info(f"Non-annual leave recorded: {leave_type} for {user_id}, {days_used} days")
         
-        # 準備請假記錄
-        leave_record = {
-            'user_id': user_id,
-            'leave_type': data['leave_type'],
-            'start_date': data['start_date'],
-            'end_date': data['end_date'], 
-            'days': days_used,
-            'reason': data.get('reason', ''),
-            'approved_by': data.get('approved_by', 'system'),
-            'approved_at': data.get('approved_at', datetime.now().isoformat()),
-            'recorded_at': datetime.now().isoformat(),
-            'previous_leave_days': current_leave_days,
-            'remaining_leave_days': new_leave_days
-        }
-        
-        # 記錄到日誌 (未來可以考慮建立 leave_history 表)
-        logger.info(f"Leave recorded: {json.dumps(leave_record, ensure_ascii=False)}")
-        
         return jsonify({
             'success': True,
             'message': 'Leave record saved successfully',
@@ -138,7 +601,7 @@ def record_leave():
             'leave_record': leave_record,
             'leave_type': leave_type,
             'annual_leave_deducted': leave_type == 'annual_leave',
-            'database_updated': updated_count > 0,
+            'database_updated': updated,
             'timestamp': datetime.now().isoformat()
         })
         
@@ -150,6 +613,64 @@ def record_leave():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+@app.route('/api/leave/history/<user_id>', methods=['GET'])
+def leave_history(user_id):
+    """
+    查詢使用者的請假紀錄 (依開始日期新到舊)
+    可選參數：start / end (開始日期區間, YYYY-MM-DD)、leave_type、limit、offset
+    """
+    try:
+        try:
+            limit = int(request.args.get('limit', 50))
+            offset = int(request.args.get('offset', 0))
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'limit and offset must be integers'
+            }), 400
+        
+        if not 1 <= limit <= LEAVE_HISTORY_MAX_LIMIT or offset < 0:
+            return jsonify({
+                'success': False,
+                'error': f'limit must be between 1 and {LEAVE_HISTORY_MAX_LIMIT}, offset must be >= 0'
+            }), 400
+        
+        try:
+            start, end = parse_date_range(request.args.get('start'), request.args.get('end'), names=('start', 'end'))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        history = db_handler.get_leave_history(
+            user_id,
+            start_date=start,
+            end_date=end,
+            leave_type=request.args.get('leave_type'),
+            limit=limit,
+            offset=offset
+        )
+        
+        return jsonify({
+            'success': True,
+            'user_id': user_id,
+            'records': history['records'],
+            'limit': limit,
+            'offset': offset,
+            'has_more': history['has_more'],
+            'next_offset': history['next_offset'],
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"Leave history query error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
 # === 前端查詢接口 ===
 @app.route('/api/frontend/users/<user_id>/data', methods=['GET'])
 def frontend_get_user_data(user_id):
@@ -168,10 +689,16 @@ def frontend_get_user_data(user_id):
         data_type = request.args.get('type')  # 可選：只查詢特定類型
         format_type = request.args.get('format', 'detailed')  # detailed 或 simple
         
-        logger.info(f"Frontend request - User: {user_id}, Type: {data_type}, Format: {format_type}")
+        logger.debug(f"Frontend request - User: {user_id}, Type: {data_type}, Format: {format_type}")
         
-        # 查詢資料
-        user_data = db_handler.get_user_data(user_id, data_type)
+        # 查詢資料：完整資料走快取，單一類型直接查詢
+        if data_type:
+            user_data = db_handler.get_user_data(user_id, data_type)
+            last_updated = user_data.get('updated_at', '')
+        else:
+            entry = get_profile_entry(user_id)
+            user_data = entry['data']
+            last_updated = entry['last_updated']
         
         if not user_data:
             return jsonify({
@@ -190,13 +717,13 @@ def frontend_get_user_data(user_id):
                 simple_data[key] = info['value']
             user_data = simple_data
         
-        return jsonify({
+        return conditional_response({
             'success': True,
             'user_id': user_id,
             'data': user_data,
             'format': format_type,
             'timestamp': datetime.now().isoformat()
-        })
+        }, user_id, last_updated, f'data|{data_type}|{format_type}')
         
     except Exception as e:
         logger.error(f"Frontend query error: {e}")
@@ -212,73 +739,884 @@ def frontend_get_user_summary(user_id):
     給前端的聚合資料接口，返回格式化的摘要資訊
     """
     try:
-        user_data = db_handler.get_user_data(user_id)
+        entry = get_profile_entry(user_id)
         
-        if not user_data:
+        if not entry['data']:
             return jsonify({
                 'success': False,
                 'message': 'No data found',
                 'summary': {}
             }), 404
         
-        # 建立前端友善的摘要格式
-        summary = {
-            'work_status': {
-                'leave_days': user_data.get('leave', {}).get('value', 0),
-                'overtime_hours': user_data.get('overtime', {}).get('value', 0),
-                'next_bonus_date': user_data.get('bonus', {}).get('value', '')
-            },
-            'financial': {
-                'salary': user_data.get('salary', {}).get('value', 0),
-                'meal_allowance': user_data.get('meal', {}).get('value', 0)
-            },
-            'last_updated': max([
-                info.get('updated_at', '') for info in user_data.values()
-            ]) if user_data else ''
-        }
+        return conditional_response({
+            'success': True,
+            'user_id': user_id,
+            'summary': entry['summary'],
+            'timestamp': datetime.now().isoformat()
+        }, user_id, entry['last_updated'], 'summary')
         
+    except Exception as e:
+        logger.error(f"Summary query error: {e}")
         return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/frontend/users/<user_id>/profile', methods=['GET'])
+def frontend_get_user_profile(user_id):
+    """
+    員工資料 (姓名、部門、主管、到職日、預先計算的年資) 與目前的資料值一次回傳
+    給聊天介面組合員工相關的 prompt
+    """
+    try:
+        entry = get_staff_profile_entry(user_id)
+        
+        if not entry['staff'] and not entry['data']:
+            return jsonify({
+                'success': False,
+                'message': 'No staff record or data found for this user',
+                'user_id': user_id
+            }), 404
+        
+        return conditional_response({
             'success': True,
             'user_id': user_id,
-            'summary': summary,
+            'staff': entry['staff'],
+            'data': entry['data'],
+            'summary': entry['summary'],
+            'timestamp': datetime.now().isoformat()
+        }, user_id, entry['last_updated'], 'profile')
+        
+    except Exception as e:
+        logger.error(f"Profile query error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/staff/sync', methods=['POST'])
+def sync_staff():
+    """立即從 company.db 重新匯入員工資料 (例如 db.js 更新員工後)"""
+    try:
+        report = staff_sync.sync(force=True)
+        return jsonify({
+            'success': True,
+            'report': report,
+            'timestamp': datetime.now().isoformat()
+        })
+    except FileNotFoundError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404
+    except Exception as e:
+        logger.error(f"Staff sync error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/frontend/users/<user_id>/events', methods=['GET'])
+def frontend_user_events(user_id):
+    """
+    使用者資料變更的 Server-Sent Events 串流，取代輪詢 /data 與 /summary
+    首次連線送 snapshot (完整資料)，之後只送有變動的欄位 (change)；
+    重新連線時瀏覽器會自動帶 Last-Event-ID，只補送斷線期間的變更 (也可用 ?last_event_id=)
+    """
+    last_event_id = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    wakeup = threading.Event()
+    stream = UserEventStream(db_handler, change_feed, user_id, last_event_id, wakeup.set)
+    try:
+        first = stream.open()
+    except Exception as e:
+        stream.close()
+        logger.error(f"Event stream error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+    
+    def generate():
+        try:
+            yield from first
+            while True:
+                timed_out = not wakeup.wait(SSE_POLL_INTERVAL)
+                wakeup.clear()
+                yield from stream.poll(timed_out)
+        finally:
+            # 用戶端斷線時 (寫入失敗) 取消訂閱
+            stream.close()
+    
+    return Response(generate(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@app.route('/api/frontend/users/<user_id>/trend', methods=['GET'])
+def frontend_get_user_trend(user_id):
+    """
+    某個欄位依日 / 月的變化趨勢，例如每月加班時數
+    參數：data_type (必填)、period (day / month，預設 month)、from / to (bucket，含)
+    """
+    try:
+        data_type = request.args.get('data_type')
+        period = request.args.get('period', 'month')
+        if not data_type:
+            return jsonify({
+                'success': False,
+                'error': 'data_type is required'
+            }), 400
+        if period not in ROLLUP_PERIODS:
+            return jsonify({
+                'success': False,
+                'error': f'period must be one of: {", ".join(ROLLUP_PERIODS)}'
+            }), 400
+        
+        trend = db_handler.get_trend(
+            user_id, data_type, period,
+            start=request.args.get('from'),
+            end=request.args.get('to')
+        )
+        
+        return jsonify({
+            'success': True,
+            'user_id': user_id,
+            'data_type': data_type,
+            'period': period,
+            'buckets': trend,
             'timestamp': datetime.now().isoformat()
         })
         
     except Exception as e:
-        logger.error(f"Summary query error: {e}")
+        logger.error(f"Trend query error: {e}")
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
-# === 健康檢查 ===
-@app.route('/health', methods=['GET'])
-def health_check():
-    """健康檢查端點"""
+# === 多使用者查詢接口 ===
+def bulk_ids_or_error():
+    user_ids = parse_ids_arg()
+    if not user_ids:
+        return None, (jsonify({
+            'success': False,
+            'error': 'Query parameter ids is required, e.g. ?ids=user001,user002'
+        }), 400)
+    if len(user_ids) > BULK_MAX_IDS:
+        return None, (jsonify({
+            'success': False,
+            'error': f'Too many ids (max {BULK_MAX_IDS})'
+        }), 400)
+    return user_ids, None
+
+@app.route('/api/frontend/users/data', methods=['GET'])
+def frontend_get_users_data():
+    """
+    一次查詢多位使用者的資料：?ids=user001,user002
+    未命中快取的使用者以單一 IN 查詢取得
+    """
+    try:
+        user_ids, error = bulk_ids_or_error()
+        if error:
+            return error
+        
+        format_type = request.args.get('format', 'detailed')
+        entries = get_profile_entries(user_ids)
+        
+        data = {}
+        for user_id in user_ids:
+            user_data = entries[user_id]['data']
+            if not user_data:
+                continue
+            if format_type == 'simple':
+                user_data = {key: info['value'] for key, info in user_data.items()}
+            data[user_id] = user_data
+        
+        return jsonify({
+            'success': True,
+            'data': data,
+            'missing': [user_id for user_id in user_ids if user_id not in data],
+            'format': format_type,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"Bulk frontend query error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+@app.route('/api/frontend/users/summary', methods=['GET'])
+def frontend_get_users_summary():
+    """一次查詢多位使用者的摘要：?ids=user001,user002"""
+    try:
+        user_ids, error = bulk_ids_or_error()
+        if error:
+            return error
+        
+        entries = get_profile_entries(user_ids)
+        summaries = {
+            user_id: entries[user_id]['summary']
+            for user_id in user_ids if entries[user_id]['data']
+        }
+        
+        return jsonify({
+            'success': True,
+            'summaries': summaries,
+            'missing': [user_id for user_id in user_ids if user_id not in summaries],
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"Bulk summary query error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+# === 資料匯出接口 ===
+def parse_export_time(value):
+    """接受 YYYY-MM-DD 或 ISO datetime，轉成資料庫中 updated_at 的格式 (以空白分隔日期與時間)"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if len(value) == 10:
+        return parsed.date().isoformat()
+    return parsed.isoformat(sep=' ')
+
+def export_records(rows, table, fmt):
+    """把資料列轉成 NDJSON 行或 CSV 區塊；每 EXPORT_PAGE_SIZE 筆輸出一次，避免每行一個 chunk"""
+    count = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(EXPORT_COLUMNS + ('cursor',))
+    try:
+        for row in rows:
+            cursor = encode_export_cursor(row['updated_at'], row['id'])
+            if writer:
+                writer.writerow([row[column] for column in EXPORT_COLUMNS] + [cursor])
+            else:
+                buffer.write(json.dumps(dict(row, cursor=cursor), ensure_ascii=False))
+                buffer.write('\n')
+            count += 1
+            if count % EXPORT_PAGE_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        registry.inc('export_rows_total', {'table': table, 'format': fmt}, count)
+
+@app.route('/api/export/user_data', methods=['GET'])
+def export_user_data():
+    """
+    串流匯出使用者資料
+    參數：format (ndjson 預設 | csv)、table (current 預設：目前值 | history：歷史紀錄)、
+    data_type (可逗號分隔多個)、updated_from (含)、updated_to (不含)、cursor (續傳)、limit
+    依 (updated_at, id) 排序；每一列都帶 cursor，中斷後以最後收到的 cursor 續傳
+    """
+    fmt = request.args.get('format', 'ndjson')
+    table = request.args.get('table', 'current')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({
+            'success': False,
+            'error': f"format must be one of: {', '.join(EXPORT_FORMATS)}"
+        }), 400
+    if table not in EXPORT_TABLES:
+        return jsonify({
+            'success': False,
+            'error': f"table must be one of: {', '.join(EXPORT_TABLES)}"
+        }), 400
+    
+    data_types = parse_ids(request.args.getlist('data_type'))
+    valid_types = {data_type for data_type, _, _ in DATA_MAPPING.values()}
+    unknown = [data_type for data_type in data_types if data_type not in valid_types]
+    if unknown:
+        return jsonify({
+            'success': False,
+            'error': f"Unknown data_type: {', '.join(unknown)}"
+        }), 400
+    
+    try:
+        updated_from = parse_export_time(request.args.get('updated_from'))
+        updated_to = parse_export_time(request.args.get('updated_to'))
+        cursor = request.args.get('cursor') or None
+        if cursor:
+            decode_export_cursor(cursor)
+        limit = request.args.get('limit')
+        limit = int(limit) if limit else None
+        if limit is not None and limit < 1:
+            raise ValueError('limit must be a positive integer')
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    rows = db_handler.iter_export(
+        table=table,
+        updated_from=updated_from,
+        updated_to=updated_to,
+        data_types=data_types or None,
+        cursor=cursor,
+        page_size=min(EXPORT_PAGE_SIZE, limit) if limit else EXPORT_PAGE_SIZE
+    )
+    if limit:
+        rows = (row for _, row in zip(range(limit), rows))
+    
+    filename = f"user_data_{table}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{fmt}"
+    return Response(
+        stream_with_context(export_records(rows, table, fmt)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+# === 福利文件檢索接口 ===
+def rag_options(source):
+    """解析 k / mode / alpha，回傳 (k, mode, alpha, error)"""
+    try:
+        k = int(source.get('k', 5))
+    except (TypeError, ValueError):
+        k = 0
+    if not 1 <= k <= RAG_MAX_K:
+        return None, None, None, f'k must be an integer between 1 and {RAG_MAX_K}'
+    
+    mode = source.get('mode', 'bm25')
+    if mode not in SEARCH_MODES:
+        return None, None, None, f"mode must be one of: {', '.join(SEARCH_MODES)}"
+    
+    try:
+        alpha = float(source.get('alpha', 0.5))
+    except (TypeError, ValueError):
+        alpha = -1
+    if not 0 <= alpha <= 1:
+        return None, None, None, 'alpha must be a number between 0 and 1'
+    
+    return k, mode, alpha, None
+
+@app.route('/api/rag/search', methods=['GET'])
+def search_benefits():
+    """
+    檢索 RAG/tsmc_benefits 文件
+    參數：q (查詢字串，必填)、k (回傳筆數，預設 5)、
+    mode (bm25 / vector / hybrid，預設 bm25)、alpha (hybrid 的向量權重，預設 0.5)
+    """
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({
+                'success': False,
+                'error': 'Query parameter q is required'
+            }), 400
+        
+        k, mode, alpha, error = rag_options(request.args)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        
+        snapshot = rag_service.snapshot
+        started = time.perf_counter()
+        results = rag_service.search_many([query], k, mode, alpha, snapshot)[0]
+        took_ms = (time.perf_counter() - started) * 1000
+        
+        return jsonify({
+            'success': True,
+            'query': query,
+            'k': k,
+            'mode': mode,
+            'results': results,
+            'took_ms': round(took_ms, 3),
+            'corpus_version': snapshot.corpus_version,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"RAG search error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+@app.route('/api/rag/search/batch', methods=['POST'])
+def search_benefits_batch():
+    """
+    一次檢索多個查詢
+    Body: {"queries": ["...", "..."], "k": 5, "mode": "vector", "alpha": 0.5}
+    vector / hybrid 模式會把所有查詢合併成一次矩陣運算
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        queries = data.get('queries')
+        if not isinstance(queries, list) or not queries:
+            return jsonify({
+                'success': False,
+                'error': 'queries must be a non-empty list'
+            }), 400
+        if len(queries) > RAG_BATCH_MAX_QUERIES:
+            return jsonify({
+                'success': False,
+                'error': f'Too many queries (max {RAG_BATCH_MAX_QUERIES})'
+            }), 400
+        if not all(isinstance(query, str) and query.strip() for query in queries):
+            return jsonify({
+                'success': False,
+                'error': 'Each query must be a non-empty string'
+            }), 400
+        queries = [query.strip() for query in queries]
+        
+        k, mode, alpha, error = rag_options(data)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        
+        snapshot = rag_service.snapshot
+        started = time.perf_counter()
+        results = rag_service.search_many(queries, k, mode, alpha, snapshot)
+        took_ms = (time.perf_counter() - started) * 1000
+        
+        return jsonify({
+            'success': True,
+            'k': k,
+            'mode': mode,
+            'results': [
+                {'query': query, 'results': hits}
+                for query, hits in zip(queries, results)
+            ],
+            'took_ms': round(took_ms, 3),
+            'corpus_version': snapshot.corpus_version,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"RAG batch search error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+@app.route('/api/rag/context', methods=['POST'])
+def rag_context():
+    """
+    組出給 LLM 的 grounding context
+    Body: {"query": "特休有幾天", "max_tokens": 1000, "user_id": "user001",
+           "include_profile": true, "mode": "hybrid", "alpha": 0.5}
+    user_id 有值時預設附上該使用者的資料 (include_profile=false 可關閉)
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        query = data.get('query')
+        if not isinstance(query, str) or not normalize_query(query):
+            return jsonify({
+                'success': False,
+                'error': 'query is required'
+            }), 400
+        
+        try:
+            max_tokens = int(data.get('max_tokens', RAG_CONTEXT_DEFAULT_TOKENS))
+        except (TypeError, ValueError):
+            max_tokens = 0
+        if not 1 <= max_tokens <= RAG_CONTEXT_MAX_TOKENS:
+            return jsonify({
+                'success': False,
+                'error': f'max_tokens must be an integer between 1 and {RAG_CONTEXT_MAX_TOKENS}'
+            }), 400
+        
+        _, mode, alpha, error = rag_options(dict(data, mode=data.get('mode', 'hybrid'), k=RAG_CONTEXT_CANDIDATES))
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        
+        user_id = data.get('user_id')
+        include_profile = bool(user_id) and bool(data.get('include_profile', True))
+        
+        started = time.perf_counter()
+        snapshot = rag_service.snapshot
+        normalized = normalize_query(query)
+        key = (normalized, snapshot.corpus_version, mode, alpha if mode == 'hybrid' else None)
+        candidates = rag_context_cache.get(key)
+        cache_hit = candidates is not None
+        if not cache_hit:
+            results = rag_service.search_many([normalized], RAG_CONTEXT_CANDIDATES, mode, alpha, snapshot)[0]
+            candidates = build_candidates(results)
+            rag_context_cache.set(key, candidates)
+        
+        profile_block = None
+        if include_profile:
+            user_data = get_profile_entry(user_id)['data']
+            if user_data:
+                profile_block = format_profile(user_id, user_data)
+        
+        packed = pack_context(candidates, max_tokens, profile_block)
+        took_ms = (time.perf_counter() - started) * 1000
+        
+        return jsonify({
+            'success': True,
+            'query': query,
+            'normalized_query': normalized,
+            'context': packed['context'],
+            'chunks': packed['chunks'],
+            'tokens': packed['tokens'],
+            'max_tokens': max_tokens,
+            'truncated': packed['truncated'],
+            'profile_included': profile_block is not None,
+            'cache': 'hit' if cache_hit else 'miss',
+            'corpus_version': snapshot.corpus_version,
+            'took_ms': round(took_ms, 3),
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"RAG context error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+@app.route('/api/rag/reindex', methods=['POST'])
+def reindex_benefits():
+    """
+    增量重建福利文件索引：只重新切塊、斷詞有變動的文件，完成後替換使用中的索引
+    Body (選填): {"force": true} 整份重建
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        report = rag_service.reindex(force=bool(data.get('force', False)))
+        
+        return jsonify({
+            'success': True,
+            'report': report,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"RAG reindex error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+# === 歷史紀錄維護 ===
+@app.route('/api/history/compact', methods=['POST'])
+def compact_history():
+    """
+    立即壓縮超過保留期限的歷史紀錄 (排程未啟用時可由 cron 呼叫)
+    Body (選填): {"retention_days": 90, "max_batches": 100}
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        retention_days = data.get('retention_days', HISTORY_RETENTION_DAYS or 90)
+        max_batches = data.get('max_batches', HISTORY_COMPACT_MAX_BATCHES)
+        if not isinstance(retention_days, int) or retention_days < 1:
+            return jsonify({
+                'success': False,
+                'error': 'retention_days must be a positive integer'
+            }), 400
+        if max_batches is not None and (not isinstance(max_batches, int) or max_batches < 1):
+            return jsonify({
+                'success': False,
+                'error': 'max_batches must be a positive integer'
+            }), 400
+        
+        report = db_handler.compact_history(
+            retention_days=retention_days,
+            day_retention_days=HISTORY_DAY_RETENTION_DAYS,
+            batch_size=HISTORY_COMPACT_BATCH,
+            max_batches=max_batches,
+            change_retention_days=CHANGE_LOG_RETENTION_DAYS
+        )
+        
+        return jsonify({
+            'success': True,
+            'report': report,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"History compaction error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+# === 日期範圍查詢 ===
+@app.route('/api/users/upcoming', methods=['GET'])
+def get_upcoming_users():
+    """
+    日期欄位在 from (預設今天) 起 within_days 天內 (含) 的使用者，依日期排序
+    給每日通知排程使用，一次查詢取代逐一查詢每位使用者
+    """
+    try:
+        data_type = request.args.get('data_type', 'bonus')
+        if data_type not in DATE_DATA_TYPES:
+            return jsonify({
+                'success': False,
+                'error': f"data_type must be one of: {', '.join(DATE_DATA_TYPES)}"
+            }), 400
+        try:
+            within_days = int(request.args.get('within_days', '30'))
+            limit = int(request.args.get('limit', str(UPCOMING_MAX_LIMIT)))
+            start = date.fromisoformat(request.args['from']) if 'from' in request.args else date.today()
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': f'Invalid parameter: {e}'
+            }), 400
+        if not 0 <= within_days <= UPCOMING_MAX_DAYS:
+            return jsonify({
+                'success': False,
+                'error': f'within_days must be between 0 and {UPCOMING_MAX_DAYS}'
+            }), 400
+        if not 1 <= limit <= UPCOMING_MAX_LIMIT:
+            return jsonify({
+                'success': False,
+                'error': f'limit must be between 1 and {UPCOMING_MAX_LIMIT}'
+            }), 400
+        
+        end = start + timedelta(days=within_days)
+        # 多取一筆判斷是否還有更多
+        users = db_handler.get_upcoming(data_type, start.isoformat(), end.isoformat(), limit + 1)
+        
+        return jsonify({
+            'success': True,
+            'data_type': data_type,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'count': min(len(users), limit),
+            'truncated': len(users) > limit,
+            'users': users[:limit],
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"Upcoming query error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# === 部門彙總 ===
+def department_aggregates_response(dept_name=None):
+    upcoming = request.args.get('upcoming', '5')
+    try:
+        upcoming = int(upcoming)
+    except ValueError:
+        upcoming = -1
+    if not 0 <= upcoming <= AGGREGATE_MAX_UPCOMING:
+        return jsonify({
+            'success': False,
+            'error': f'upcoming must be an integer between 0 and {AGGREGATE_MAX_UPCOMING}'
+        }), 400
+    
+    departments = db_handler.get_department_aggregates(dept_name, upcoming_limit=upcoming)
+    if dept_name is not None:
+        if dept_name not in departments:
+            return jsonify({
+                'success': False,
+                'message': 'No aggregates found for this department',
+                'department': dept_name
+            }), 404
+        return jsonify({
+            'success': True,
+            'department': dept_name,
+            **departments[dept_name],
+            'timestamp': datetime.now().isoformat()
+        })
     return jsonify({
-        'status': 'healthy',
+        'success': True,
+        'departments': departments,
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/api/aggregates/departments', methods=['GET'])
+def get_departments_aggregates():
+    """
+    各部門的數值欄位 (人數、總和、平均) 與即將到來的日期 (例如獎金發放日)
+    直接讀取寫入時維護的彙總表，不會掃描使用者資料
+    """
+    try:
+        return department_aggregates_response()
+    except Exception as e:
+        logger.error(f"Department aggregates error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/aggregates/departments/<dept_name>', methods=['GET'])
+def get_department_aggregates(dept_name):
+    try:
+        return department_aggregates_response(dept_name)
+    except Exception as e:
+        logger.error(f"Department aggregates error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/aggregates/rebuild', methods=['POST'])
+def rebuild_aggregates():
+    """
+    重新完整計算部門彙總並回報與目前結果不一致的項目
+    Body (選填): {"verify_only": true} 只比對、不改寫
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        verify_only = data.get('verify_only', False)
+        if not isinstance(verify_only, bool):
+            return jsonify({
+                'success': False,
+                'error': 'verify_only must be a boolean'
+            }), 400
+        
+        report = db_handler.rebuild_aggregates(verify_only=verify_only)
+        if report['mismatches']:
+            logger.warning(f"Department aggregates had {report['mismatches']} mismatches "
+                           f"({'verified only' if verify_only else 'rebuilt'})")
+        
+        return jsonify({
+            'success': True,
+            'report': report,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"Aggregate rebuild error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+# === 健康檢查 ===
+def readiness_checks():
+    """回傳 (是否就緒, 各項檢查結果)；資料庫無法讀取時視為未就緒"""
+    checks = {}
+    try:
+        checks['database'] = {'ok': True, 'latency_ms': round(db_handler.ping(), 3)}
+    except Exception as e:
+        checks['database'] = {'ok': False, 'error': str(e)}
+    pool = db_handler.pool.stats()
+    checks['db_pool'] = {
+        'ok': True,
+        'open': pool['open'],
+        'idle': pool['idle'],
+        'in_use': pool['in_use'],
+        'pool_size': pool['pool_size']
+    }
+    if isinstance(db_handler, ShardedUserDataHandler):
+        checks['db_pool']['shards'] = db_handler.shard_count
+    # 索引延遲載入，尚未載入不影響就緒狀態
+    checks['rag_index'] = {'ok': True, 'loaded': rag_service.loaded}
+    if write_queue is not None:
+        queue = write_queue.stats()
+        checks['write_behind'] = {
+            'ok': queue['consecutive_failures'] == 0,
+            'pending_rows': queue['pending_rows'],
+            'oldest_pending_seconds': queue['oldest_pending_seconds']
+        }
+    if isinstance(db_handler, RemoteWriteHandler):
+        try:
+            writer = db_handler.writer_status()
+            checks['db_writer'] = {
+                'ok': True,
+                'pid': writer['pid'],
+                'latency_ms': writer['latency_ms'],
+                'queued': writer['queued'],
+                'avg_batch': writer['avg_batch']
+            }
+        except Exception as e:
+            checks['db_writer'] = {'ok': False, 'error': str(e)}
+    return all(check['ok'] for check in checks.values()), checks
+
+# 對外公開的端點：/health 的 endpoints 與 404 回應的 available_endpoints 都由這份清單產生
+ENDPOINTS = (
+    ('llm_callback', 'POST', '/api/llm/callback'),
+    ('llm_callback_batch', 'POST', '/api/llm/callback/batch'),
+    ('leave_record', 'POST', '/api/leave/record'),
+    ('leave_history', 'GET', '/api/leave/history/<user_id>'),
+    ('frontend_data', 'GET', '/api/frontend/users/<user_id>/data'),
+    ('frontend_summary', 'GET', '/api/frontend/users/<user_id>/summary'),
+    ('frontend_profile', 'GET', '/api/frontend/users/<user_id>/profile'),
+    ('frontend_events', 'GET', '/api/frontend/users/<user_id>/events'),
+    ('frontend_trend', 'GET', '/api/frontend/users/<user_id>/trend?data_type=overtime&period=month'),
+    ('frontend_bulk_data', 'GET', '/api/frontend/users/data?ids=...'),
+    ('frontend_bulk_summary', 'GET', '/api/frontend/users/summary?ids=...'),
+    ('export_user_data', 'GET', '/api/export/user_data?format=ndjson'),
+    ('rag_search', 'GET', '/api/rag/search?q=...&k=5&mode=bm25'),
+    ('rag_search_batch', 'POST', '/api/rag/search/batch'),
+    ('rag_context', 'POST', '/api/rag/context'),
+    ('rag_reindex', 'POST', '/api/rag/reindex'),
+    ('history_compact', 'POST', '/api/history/compact'),
+    ('staff_sync', 'POST', '/api/staff/sync'),
+    ('upcoming_users', 'GET', '/api/users/upcoming?data_type=bonus&within_days=30'),
+    ('department_aggregates', 'GET', '/api/aggregates/departments[/<dept_name>]'),
+    ('aggregates_rebuild', 'POST', '/api/aggregates/rebuild'),
+    ('health', 'GET', '/health'),
+    ('metrics', 'GET', '/metrics'),
+)
+
+def health_payload():
+    ready, checks = readiness_checks()
+    return {
+        'status': 'healthy' if ready else 'unhealthy',
+        'ready': ready,
         'service': 'Database API',
-        'endpoints': {
-            'llm_callback': '/api/llm/callback',
-            'leave_record': '/api/leave/record',
-            'frontend_data': '/api/frontend/users/<user_id>/data',
-            'frontend_summary': '/api/frontend/users/<user_id>/summary'
+        **SERVER_INFO,
+        'uptime_seconds': round(time.time() - registry.started_at, 1),
+        'checks': checks,
+        'requests': registry.histogram_summary('http_request_duration_seconds', 'route'),
+        'slow_request_ms': SLOW_REQUEST_MS,
+        'profile_cache': profile_cache.stats(),
+        'staff_profile_cache': staff_profile_cache.stats(),
+        'rag_index': rag_service.stats(),
+        'rag_context_cache': rag_context_cache.stats(),
+        'write_behind': write_queue.stats() if write_queue is not None else {'enabled': False},
+        'change_feed': change_feed.stats(),
+        'history_compaction': {
+            'enabled': history_compactor is not None,
+            'retention_days': HISTORY_RETENTION_DAYS,
+            'last_report': history_compactor.last_report if history_compactor else None
+        },
+        'staff_sync': {
+            'enabled': STAFF_SYNC_INTERVAL > 0,
+            'source': STAFF_DB_PATH,
+            'last_report': staff_sync.last_report,
+            'last_error': staff_sync.last_error
         },
+        'endpoints': {name: path for name, _, path in ENDPOINTS},
         'timestamp': datetime.now().isoformat()
-    })
+    }
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """健康檢查端點；未就緒時回傳 503"""
+    payload = health_payload()
+    return jsonify(payload), 200 if payload['ready'] else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 文字格式的 metrics"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
 
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({
         'success': False,
         'error': 'Endpoint not found',
-        'available_endpoints': [
-            'POST /api/llm/callback',
-            'POST /api/leave/record',
-            'GET /api/frontend/users/<user_id>/data',
-            'GET /api/frontend/users/<user_id>/summary',
-            'GET /health'
-        ]
+        'available_endpoints': [f'{method} {path}' for _, method, path in ENDPOINTS]
     }), 404
 
 @app.errorhandler(405)
@@ -294,9 +1632,27 @@ if __name__ == '__main__':
     print("📡 Available endpoints:")
     print("  POST   /api/llm/callback              # LLM 資料回調")
     print("  POST   /api/leave/record              # 前端記錄請假") 
+    print("  GET    /api/leave/history/<id>        # 請假紀錄查詢")
     print("  GET    /api/frontend/users/<id>/data  # 前端查詢使用者資料") 
     print("  GET    /api/frontend/users/<id>/summary # 前端摘要")
+    print("  GET    /api/frontend/users/<id>/profile # 員工資料 + 目前資料")
+    print("  GET    /api/frontend/users/<id>/events # 資料變更推送 (SSE)")
+    print("  GET    /api/frontend/users/<id>/trend # 欄位每日 / 每月趨勢")
+    print("  POST   /api/llm/callback/batch        # 批次 LLM 資料回調")
+    print("  GET    /api/frontend/users/data?ids=  # 多位使用者資料")
+    print("  GET    /api/frontend/users/summary?ids= # 多位使用者摘要")
+    print("  GET    /api/export/user_data          # 串流匯出 (NDJSON / CSV)")
+    print("  GET    /api/rag/search?q=&k=&mode=    # 福利文件檢索")
+    print("  POST   /api/rag/search/batch          # 批次福利文件檢索")
+    print("  POST   /api/rag/context               # LLM grounding context")
+    print("  POST   /api/rag/reindex               # 增量重建文件索引")
+    print("  POST   /api/history/compact           # 壓縮舊的歷史紀錄")
+    print("  POST   /api/staff/sync                # 重新匯入 company.db 員工資料")
+    print("  GET    /api/users/upcoming?data_type=&within_days= # 日期即將到來的使用者")
+    print("  GET    /api/aggregates/departments[/<dept>] # 部門彙總")
+    print("  POST   /api/aggregates/rebuild        # 重建 / 驗證部門彙總")
     print("  GET    /health                       # 健康檢查")
+    print("  GET    /metrics                      # Prometheus metrics")
     print("")
     
     app.run(
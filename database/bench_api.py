@@ -0,0 +1,357 @@
+"""
+Database API 壓力測試 / 基準測試
+
+    python bench_api.py                                   # in-process (Flask test client)，1k 與 100k 筆
+    python bench_api.py --sizes 1000,100000,1000000 --concurrency 16 --requests 5000
+    python bench_api.py --url http://localhost:5001 --sizes 1000   # 對已啟動的伺服器 (main.py / api_server.py)
+    python bench_api.py --json bench_api.json --baseline last_release.json
+
+每個資料量 (user_data_current 的筆數，每位使用者 5 筆) 會：
+    1. 建立 N 位合成使用者 (in-process 直接寫入暫存資料庫；--url 模式透過批次回調寫入)
+    2. 依 --mix 的比例隨機送出混合請求，以 --concurrency 個執行緒同時執行
+    3. 統計每個端點的吞吐量與 p50 / p95 / p99 延遲
+--json 輸出機器可讀的結果；--baseline 與先前的結果比較，p95 或吞吐量退步超過 --tolerance 時以 exit code 1 結束。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from bench_rag import percentile
+from data_handler import DATA_MAPPING
+
+DEFAULT_MIX = {
+    'summary': 40,
+    'data': 15,
+    'callback': 20,
+    'leave_record': 10,
+    'leave_history': 5,
+    'bulk_summary': 5,
+    'batch_callback': 5,
+}
+BULK_SIZE = 50
+SEED_CHUNK_ROWS = 50000
+ROWS_PER_USER = len(DATA_MAPPING)
+
+
+def parse_mix(raw):
+    mix = {}
+    for part in raw.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f'unknown operation {name!r}; choose from {", ".join(DEFAULT_MIX)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def user_id(n):
+    return f'bench{n:07d}'
+
+
+def random_profile(rng):
+    return {
+        'leave_days': rng.randint(0, 30),
+        'meal_allowance': rng.randint(0, 3000),
+        'overtime_hours': rng.randint(0, 60),
+        'salary': rng.randint(28000, 200000),
+        'next_bonus_date': (date(2025, 1, 1) + timedelta(days=rng.randint(0, 364))).isoformat(),
+    }
+
+
+# === 請求的送出方式 ===
+class InProcessClient:
+    """Flask test client；每個執行緒各自建立一個"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client
+
+    def request(self, method, path, json_body=None):
+        response = self._client().open(path, method=method, json=json_body)
+        return response.status_code
+
+
+class HttpClient:
+    """對已啟動的伺服器送 HTTP 請求；每個執行緒各自保有一個 keep-alive session"""
+
+    def __init__(self, base_url):
+        import requests
+        self.requests = requests
+        self.base_url = base_url.rstrip('/')
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self.requests.Session()
+        return session
+
+    def request(self, method, path, json_body=None):
+        response = self._session().request(method, self.base_url + path, json=json_body, timeout=60)
+        return response.status_code
+
+
+# === 建立資料 ===
+def seed_in_process(n_users, db_path, seed):
+    """直接以 UserDataHandler.batch_update_data 寫入 (不經過 HTTP)，每個交易 SEED_CHUNK_ROWS 筆"""
+    from data_handler import UserDataHandler
+
+    rng = random.Random(seed)
+    handler = UserDataHandler(db_path=db_path)
+    try:
+        pending = []
+        for n in range(n_users):
+            profile = random_profile(rng)
+            for key, value in profile.items():
+                data_type, unit, description = DATA_MAPPING[key]
+                pending.append((user_id(n), data_type, value, unit, description))
+            if len(pending) >= SEED_CHUNK_ROWS:
+                handler.batch_update_data(pending)
+                pending = []
+        if pending:
+            handler.batch_update_data(pending)
+    finally:
+        handler.close()
+
+
+def seed_over_http(client, n_users, seed, batch_size=1000):
+    rng = random.Random(seed)
+    for start in range(0, n_users, batch_size):
+        items = [
+            {'user_id': user_id(n), 'extracted_data': random_profile(rng)}
+            for n in range(start, min(n_users, start + batch_size))
+        ]
+        status = client.request('POST', '/api/llm/callback/batch', {'items': items})
+        if status != 200:
+            raise RuntimeError(f'Seeding failed with HTTP {status}')
+
+
+def use_database(api_server, db_path):
+    """把 api_server 的資料庫換成這一輪的暫存資料庫 (只在 in-process 模式使用)"""
+    from data_handler import UserDataHandler
+
+    api_server.db_handler.close()
+    api_server.db_handler = UserDataHandler(db_path=db_path)
+    api_server.db_handler.add_write_listener(
+        lambda uid, changed_fields: api_server.profile_cache.invalidate(uid)
+    )
+    api_server.profile_cache.clear()
+
+
+# === 工作負載 ===
+def make_operation(name, rng, n_users, leave_counter):
+    """回傳 (method, path, body)"""
+    uid = user_id(rng.randrange(n_users))
+    if name == 'summary':
+        return 'GET', f'/api/frontend/users/{uid}/summary', None
+    if name == 'data':
+        return 'GET', f'/api/frontend/users/{uid}/data', None
+    if name == 'callback':
+        key = rng.choice(list(DATA_MAPPING))
+        value = random_profile(rng)[key]
+        return 'POST', '/api/llm/callback', {'user_id': uid, 'extracted_data': {key: value}}
+    if name == 'leave_record':
+        day = date(2025, 1, 1) + timedelta(days=next(leave_counter) % 365)
+        return 'POST', '/api/leave/record', {
+            'user_id': uid,
+            'leave_type': rng.choice(['annual_leave', 'sick_leave', 'personal_leave']),
+            'start_date': day.isoformat(),
+            'end_date': day.isoformat(),
+            'days': 0.5,
+            'reason': 'benchmark'
+        }
+    if name == 'leave_history':
+        return 'GET', f'/api/leave/history/{uid}?limit=20', None
+    if name == 'bulk_summary':
+        ids = ','.join(user_id(rng.randrange(n_users)) for _ in range(BULK_SIZE))
+        return 'GET', f'/api/frontend/users/summary?ids={ids}', None
+    if name == 'batch_callback':
+        items = [
+            {'user_id': user_id(rng.randrange(n_users)), 'extracted_data': {'overtime_hours': rng.randint(0, 60)}}
+            for _ in range(BULK_SIZE)
+        ]
+        return 'POST', '/api/llm/callback/batch', {'items': items}
+    raise ValueError(name)
+
+
+def summarize(timings, errors, wall_seconds):
+    if not timings:
+        return {'count': 0, 'errors': errors}
+    return {
+        'count': len(timings),
+        'errors': errors,
+        'throughput_rps': round(len(timings) / wall_seconds, 1) if wall_seconds else None,
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'max_ms': round(max(timings), 3),
+    }
+
+
+def run_workload(client, n_users, mix, total_requests, concurrency, seed, warmup):
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    leave_counter = iter(range(10 ** 9))
+    plan = [
+        (name, *make_operation(name, rng, n_users, leave_counter))
+        for name in rng.choices(names, weights, k=total_requests + warmup)
+    ]
+    warmup_plan, plan = plan[:warmup], plan[warmup:]
+    for _, method, path, body in warmup_plan:
+        client.request(method, path, body)
+
+    timings = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+
+    def execute(op):
+        name, method, path, body = op
+        started = time.perf_counter()
+        try:
+            status = client.request(method, path, body)
+        except Exception:
+            status = None
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            timings[name].append(elapsed)
+            if status is None or status >= 400:
+                errors[name] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(execute, plan))
+    wall_seconds = time.perf_counter() - started
+
+    all_timings = [t for values in timings.values() for t in values]
+    return {
+        'wall_seconds': round(wall_seconds, 3),
+        'total': summarize(all_timings, sum(errors.values()), wall_seconds),
+        # 每個端點的吞吐量以整輪時間計算 (混合負載下各端點共享同一段時間)
+        'endpoints': {name: summarize(timings[name], errors[name], wall_seconds) for name in names},
+    }
+
+
+def compare(report, baseline, tolerance):
+    """回傳退步項目的說明清單；p95 變慢或吞吐量下降超過 tolerance (比例) 視為退步"""
+    regressions = []
+    previous = {run['rows']: run for run in baseline.get('runs', [])}
+    for run in report['runs']:
+        before = previous.get(run['rows'])
+        if before is None:
+            continue
+        for name, stats in run['endpoints'].items():
+            old = before['endpoints'].get(name)
+            if not old or not stats.get('count') or not old.get('count'):
+                continue
+            if stats['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{run['rows']} rows {name}: p95 {old['p95_ms']} -> {stats['p95_ms']} ms")
+            if stats['throughput_rps'] < old['throughput_rps'] * (1 - tolerance):
+                regressions.append(
+                    f"{run['rows']} rows {name}: throughput {old['throughput_rps']} -> {stats['throughput_rps']} rps")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Database API with a mixed workload')
+    parser.add_argument('--url', help='benchmark a running server instead of the in-process Flask app')
+    parser.add_argument('--sizes', default='1000,100000',
+                        help='comma separated user_data_current row counts (default: 1000,100000)')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per database size')
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='operation weights, e.g. summary=40,callback=20 (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db-dir', help='where to create the temporary databases (in-process mode)')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='compare against a previous --json result')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed p95 / throughput regression ratio (default: 0.2)')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'target': args.url or 'in-process',
+        'python': platform.python_version(),
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'mix': args.mix,
+        'runs': [],
+    }
+
+    if args.url:
+        client = HttpClient(args.url)
+        api_server = None
+    else:
+        db_dir = tempfile.mkdtemp(prefix='bench_api_', dir=args.db_dir)
+        # api_server 在匯入時就建立資料庫，先指向暫存目錄
+        os.environ.setdefault('DB_PATH', os.path.join(db_dir, 'initial.db'))
+        # 基準測試不需要員工資料，也不要讓背景匯入跟著量測
+        os.environ.setdefault('STAFF_SYNC_INTERVAL', '0')
+        import logging
+        import api_server
+        logging.getLogger('api_server').setLevel(logging.WARNING)
+        client = InProcessClient(api_server.app)
+
+    for rows in sizes:
+        n_users = max(1, rows // ROWS_PER_USER)
+        started = time.perf_counter()
+        db_bytes = None
+        if api_server is not None:
+            db_path = os.path.join(db_dir, f'bench_{rows}.db')
+            seed_in_process(n_users, db_path, args.seed)
+            use_database(api_server, db_path)
+            db_bytes = os.path.getsize(db_path)
+        else:
+            seed_over_http(client, n_users, args.seed)
+        seed_seconds = time.perf_counter() - started
+
+        result = run_workload(client, n_users, args.mix, args.requests, args.concurrency, args.seed, args.warmup)
+        run = {'rows': rows, 'users': n_users, 'seed_seconds': round(seed_seconds, 2), 'db_bytes': db_bytes}
+        run.update(result)
+        report['runs'].append(run)
+
+        print(f"\n{rows:,} rows ({n_users:,} users), seeded in {seed_seconds:.1f}s, "
+              f"{args.requests} requests x {args.concurrency} threads in {result['wall_seconds']}s")
+        print(f"{'endpoint':16} {'count':>6} {'err':>4} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+        for name, stats in list(result['endpoints'].items()) + [('TOTAL', result['total'])]:
+            if not stats['count']:
+                continue
+            print(f"{name:16} {stats['count']:>6} {stats['errors']:>4} {stats['throughput_rps']:>8} "
+                  f"{stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print('\nRegressions vs baseline:')
+            for line in regressions:
+                print(f'  {line}')
+            sys.exit(1)
+        print('\nNo regressions vs baseline.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+BM25 索引 vs. 全掃描 (naive) 的延遲與召回率比較
+
+    python bench_rag.py                # 使用內建查詢
+    python bench_rag.py -k 10 --repeat 20 --json bench_rag.json
+
+召回率以全掃描的 top-k 為基準 (兩者計算同一個 BM25 分數，理論上應為 1.0)。
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from rag_search import BM25Index, DEFAULT_CORPUS_DIR, load_corpus, naive_search
+
+QUERIES = [
+    '特休天數怎麼計算',
+    '年終獎金什麼時候發放',
+    '員工分紅 計算方式',
+    '員工認股 股票選擇權',
+    '勞保 健保 自付額',
+    '團體保險 理賠',
+    '健康檢查 項目',
+    '廠區診所 看診時間',
+    '婚假 喪假 天數',
+    '產假 陪產假',
+    '彈性上班時間',
+    '新人訓練 課程',
+    '在職進修 補助',
+    '學位 學費補助',
+    '證照獎勵金',
+    '加班費 倍數',
+    '14個月薪資保障',
+    'annual leave',
+    'EAP 員工協助方案',
+    '留職停薪 年資',
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, timings
+
+
+def summarize(timings):
+    return {
+        'mean_ms': round(statistics.mean(timings), 4),
+        'p50_ms': round(percentile(timings, 50), 4),
+        'p95_ms': round(percentile(timings, 95), 4),
+        'p99_ms': round(percentile(timings, 99), 4),
+    }
+
+
+def run(corpus_dir, k, repeat):
+    chunks = load_corpus(corpus_dir)
+
+    started = time.perf_counter()
+    built = BM25Index.build(chunks)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bm25.idx')
+        built.save(path)
+        index_bytes = os.path.getsize(path)
+        started = time.perf_counter()
+        index = BM25Index.load(path)
+        load_ms = (time.perf_counter() - started) * 1000
+
+        index_timings, naive_timings, recalls = [], [], []
+        for query in QUERIES:
+            indexed, timings = measure(lambda: index.search(query, k, with_text=False), repeat)
+            index_timings.extend(timings)
+            naive, timings = measure(lambda: naive_search(chunks, query, k), max(1, repeat // 10))
+            naive_timings.extend(timings)
+            expected = {result['chunk_id'] for result in naive}
+            if expected:
+                found = {result['chunk_id'] for result in indexed}
+                recalls.append(len(expected & found) / len(expected))
+        index.close()
+
+    return {
+        'chunks': len(chunks),
+        'terms': len(built.terms),
+        'postings': built.header['total_postings'],
+        'index_bytes': index_bytes,
+        'build_ms': round(build_ms, 2),
+        'load_ms': round(load_ms, 3),
+        'queries': len(QUERIES),
+        'k': k,
+        'bm25_index': summarize(index_timings),
+        'naive_scan': summarize(naive_timings),
+        'recall_at_k': round(statistics.mean(recalls), 4) if recalls else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark BM25 index against a naive full scan')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_DIR)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    report = run(args.corpus, args.k, args.repeat)
+
+    print(f"Corpus: {report['chunks']} chunks, {report['terms']} terms, "
+          f"{report['postings']} postings, index {report['index_bytes'] / 1024:.1f} KiB")
+    print(f"Build {report['build_ms']} ms, mmap load {report['load_ms']} ms")
+    print(f"{'':12} {'mean':>10} {'p50':>10} {'p95':>10} {'p99':>10}")
+    for name in ('bm25_index', 'naive_scan'):
+        stats = report[name]
+        print(f"{name:12} {stats['mean_ms']:>10} {stats['p50_ms']:>10} {stats['p95_ms']:>10} {stats['p99_ms']:>10}")
+    print(f"recall@{report['k']} vs naive scan: {report['recall_at_k']}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    執行緒安全的 LRU 快取
+    以筆數限制大小，可選擇設定 TTL (秒)；並記錄 hit / miss / eviction 次數
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl or None
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        # 每次 invalidate 遞增；用來避免把載入期間已失效的舊資料放回快取
+        self._invalidation_seq = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._set_locked(key, value)
+
+    def _set_locked(self, key: Hashable, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            seq = self._invalidation_seq
+        value = loader()
+        with self._lock:
+            if seq == self._invalidation_seq:
+                self._set_locked(key, value)
+        return value
+
+    def get_many_or_load(self, keys: list, loader: Callable[[list], Dict[Hashable, Any]]) -> Dict[Hashable, Any]:
+        """批次版 get_or_load；loader 收到所有未命中的 key，一次載入後回傳 dict"""
+        result = {}
+        missing = []
+        for key in keys:
+            value = self.get(key, _MISSING)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                result[key] = value
+        if missing:
+            with self._lock:
+                seq = self._invalidation_seq
+            loaded = loader(missing)
+            with self._lock:
+                for key in missing:
+                    result[key] = loaded[key]
+                    if seq == self._invalidation_seq:
+                        self._set_locked(key, loaded[key])
+        return result
+
+    def invalidate(self, key: Hashable) -> bool:
+        with self._lock:
+            self._invalidation_seq += 1
+            if self._data.pop(key, None) is None:
+                return False
+            self.invalidations += 1
+            return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._invalidation_seq += 1
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
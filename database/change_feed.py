@@ -0,0 +1,187 @@
+"""
+使用者資料變更的 Server-Sent Events 推送
+
+    feed = ChangeFeed()
+    db_handler.add_change_listener(feed.publish)      # commit 後通知訂閱者
+
+    stream = UserEventStream(db_handler, feed, 'user001', last_event_id, notify=event.set)
+    chunks = stream.open()                            # 首次連線送完整資料，續傳則補送遺漏的變更
+    chunks = stream.poll(timed_out)                   # 被喚醒或逾時後取得要送出的事件
+
+變更內容以 SQLite 的 user_data_changes (seq 單調遞增) 為準：通知只負責喚醒，
+送出的差異一律依 seq 從資料庫讀取，同時 commit 的交易不會因通知順序顛倒而漏送，
+其他 worker process 的寫入也會在逾時輪詢時補上。
+"""
+import json
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Set
+
+DEFAULT_BUFFER_SIZE = 64
+CATCH_UP_LIMIT = 500
+RETRY_MS = 3000
+
+
+def format_sse(data: Dict[str, Any], event: Optional[str] = None, event_id: Optional[int] = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event:
+        lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def parse_event_id(value: Optional[str]) -> Optional[int]:
+    """Last-Event-ID 不是非負整數時當作沒有帶 (重新取得完整資料)"""
+    try:
+        seq = int(value)
+    except (TypeError, ValueError):
+        return None
+    return seq if seq >= 0 else None
+
+
+class Subscription:
+    """一個連線的通知緩衝區；超過 maxsize 時清空並標記 overflowed，改由資料庫補齊"""
+
+    def __init__(self, user_id: str, notify: Callable[[], None], maxsize: int = DEFAULT_BUFFER_SIZE):
+        self.user_id = user_id
+        self.maxsize = maxsize
+        self._notify = notify
+        self._events = deque()
+        self._overflowed = False
+        self._lock = threading.Lock()
+
+    def push(self, events: List[Dict[str, Any]]) -> bool:
+        with self._lock:
+            overflow = len(self._events) + len(events) > self.maxsize
+            if overflow:
+                self._events.clear()
+                self._overflowed = True
+            else:
+                self._events.extend(events)
+        try:
+            self._notify()
+        except RuntimeError:
+            # 非同步連線的 event loop 已關閉
+            pass
+        return not overflow
+
+    def drain(self):
+        """取出緩衝的事件，回傳 (events, overflowed)"""
+        with self._lock:
+            events = list(self._events)
+            overflowed = self._overflowed
+            self._events.clear()
+            self._overflowed = False
+        return events, overflowed
+
+
+class ChangeFeed:
+    """行程內的 pub/sub：依 user_id 分派 commit 後的變更"""
+
+    def __init__(self, buffer_size: int = DEFAULT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self._counters = {'published': 0, 'delivered': 0, 'overflows': 0}
+
+    def subscribe(self, user_id: str, notify: Callable[[], None]) -> Subscription:
+        subscription = Subscription(user_id, notify, self.buffer_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id: str, events: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+            self._counters['published'] += 1
+        overflows = sum(1 for subscription in subscribers if not subscription.push(events))
+        with self._lock:
+            self._counters['delivered'] += len(subscribers)
+            self._counters['overflows'] += overflows
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'subscribers': sum(len(subscribers) for subscribers in self._subscribers.values()),
+                'users': len(self._subscribers),
+                'buffer_size': self.buffer_size,
+                **self._counters
+            }
+
+
+class UserEventStream:
+    """
+    一個 SSE 連線的狀態 (目前送到的 seq)；open / poll 會查詢資料庫，非同步框架請丟到 thread pool 執行
+    事件：
+        snapshot  {"user_id", "seq", "data": 完整資料}         首次連線或續傳位置已被清除
+        change    {"user_id", "seq", "changes": {data_type: 新值}}   只含有變動的欄位
+    """
+
+    def __init__(self, handler, feed: ChangeFeed, user_id: str,
+                 last_event_id: Optional[int], notify: Callable[[], None]):
+        self.handler = handler
+        self.feed = feed
+        self.user_id = user_id
+        self.last_seq = last_event_id
+        self.subscription: Optional[Subscription] = None
+        self._notify = notify
+
+    def open(self) -> List[str]:
+        # 先訂閱再讀資料，兩者之間的寫入會在下一次 poll 補上
+        self.subscription = self.feed.subscribe(self.user_id, self._notify)
+        oldest, latest = self.handler.change_log_bounds(self.user_id)
+        chunks = [f'retry: {RETRY_MS}\n\n']
+        if self.last_seq is None or self.last_seq < oldest - 1 or self.last_seq > latest:
+            self.last_seq = latest
+            chunks.append(format_sse({
+                'user_id': self.user_id,
+                'seq': latest,
+                'data': self.handler.get_user_data(self.user_id)
+            }, 'snapshot', latest))
+        chunks.extend(self._catch_up())
+        return chunks
+
+    def _catch_up(self) -> List[str]:
+        chunks = []
+        while True:
+            rows = self.handler.get_changes(self.user_id, self.last_seq, CATCH_UP_LIMIT)
+            if not rows:
+                return chunks
+            self.last_seq = rows[-1]['seq']
+            # 同一欄位改了好幾次時只送最後的值
+            changes = {}
+            for row in rows:
+                row.pop('seq')
+                changes[row.pop('data_type')] = row
+            chunks.append(format_sse({
+                'user_id': self.user_id,
+                'seq': self.last_seq,
+                'changes': changes
+            }, 'change', self.last_seq))
+            if len(rows) < CATCH_UP_LIMIT:
+                return chunks
+
+    def poll(self, timed_out: bool = False) -> List[str]:
+        """被喚醒 (有這位使用者的變更) 或輪詢逾時後呼叫；沒有新事件時回傳 keepalive 註解"""
+        events, overflowed = self.subscription.drain()
+        if events and not overflowed and max(event['seq'] for event in events) <= self.last_seq:
+            return []
+        chunks = self._catch_up() if (events or overflowed or timed_out) else []
+        if not chunks and timed_out:
+            chunks.append(': keepalive\n\n')
+        return chunks
+
+    def close(self) -> None:
+        if self.subscription is not None:
+            self.feed.unsubscribe(self.subscription)
+            self.subscription = None
@@ -0,0 +1,244 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Callable
+
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,      # 負數代表 KiB，約 16 MB page cache
+    'mmap_size': 268435456,    # 256 MB
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'ON',
+}
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    設定 on_query 後，每個 execute / executemany / commit 都會回報 (sql, params, 秒數)
+    SELECT 的耗時只包含執行到第一筆結果，之後 fetch 的時間不計入
+    """
+    on_query = None
+
+    def execute(self, sql, parameters=()):
+        hook = self.on_query
+        if hook is None:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            hook(sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        hook = self.on_query
+        if hook is None:
+            return super().executemany(sql, seq_of_parameters)
+        if not isinstance(seq_of_parameters, (list, tuple)):
+            seq_of_parameters = list(seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            hook(sql, seq_of_parameters, time.perf_counter() - started)
+
+    def commit(self):
+        hook = self.on_query
+        if hook is None:
+            return super().commit()
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            hook('COMMIT', (), time.perf_counter() - started)
+
+
+class SQLiteConnectionPool:
+    """
+    可重複使用的 SQLite 連線池
+    連線在請求之間共用，避免每次呼叫都重新建立連線與暖機 page cache
+    """
+
+    def __init__(self, db_path: str, pool_size: int = 8, busy_timeout: int = 5000,
+                 pragmas: Optional[Dict[str, Any]] = None,
+                 on_query: Optional[Callable[[str, Any, float], None]] = None):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.busy_timeout = busy_timeout
+        self.on_query = on_query
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        if pragmas:
+            self.pragmas.update(pragmas)
+
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        self._all = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        # 目前執行緒正在進行的交易 (連線、巢狀深度、commit 後要執行的回呼)
+        self._local = threading.local()
+        # 累計次數 (給 metrics 使用)；只在持有 _lock 時更新
+        self._counters = {
+            'connections_created': 0,
+            'connections_closed': 0,
+            'acquired': 0,
+            'commits': 0,
+            'rollbacks': 0,
+            'savepoints': 0,
+            'savepoint_rollbacks': 0,
+        }
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def _create_connection(self) -> sqlite3.Connection:
+        # isolation_level=None：交易由 transaction() 明確控制
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            factory=TimedConnection,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        conn.on_query = self.on_query
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError('Connection pool is closed')
+        try:
+            conn = self._idle.get_nowait()
+            self._count('acquired')
+            return conn
+        except queue.Empty:
+            conn = self._create_connection()
+            with self._lock:
+                self._all.add(conn)
+                self._counters['connections_created'] += 1
+                self._counters['acquired'] += 1
+            return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        if not self._closed:
+            try:
+                self._idle.put_nowait(conn)
+                return
+            except queue.Full:
+                pass
+        self._discard(conn)
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self._all.discard(conn)
+            self._counters['connections_closed'] += 1
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """
+        借出一條連線 (autocommit，適合唯讀查詢)
+        若目前執行緒已在交易中，直接沿用該交易的連線以讀到尚未 commit 的資料
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """
+        借出一條連線並包在 BEGIN IMMEDIATE ... COMMIT 交易中
+        巢狀呼叫會改用 SAVEPOINT，內層失敗只回滾內層的變更
+        """
+        local = self._local
+        if getattr(local, 'conn', None) is not None:
+            yield from self._savepoint(local)
+            return
+
+        conn = self.acquire()
+        local.conn = conn
+        local.depth = 0
+        local.callbacks = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                self._count('rollbacks')
+                raise
+            conn.commit()
+            self._count('commits')
+            callbacks = local.callbacks
+        finally:
+            local.conn = None
+            local.callbacks = []
+            self.release(conn)
+        for callback in callbacks:
+            callback()
+
+    def _savepoint(self, local):
+        conn = local.conn
+        local.depth += 1
+        name = f'sp_{local.depth}'
+        mark = len(local.callbacks)
+        conn.execute(f'SAVEPOINT {name}')
+        self._count('savepoints')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute(f'ROLLBACK TO {name}')
+            conn.execute(f'RELEASE {name}')
+            self._count('savepoint_rollbacks')
+            del local.callbacks[mark:]
+            raise
+        else:
+            conn.execute(f'RELEASE {name}')
+        finally:
+            local.depth -= 1
+
+    def in_transaction(self) -> bool:
+        return getattr(self._local, 'conn', None) is not None
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """交易 commit 後才執行 callback；不在交易中則立即執行"""
+        if self.in_transaction():
+            self._local.callbacks.append(callback)
+        else:
+            callback()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            total = len(self._all)
+            counters = dict(self._counters)
+        return {
+            'open': total,
+            'idle': self._idle.qsize(),
+            'in_use': total - self._idle.qsize(),
+            'pool_size': self.pool_size,
+            **counters,
+        }
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+        # 仍被借出的連線在歸還時會被關閉
@@ -1,20 +1,494 @@
+import argparse
+import base64
 import sqlite3
 import json
-from datetime import datetime
-from typing import Dict, Any, Optional
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, Optional, Callable, List
+from connection_pool import SQLiteConnectionPool
+from metrics import current_trace, registry, sql_query_name
+
+logger = logging.getLogger(__name__)
+
+# PRAGMA user_version 記錄目前資料庫結構版本
+SCHEMA_VERSION = 3
+
+# 會扣除特休天數的假別
+ANNUAL_LEAVE_TYPE = 'annual_leave'
+
+DATA_MAPPING = {
+    'leave_days': ('leave', 'days', '剩餘特休天數'),
+    'meal_allowance': ('meal', 'ntd', '剩餘餐補'),
+    'overtime_hours': ('overtime', 'hours', '加班時數'),
+    'salary': ('salary', 'ntd', '薪水'),
+    'next_bonus_date': ('bonus', 'date', '下次獎金發放時間')
+}
+
+# 新使用者第一次寫入時的預設值
+DEFAULT_VALUES = {
+    'leave_days': 15,
+    'meal_allowance': 100,
+    'overtime_hours': 30,
+    'salary': 28000,
+    'next_bonus_date': '2025-09-22',
+}
+
+# 日期欄位的 unit；這類欄位的值一律存成 YYYY-MM-DD
+DATE_UNIT = 'date'
+
+UPSERT_CURRENT_SQL = '''
+    INSERT INTO user_data_current (user_id, data_type, value, value_num, value_date, unit, description,
+                                   created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, data_type) DO UPDATE SET
+        value = excluded.value,
+        value_num = excluded.value_num,
+        value_date = excluded.value_date,
+        unit = excluded.unit,
+        description = excluded.description,
+        updated_at = excluded.updated_at
+'''
+
+INSERT_HISTORY_SQL = '''
+    INSERT INTO user_data (user_id, data_type, value, value_num, value_date, unit, description,
+                           created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# 變更紀錄：每次欄位值改變追加一筆，seq 單調遞增，給 SSE 變更通知續傳使用
+INSERT_CHANGE_SQL = '''
+    INSERT INTO user_data_changes (user_id, data_type, value, unit, description, changed_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+# 歷史彙總：period -> updated_at 取前幾個字元當 bucket (day: 2025-09-20, month: 2025-09)
+ROLLUP_PERIODS = {'day': 10, 'month': 7}
+
+UPSERT_ROLLUP_SQL = '''
+    INSERT INTO user_data_rollup (user_id, data_type, period, bucket, unit,
+                                  first_value, first_at, last_value, last_at,
+                                  min_value, max_value, sum_value, samples)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, data_type, period, bucket) DO UPDATE SET
+        first_value = CASE WHEN excluded.first_at < first_at THEN excluded.first_value ELSE first_value END,
+        first_at = MIN(first_at, excluded.first_at),
+        last_value = CASE WHEN excluded.last_at >= last_at THEN excluded.last_value ELSE last_value END,
+        unit = CASE WHEN excluded.last_at >= last_at THEN excluded.unit ELSE unit END,
+        last_at = MAX(last_at, excluded.last_at),
+        min_value = COALESCE(MIN(min_value, excluded.min_value), min_value, excluded.min_value),
+        max_value = COALESCE(MAX(max_value, excluded.max_value), max_value, excluded.max_value),
+        sum_value = COALESCE(sum_value + excluded.sum_value, sum_value, excluded.sum_value),
+        samples = samples + excluded.samples
+'''
+
+# 從 company.db (db.js 建立) 的 staff 匯入的欄位
+STAFF_SOURCE_COLUMNS = ('staff_id', 'first_name', 'last_name', 'email', 'hire_date', 'job_title',
+                        'dept_name', 'phone', 'manager_id', 'status')
+# staff_profile 的欄位：匯入的欄位加上預先計算的姓名、主管姓名、年資與部門內年資排名
+STAFF_PROFILE_COLUMNS = STAFF_SOURCE_COLUMNS + (
+    'full_name', 'manager_name', 'tenure_days', 'tenure_months', 'tenure_years',
+    'seniority_rank', 'dept_headcount', 'tenure_as_of'
+)
+
+UPSERT_STAFF_SQL = f'''
+    INSERT INTO staff_profile ({', '.join(STAFF_PROFILE_COLUMNS)}, synced_at)
+    VALUES ({', '.join('?' * (len(STAFF_PROFILE_COLUMNS) + 1))})
+    ON CONFLICT(staff_id) DO UPDATE SET
+        {', '.join(f'{column} = excluded.{column}' for column in STAFF_PROFILE_COLUMNS[1:])},
+        synced_at = excluded.synced_at
+'''
+
+# 部門彙總：user_data_current / staff_profile 的 trigger 在同一個交易內以增減量維護
+#   dept_aggregate        數值欄位 (value_num：特休、加班…) 的人數與總和
+#   dept_date_aggregate   日期欄位 (value_date：獎金發放日) 每個日期的人數
+
+
+def _add_value_sql(dept: str, source: str, where: str, data_type: str, prefix: str) -> str:
+    """把 source 中符合 where 的每一筆 (dept, data_type, {prefix}value_num / value_date) 加進彙總"""
+    return f'''
+        INSERT INTO dept_aggregate (dept_name, data_type, members, value_sum)
+        SELECT {dept}, {data_type}, 1, {prefix}value_num FROM {source}
+         WHERE {where} AND {dept} IS NOT NULL AND {prefix}value_num IS NOT NULL
+        ON CONFLICT(dept_name, data_type) DO UPDATE SET
+            members = members + 1, value_sum = value_sum + excluded.value_sum;
+        INSERT INTO dept_date_aggregate (dept_name, data_type, value_date, members)
+        SELECT {dept}, {data_type}, {prefix}value_date, 1 FROM {source}
+         WHERE {where} AND {dept} IS NOT NULL AND {prefix}value_date IS NOT NULL
+        ON CONFLICT(dept_name, data_type, value_date) DO UPDATE SET members = members + 1;
+    '''
+
+
+def _remove_row_sql(row: str) -> str:
+    """從彙總扣掉 user_data_current 的一筆 (OLD)；部門依 staff_profile 查詢"""
+    dept = f'(SELECT dept_name FROM staff_profile WHERE staff_id = {row}.user_id)'
+    return f'''
+        UPDATE dept_aggregate SET members = members - 1, value_sum = value_sum - {row}.value_num
+         WHERE dept_name = {dept} AND data_type = {row}.data_type AND {row}.value_num IS NOT NULL;
+        UPDATE dept_date_aggregate SET members = members - 1
+         WHERE dept_name = {dept} AND data_type = {row}.data_type AND value_date = {row}.value_date;
+        DELETE FROM dept_aggregate WHERE dept_name = {dept} AND data_type = {row}.data_type AND members <= 0;
+        DELETE FROM dept_date_aggregate
+         WHERE dept_name = {dept} AND data_type = {row}.data_type AND value_date = {row}.value_date
+           AND members <= 0;
+    '''
+
+
+def _remove_staff_sql(row: str) -> str:
+    """員工離開部門 (OLD)：把他目前的所有欄位從該部門的彙總扣掉"""
+    return f'''
+        UPDATE dept_aggregate SET
+            members = members - 1,
+            value_sum = value_sum - (SELECT c.value_num FROM user_data_current c
+                                      WHERE c.user_id = {row}.staff_id AND c.data_type = dept_aggregate.data_type)
+         WHERE dept_name = {row}.dept_name
+           AND data_type IN (SELECT data_type FROM user_data_current
+                              WHERE user_id = {row}.staff_id AND value_num IS NOT NULL);
+        UPDATE dept_date_aggregate SET members = members - 1
+         WHERE dept_name = {row}.dept_name
+           AND (data_type, value_date) IN (SELECT data_type, value_date FROM user_data_current
+                                            WHERE user_id = {row}.staff_id AND value_date IS NOT NULL);
+        DELETE FROM dept_aggregate WHERE dept_name = {row}.dept_name AND members <= 0;
+        DELETE FROM dept_date_aggregate WHERE dept_name = {row}.dept_name AND members <= 0;
+    '''
+
+
+_ADD_ROW_SQL = _add_value_sql('dept_name', 'staff_profile', 'staff_id = NEW.user_id', 'NEW.data_type', 'NEW.')
+_ADD_STAFF_SQL = _add_value_sql('NEW.dept_name', 'user_data_current', 'user_id = NEW.staff_id', 'data_type', '')
+
+DEPT_AGGREGATE_TRIGGERS = {
+    'trg_current_insert_dept': f'AFTER INSERT ON user_data_current BEGIN {_ADD_ROW_SQL} END',
+    'trg_current_update_dept': f'''AFTER UPDATE OF user_id, data_type, value_num, value_date ON user_data_current
+        BEGIN {_remove_row_sql('OLD')} {_ADD_ROW_SQL} END''',
+    'trg_current_delete_dept': f'AFTER DELETE ON user_data_current BEGIN {_remove_row_sql("OLD")} END',
+    'trg_staff_insert_dept': f'AFTER INSERT ON staff_profile BEGIN {_ADD_STAFF_SQL} END',
+    'trg_staff_update_dept': f'''AFTER UPDATE OF dept_name ON staff_profile
+        WHEN OLD.dept_name IS NOT NEW.dept_name
+        BEGIN {_remove_staff_sql('OLD')} {_ADD_STAFF_SQL} END''',
+    'trg_staff_delete_dept': f'AFTER DELETE ON staff_profile BEGIN {_remove_staff_sql("OLD")} END',
+}
+
+# 重建 / 驗證用：直接從 user_data_current JOIN staff_profile 算出的彙總
+DEPT_NUMERIC_SQL = '''
+    SELECT s.dept_name, c.data_type, COUNT(*) AS members, TOTAL(c.value_num) AS value_sum
+      FROM user_data_current c JOIN staff_profile s ON s.staff_id = c.user_id
+     WHERE s.dept_name IS NOT NULL AND c.value_num IS NOT NULL
+     GROUP BY s.dept_name, c.data_type
+'''
+DEPT_DATE_SQL = '''
+    SELECT s.dept_name, c.data_type, c.value_date, COUNT(*) AS members
+      FROM user_data_current c JOIN staff_profile s ON s.staff_id = c.user_id
+     WHERE s.dept_name IS NOT NULL AND c.value_date IS NOT NULL
+     GROUP BY s.dept_name, c.data_type, c.value_date
+'''
+
+# 對外回傳的資料列欄位 (單筆查詢與匯出)
+# value 是 API 回傳的值，宣告為 REAL 但日期欄位存的是 'YYYY-MM-DD' 字串 (SQLite 不會轉型)，型別不固定；
+# 需要依型別查詢或計算時使用 value_num / value_date，它們是內部欄位，不對外回傳
+USER_DATA_COLUMNS = ('id', 'user_id', 'data_type', 'value', 'unit', 'description', 'created_at', 'updated_at')
+
+# 匯出：table 參數對應的資料表與輸出欄位
+EXPORT_TABLES = {'current': 'user_data_current', 'history': 'user_data'}
+EXPORT_COLUMNS = USER_DATA_COLUMNS
+
+
+def encode_export_cursor(updated_at: str, row_id: int) -> str:
+    """匯出續傳用的 cursor：最後一筆的 (updated_at, id)，以 URL-safe base64 編碼"""
+    return base64.urlsafe_b64encode(f'{updated_at}|{row_id}'.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_export_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        updated_at, row_id = raw.rsplit('|', 1)
+        return updated_at, int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f'Invalid export cursor: {cursor}') from e
+
+
+def _new_bucket(value: Any, unit: Optional[str], at: str) -> Dict[str, Any]:
+    number = value if isinstance(value, (int, float)) else None
+    return {
+        'unit': unit,
+        'first_value': value, 'first_at': at,
+        'last_value': value, 'last_at': at,
+        'min_value': number, 'max_value': number, 'sum_value': number,
+        'samples': 1
+    }
+
+
+def _merge_bucket(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    """合併同一個 bucket 的兩份彙總 (與 UPSERT_ROLLUP_SQL 的規則相同)"""
+    def pick(func, x, y):
+        return func(x, y) if x is not None and y is not None else (x if y is None else y)
+
+    first = a if a['first_at'] <= b['first_at'] else b
+    last = b if b['last_at'] >= a['last_at'] else a
+    return {
+        'unit': last['unit'],
+        'first_value': first['first_value'], 'first_at': first['first_at'],
+        'last_value': last['last_value'], 'last_at': last['last_at'],
+        'min_value': pick(min, a['min_value'], b['min_value']),
+        'max_value': pick(max, a['max_value'], b['max_value']),
+        'sum_value': pick(lambda x, y: x + y, a['sum_value'], b['sum_value']),
+        'samples': a['samples'] + b['samples']
+    }
+
+
+def _aggregate_rows(rows, width: int) -> Dict[tuple, Dict[str, Any]]:
+    """把 (user_id, data_type, value, unit, updated_at) 依 (user_id, data_type, bucket) 彙總"""
+    buckets = {}
+    for user_id, data_type, value, unit, updated_at in rows:
+        key = (user_id, data_type, updated_at[:width])
+        bucket = _new_bucket(value, unit, updated_at)
+        buckets[key] = _merge_bucket(buckets[key], bucket) if key in buckets else bucket
+    return buckets
+
+
+def now_timestamp() -> str:
+    """寫入 created_at / updated_at 的時間格式 (本地時間，'YYYY-MM-DD HH:MM:SS.ffffff')"""
+    return datetime.now().isoformat(sep=' ')
+
+
+def batch_error(index: int, user_id: Any, error: Exception) -> Dict[str, Any]:
+    """ingest_backend_batch 中因為交易沒有完成而沒有寫入的項目 (資料本身沒有問題，可以重試)"""
+    return {'index': index, 'user_id': user_id, 'success': False, 'error': str(error), 'retryable': True}
+
+
+def normalize_date(value: Any) -> str:
+    """
+    把日期欄位的值整理成 YYYY-MM-DD
+    接受 date / datetime、'2025-12-15' (可帶時間)、'2025/12/15'、'20251215' 與數字 20251215；其他值拋出 ValueError
+    """
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        raise ValueError(f'Invalid date: {value!r}')
+    text = str(value).strip()
+    if len(text) == 8 and text.isdigit():
+        text = f'{text[:4]}-{text[4:6]}-{text[6:]}'
+    try:
+        return datetime.strptime(text[:10].replace('/', '-'), '%Y-%m-%d').date().isoformat()
+    except ValueError:
+        raise ValueError(f'Invalid date: {value!r}') from None
+
+
+def parse_date_range(start: Any, end: Any, names: tuple = ('start_date', 'end_date'),
+                     required: bool = False) -> tuple:
+    """
+    檢查請假日期區間，回傳 (start, end) 的 YYYY-MM-DD 字串 (未提供的一端為 None)
+    不是 ISO 日期、缺少必要的日期或開始晚於結束時拋出 ValueError
+    """
+    parsed = []
+    for name, value in zip(names, (start, end)):
+        if value is None or value == '':
+            if required:
+                raise ValueError(f'{name} is required')
+            parsed.append(None)
+            continue
+        try:
+            parsed.append(date.fromisoformat(value))
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid {name}: {value!r}, expected YYYY-MM-DD') from None
+    if parsed[0] and parsed[1] and parsed[0] > parsed[1]:
+        raise ValueError(f'{names[0]} must not be after {names[1]}')
+    return tuple(value.isoformat() if value else None for value in parsed)
+
+
+def typed_value(value: Any, unit: Optional[str]):
+    """
+    回傳寫入時的 (value, value_num, value_date)
+    日期欄位 (unit='date') 存成 YYYY-MM-DD，其他能轉成數字的值存成 float，都不是時兩個型別欄位為 NULL
+    """
+    if unit == DATE_UNIT:
+        day = normalize_date(value)
+        return day, None, day
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return value, None, None
+    return number, number, None
+
+
+def _tenure(hire_date: Optional[str], as_of: date):
+    """回傳 (年資天數, 滿幾個月, 滿幾年)；沒有或無法解析到職日時為 None，尚未到職時為 0"""
+    try:
+        hired = date.fromisoformat(hire_date[:10])
+    except (TypeError, ValueError):
+        return None, None, None
+    if hired >= as_of:
+        return 0, 0, 0
+    months = (as_of.year - hired.year) * 12 + as_of.month - hired.month - (as_of.day < hired.day)
+    return (as_of - hired).days, months, months // 12
+
+
+def _build_staff_profiles(rows: list, as_of: date) -> List[tuple]:
+    """把 staff 的資料列 (STAFF_SOURCE_COLUMNS 順序) 計算成 staff_profile 的資料列"""
+    staff = [dict(zip(STAFF_SOURCE_COLUMNS, row)) for row in rows]
+    names = {member['staff_id']: f"{member['first_name']} {member['last_name']}".strip() for member in staff}
+    departments = {}
+    for member in staff:
+        departments.setdefault(member['dept_name'], []).append(member)
+    ranks = {}
+    for members in departments.values():
+        # 到職日越早排名越前，沒有到職日的排在最後
+        ordered = sorted(members, key=lambda member: (member['hire_date'] is None, member['hire_date'] or '', member['staff_id']))
+        for rank, member in enumerate(ordered, 1):
+            ranks[member['staff_id']] = (rank, len(members))
+    profiles = []
+    for member in staff:
+        rank, headcount = ranks[member['staff_id']]
+        profiles.append(tuple(member[column] for column in STAFF_SOURCE_COLUMNS) + (
+            names[member['staff_id']],
+            names.get(member['manager_id']),
+            *_tenure(member['hire_date'], as_of),
+            rank,
+            headcount,
+            as_of.isoformat()
+        ))
+    return profiles
+
+
 class UserDataHandler:
-    def __init__(self, db_path: str = "user_data.db"):
+    def __init__(self, db_path: str = "user_data.db", pool_size: int = 8,
+                 busy_timeout: int = 5000, pragmas: Optional[Dict[str, Any]] = None,
+                 keep_history: bool = True):
         self.db_path = db_path
+        # keep_history=False 時只維護 user_data_current，不再追加歷史紀錄
+        self.keep_history = keep_history
+        self.pool = SQLiteConnectionPool(db_path, pool_size=pool_size,
+                                         busy_timeout=busy_timeout, pragmas=pragmas,
+                                         on_query=self._on_query)
+        self._write_listeners = []
+        self._pending_reader = None
+        self._change_listeners = []
         self.init_database()
-    
+
+    def close(self):
+        self.pool.close()
+
+    def ping(self) -> float:
+        """確認資料庫可讀，回傳耗時 (毫秒)；連線失敗時拋出例外"""
+        started = time.perf_counter()
+        with self.pool.connection() as conn:
+            conn.execute('SELECT 1 FROM user_data_current LIMIT 1').fetchall()
+        return (time.perf_counter() - started) * 1000
+
+    @staticmethod
+    def _on_query(sql: str, params: Any, seconds: float) -> None:
+        """每個 SQL 語句執行後呼叫：記入依語句名稱分組的直方圖，並掛到目前請求的追蹤上"""
+        registry.observe('db_query_duration_seconds', {'query': sql_query_name(sql)}, seconds)
+        trace = current_trace()
+        if trace is not None:
+            trace.record(sql, params, seconds)
+
+    def explain(self, sql: str, params: Any = ()) -> List[str]:
+        """回傳 EXPLAIN QUERY PLAN 的每一行；executemany 的參數取第一組"""
+        if isinstance(params, list) and params and isinstance(params[0], (list, tuple)):
+            params = params[0]
+        with self.pool.connection() as conn:
+            rows = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        return [row['detail'] for row in rows]
+
+    def add_write_listener(self, listener: Callable[[str, List[str]], None]) -> None:
+        """註冊寫入通知 (交易 commit 後呼叫)，參數為 user_id 與改變的 data_type"""
+        self._write_listeners.append(listener)
+
+    def set_pending_reader(self, reader: Optional[Callable[[str], Optional[Dict[str, Any]]]]) -> None:
+        """
+        掛上尚未寫入資料庫的更新來源 (write-behind 佇列)，讀取時合併進結果 (read-your-writes)
+        reader(user_id) 回傳 {'fields': {欄位: 值}, 'queued_at': 時間} 或 None；傳入 None 取消
+        """
+        self._pending_reader = reader
+
+    def _pending_for(self, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        reader = self._pending_reader
+        if reader is None:
+            return {}
+        pending = {}
+        for user_id in user_ids:
+            entry = reader(user_id)
+            if entry:
+                pending[user_id] = entry
+        return pending
+
+    def _apply_pending(self, user_id: str, profile: Dict[str, Any], pending: Dict[str, Any]) -> Dict[str, Any]:
+        """以與 ingest_backend_data 相同的規則把待寫入的值套在讀到的資料上 (沒有資料時先套預設值)"""
+        profile = dict(profile)
+        rows = self._map_updates(user_id, pending['fields'])
+        if not profile:
+            rows = self._map_updates(user_id, DEFAULT_VALUES) + rows
+        for _, data_type, value, unit, description in rows:
+            value = float(value) if isinstance(value, int) else value
+            current = profile.get(data_type)
+            if current and (current['value'], current['unit'], current['description']) == (value, unit, description):
+                continue
+            profile[data_type] = {
+                'value': value,
+                'unit': unit,
+                'description': description,
+                'updated_at': pending['queued_at']
+            }
+        return dict(sorted(profile.items()))
+
+    def add_change_listener(self, listener: Callable[[str, List[Dict[str, Any]]], None]) -> None:
+        """註冊變更通知 (交易 commit 後呼叫)，參數為 user_id 與這次寫入的變更紀錄 (含 seq)"""
+        self._change_listeners.append(listener)
+
+    def _record_changes(self, conn: sqlite3.Connection, rows: list, now: str) -> None:
+        """在目前的交易內寫入變更紀錄，commit 後依使用者通知 change listener"""
+        changes = {}
+        for user_id, data_type, value, unit, description in rows:
+            seq = conn.execute(INSERT_CHANGE_SQL, (user_id, data_type, value, unit, description, now)).lastrowid
+            changes.setdefault(user_id, []).append({
+                'seq': seq,
+                'data_type': data_type,
+                'value': float(value) if isinstance(value, int) else value,
+                'unit': unit,
+                'description': description,
+                'updated_at': now
+            })
+        if not self._change_listeners:
+            return
+
+        def dispatch():
+            for user_id, events in changes.items():
+                for listener in self._change_listeners:
+                    try:
+                        listener(user_id, events)
+                    except Exception as e:
+                        logger.error(f"Change listener error for {user_id}: {e}")
+        self.pool.after_commit(dispatch)
+
+    def _notify_write(self, user_id: str, changed_fields: List[str]) -> None:
+        def dispatch():
+            for listener in self._write_listeners:
+                try:
+                    listener(user_id, changed_fields)
+                except Exception as e:
+                    logger.error(f"Write listener error for {user_id}: {e}")
+        # 外層還有交易時延後到 commit 之後才通知
+        self.pool.after_commit(dispatch)
+
     def init_database(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self.pool.transaction() as conn:
+            # user_data：歷史紀錄 (每次寫入追加一筆)
             conn.execute('''
                 CREATE TABLE IF NOT EXISTS user_data (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id TEXT NOT NULL,
                     data_type TEXT NOT NULL,
                     value REAL NOT NULL,
+                    value_num REAL,
+                    value_date TEXT,
                     unit TEXT,
                     description TEXT,
                     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -24,100 +498,971 @@ class UserDataHandler:
             conn.execute('CREATE INDEX IF NOT EXISTS idx_user_data_type ON user_data(user_id, data_type)')
             conn.execute('CREATE INDEX IF NOT EXISTS idx_updated_at ON user_data(updated_at)')
 
+            # user_data_current：每個 (user_id, data_type) 只保留一筆目前值
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS user_data_current (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    data_type TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    value_num REAL,
+                    value_date TEXT,
+                    unit TEXT,
+                    description TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(user_id, data_type)
+                )
+            ''')
+            # leave_history：請假紀錄，依 (user_id, start_date) 查詢
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS leave_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    leave_type TEXT NOT NULL,
+                    start_date TEXT NOT NULL,
+                    end_date TEXT NOT NULL,
+                    days REAL NOT NULL,
+                    reason TEXT,
+                    approved_by TEXT,
+                    approved_at TEXT,
+                    previous_leave_days REAL,
+                    remaining_leave_days REAL,
+                    recorded_at TEXT NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_leave_history_user_start ON leave_history(user_id, start_date)')
+            # 匯出依 (updated_at, id) 順序分頁
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_current_updated_at ON user_data_current(updated_at)')
+            # user_data_changes：欄位值的變更紀錄，依 (user_id, seq) 續傳
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS user_data_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    data_type TEXT NOT NULL,
+                    value REAL,
+                    unit TEXT,
+                    description TEXT,
+                    changed_at TEXT NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_changes_user_seq ON user_data_changes(user_id, seq)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_changes_changed_at ON user_data_changes(changed_at)')
+            # user_data_rollup：超過保留期限的歷史紀錄壓縮成每日 / 每月彙總
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS user_data_rollup (
+                    user_id TEXT NOT NULL,
+                    data_type TEXT NOT NULL,
+                    period TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    unit TEXT,
+                    first_value REAL,
+                    first_at TEXT NOT NULL,
+                    last_value REAL,
+                    last_at TEXT NOT NULL,
+                    min_value REAL,
+                    max_value REAL,
+                    sum_value REAL,
+                    samples INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, data_type, period, bucket)
+                ) WITHOUT ROWID
+            ''')
+            # staff_profile：company.db 員工資料的副本，年資等欄位在匯入時預先計算
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS staff_profile (
+                    staff_id TEXT PRIMARY KEY,
+                    first_name TEXT,
+                    last_name TEXT,
+                    email TEXT,
+                    hire_date TEXT,
+                    job_title TEXT,
+                    dept_name TEXT,
+                    phone TEXT,
+                    manager_id TEXT,
+                    status TEXT,
+                    full_name TEXT,
+                    manager_name TEXT,
+                    tenure_days INTEGER,
+                    tenure_months INTEGER,
+                    tenure_years INTEGER,
+                    seniority_rank INTEGER,
+                    dept_headcount INTEGER,
+                    tenure_as_of TEXT NOT NULL,
+                    synced_at TEXT NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS dept_aggregate (
+                    dept_name TEXT NOT NULL,
+                    data_type TEXT NOT NULL,
+                    members INTEGER NOT NULL,
+                    value_sum REAL NOT NULL,
+                    PRIMARY KEY (dept_name, data_type)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS dept_date_aggregate (
+                    dept_name TEXT NOT NULL,
+                    data_type TEXT NOT NULL,
+                    value_date TEXT NOT NULL,
+                    members INTEGER NOT NULL,
+                    PRIMARY KEY (dept_name, data_type, value_date)
+                ) WITHOUT ROWID
+            ''')
+            # value_num / value_date：第 3 版加入的型別欄位 (value 保留原本的格式供 API 回傳)
+            for table in ('user_data', 'user_data_current'):
+                columns = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+                for column, column_type in (('value_num', 'REAL'), ('value_date', 'TEXT')):
+                    if column not in columns:
+                        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+            # 依日期範圍查詢 (例如即將發放獎金的使用者)
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_current_type_date
+                    ON user_data_current(data_type, value_date, user_id) WHERE value_date IS NOT NULL
+            ''')
+            # trigger 每次都重新建立，定義改變時不需要另外遷移；遷移期間先移除，整理完資料再重算彙總
+            for name in DEPT_AGGREGATE_TRIGGERS:
+                conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+            self._migrate(conn)
+            for name, body in DEPT_AGGREGATE_TRIGGERS.items():
+                conn.execute(f'CREATE TRIGGER {name} {body}')
+
+    def _migrate(self, conn: sqlite3.Connection) -> None:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < 1:
+            # 舊版資料庫只有 user_data，取每個 key 最新的一筆搬到 user_data_current
+            conn.execute('''
+                INSERT INTO user_data_current (user_id, data_type, value, unit, description, created_at, updated_at)
+                SELECT user_id, data_type, value, unit, description, created_at, updated_at
+                  FROM user_data u
+                 WHERE u.id = (
+                    SELECT ud2.id FROM user_data ud2
+                     WHERE ud2.user_id = u.user_id AND ud2.data_type = u.data_type
+                     ORDER BY ud2.updated_at DESC, ud2.id DESC
+                     LIMIT 1
+                 )
+                ON CONFLICT(user_id, data_type) DO NOTHING
+            ''')
+        if version < 3:
+            # 型別欄位在第 3 版加入：整理既有資料 (例如 20251215 -> '2025-12-15')
+            self._normalize_typed_values(conn)
+            # 部門彙總在第 2 版加入、第 3 版改依型別欄位計算，以既有資料完整重算
+            self._rebuild_aggregates(conn)
+        if version < SCHEMA_VERSION:
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    @staticmethod
+    def _normalize_typed_values(conn: sqlite3.Connection) -> None:
+        for table in ('user_data', 'user_data_current'):
+            conn.execute(f'''
+                UPDATE {table} SET value_num = value
+                 WHERE value_num IS NULL AND unit IS NOT '{DATE_UNIT}' AND typeof(value) IN ('integer', 'real')
+            ''')
+            rows = conn.execute(
+                f'SELECT id, value FROM {table} WHERE unit = ? AND value_date IS NULL', (DATE_UNIT,)
+            ).fetchall()
+            updates, invalid = [], 0
+            for row in rows:
+                try:
+                    day = normalize_date(row['value'])
+                except ValueError:
+                    invalid += 1
+                    continue
+                updates.append((day, day, row['id']))
+            conn.executemany(f'UPDATE {table} SET value = ?, value_date = ? WHERE id = ?', updates)
+            if invalid:
+                logger.warning(f"{invalid} rows in {table} have a date value that could not be parsed")
+
+    @staticmethod
+    def _now() -> str:
+        return now_timestamp()
+
+    def _write_rows(self, conn: sqlite3.Connection, updates: list, now: str) -> None:
+        rows = []
+        normalized = []
+        for user_id, data_type, value, unit, description in updates:
+            value, value_num, value_date = typed_value(value, unit)
+            rows.append((user_id, data_type, value, value_num, value_date, unit, description, now, now))
+            normalized.append((user_id, data_type, value, unit, description))
+        conn.executemany(UPSERT_CURRENT_SQL, rows)
+        if self.keep_history:
+            conn.executemany(INSERT_HISTORY_SQL, rows)
+        self._record_changes(conn, normalized, now)
+
     def _has_any_data(self, user_id: str) -> bool:
-        with sqlite3.connect(self.db_path) as conn:
-            cur = conn.execute('SELECT 1 FROM user_data WHERE user_id = ? LIMIT 1', (user_id,))
+        with self.pool.connection() as conn:
+            cur = conn.execute('SELECT 1 FROM user_data_current WHERE user_id = ? LIMIT 1', (user_id,))
             return cur.fetchone() is not None
 
+    @staticmethod
+    def _map_updates(user_id: str, backend_response: Dict[str, Any]) -> list:
+        updates = []
+        for key, value in backend_response.items():
+            if key in DATA_MAPPING and value is not None:
+                data_type, unit, description = DATA_MAPPING[key]
+                # 先整理成寫入時的格式，與資料庫中的值比較才會一致
+                updates.append((user_id, data_type, typed_value(value, unit)[0], unit, description))
+        return updates
+
     def seed_defaults(self, user_id: str) -> None:
-        now = datetime.now()
-        defaults = [
-            ('leave_days',    15,  'days',  '剩餘特休天數'),
-            ('meal_allowance',     100,  'ntd',   '剩餘餐補'),
-            ('overtime_hours', 30,  'hours', '加班時數'),
-            ('salary',   28000,  'ntd',   '薪水'),
-            ('next_bonus_date',    '2025-09-22', 'date',  '下次獎金發放時間'),
-        ]
-        with sqlite3.connect(self.db_path) as conn:
-            for data_type, value, unit, description in defaults:
-                cur = conn.execute('''
-                    UPDATE user_data
-                       SET value = ?, unit = ?, description = ?, updated_at = ?
-                     WHERE user_id = ? AND data_type = ?
-                ''', (value, unit, description, now, user_id, data_type))
-                if cur.rowcount == 0:
-                    conn.execute('''
-                        INSERT INTO user_data (user_id, data_type, value, unit, description, updated_at)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (user_id, data_type, value, unit, description, now))
+        rows = self._map_updates(user_id, DEFAULT_VALUES)
+        with self.pool.transaction() as conn:
+            self._write_rows(conn, rows, self._now())
+        self._notify_write(user_id, sorted(row[1] for row in rows))
 
-    def process_backend_data(self, user_id: str, backend_response: Dict[str, Any]):
-        if not self._has_any_data(user_id):
-            self.seed_defaults(user_id)
-
-        data_mapping = {
-            'leave_days': ('leave', 'days', '剩餘特休天數'),
-            'meal_allowance': ('meal', 'ntd', '剩餘餐補'),
-            'overtime_hours': ('overtime', 'hours', '加班時數'),
-            'salary': ('salary', 'ntd', '薪水'),
-            'next_bonus_date': ('bonus', 'date', '下次獎金發放時間')
+    def ingest_backend_data(self, user_id: str, backend_response: Dict[str, Any],
+                            as_of: Optional[str] = None) -> Dict[str, Any]:
+        """
+        在單一交易內完成：沒有資料時先寫入預設值、套用更新、回傳最新資料
+        只有值真的改變的欄位才會寫入，並回報在 changed_fields
+        as_of 是這份資料產生的時間 (例如送進 write-behind 佇列的時間)；
+        資料庫中 updated_at 晚於 as_of 的欄位已經有較新的寫入 (例如扣除特休)，不會被覆蓋
+        """
+        updates = self._map_updates(user_id, backend_response)
+        with self.pool.transaction() as conn:
+            profile = self._read_profile(conn, user_id)
+            seeded = not profile
+            pending = {}
+            if seeded:
+                for row in self._map_updates(user_id, DEFAULT_VALUES):
+                    pending[row[1]] = row
+            for row in updates:
+                pending[row[1]] = row
+
+            now = self._now()
+            changed = []
+            for data_type, (_, _, value, unit, description) in pending.items():
+                current = profile.get(data_type)
+                if current and (current['value'], current['unit'], current['description']) == (value, unit, description):
+                    continue
+                if current and as_of is not None and current['updated_at'] > as_of:
+                    continue
+                changed.append(pending[data_type])
+                profile[data_type] = {
+                    # 與 REAL 欄位存回來的型別一致
+                    'value': float(value) if isinstance(value, int) else value,
+                    'unit': unit,
+                    'description': description,
+                    'updated_at': now
+                }
+            if changed:
+                self._write_rows(conn, changed, now)
+
+        changed_fields = sorted(row[1] for row in changed)
+        if changed_fields:
+            self._notify_write(user_id, changed_fields)
+        return {
+            'updated_count': len(updates),
+            'changed_fields': changed_fields,
+            'seeded': seeded,
+            'current_data': dict(sorted(profile.items()))
         }
-        
-        updates = []
-        for key, value in backend_response.items():
-            if key in data_mapping and value is not None:
-                data_type, unit, description = data_mapping[key]
-                updates.append((user_id, data_type, value, unit, description))
-        
-        if updates:
-            self.batch_update_data(updates)
-            return len(updates)
-        return 0
-    
+
+    def ingest_backend_batch(self, items: list, chunk_size: int = 500) -> List[Dict[str, Any]]:
+        """
+        批次處理多位使用者的 LLM 回調資料
+        每 chunk_size 筆共用一個交易；每筆資料各自包在 SAVEPOINT 中，單筆錯誤不影響其他資料
+        項目可帶 as_of (見 ingest_backend_data)
+        每個項目都有一筆結果；交易本身失敗 (例如資料庫被鎖住) 時該 chunk 的項目帶 retryable=True
+        """
+        results = []
+        for start in range(0, len(items), chunk_size):
+            chunk = items[start:start + chunk_size]
+            chunk_results = []
+            try:
+                with self.pool.transaction():
+                    for index, item in enumerate(chunk, start):
+                        chunk_results.append(self._ingest_batch_item(index, item))
+            except Exception as e:
+                # BEGIN 或 commit 失敗時整個 chunk 都沒有寫入
+                for result in chunk_results:
+                    if result['success']:
+                        result.update(batch_error(result['index'], result['user_id'], e))
+                        result.pop('changed_fields', None)
+                        result.pop('updated_count', None)
+                for index in range(start + len(chunk_results), start + len(chunk)):
+                    item = items[index]
+                    chunk_results.append(batch_error(index, item.get('user_id') if isinstance(item, dict) else None, e))
+            results.extend(chunk_results)
+        return results
+
+    def _ingest_batch_item(self, index: int, item: Any) -> Dict[str, Any]:
+        user_id = item.get('user_id') if isinstance(item, dict) else None
+        try:
+            if not isinstance(user_id, str) or not user_id:
+                raise ValueError('user_id is required')
+            extracted_data = item.get('extracted_data')
+            if not isinstance(extracted_data, dict):
+                raise ValueError('extracted_data must be an object')
+            as_of = item.get('as_of')
+            if as_of is not None and not isinstance(as_of, str):
+                raise ValueError('as_of must be a timestamp string')
+            result = self.ingest_backend_data(user_id, extracted_data, as_of=as_of)
+        except Exception as e:
+            return {'index': index, 'user_id': user_id, 'success': False, 'error': str(e)}
+        return {
+            'index': index,
+            'user_id': user_id,
+            'success': True,
+            'updated_count': result['updated_count'],
+            'changed_fields': result['changed_fields']
+        }
+
+    def process_backend_data(self, user_id: str, backend_response: Dict[str, Any]):
+        return self.ingest_backend_data(user_id, backend_response)['updated_count']
+
     def batch_update_data(self, updates: list):
-        now = datetime.now()
-        with sqlite3.connect(self.db_path) as conn:
-            for user_id, data_type, value, unit, description in updates:
-                cur = conn.execute('''
-                    UPDATE user_data
-                       SET value = ?, unit = ?, description = ?, updated_at = ?
+        with self.pool.transaction() as conn:
+            self._write_rows(conn, updates, self._now())
+        changed = {}
+        for user_id, data_type, *_ in updates:
+            changed.setdefault(user_id, set()).add(data_type)
+        for user_id, data_types in changed.items():
+            self._notify_write(user_id, sorted(data_types))
+
+    def record_leave(self, user_id: str, leave_type: str, start_date: str, end_date: str,
+                     days: float, reason: str = '', approved_by: str = 'system',
+                     approved_at: Optional[str] = None) -> Dict[str, Any]:
+        """
+        寫入請假紀錄；特休假在同一個交易內以單一 UPDATE 原子扣除剩餘特休
+        回傳寫入的紀錄 (含扣除前後的特休天數)；日期不是 YYYY-MM-DD、開始晚於結束或天數不合法時拋出 ValueError
+        """
+        start_date, end_date = parse_date_range(start_date, end_date, required=True)
+        if isinstance(days, bool) or not isinstance(days, (int, float)) or not math.isfinite(days) or days < 0:
+            raise ValueError(f'Invalid days: {days!r}')
+        now = self._now()
+        deduct = leave_type == ANNUAL_LEAVE_TYPE
+        data_type, unit, description = DATA_MAPPING['leave_days']
+        with self.pool.transaction() as conn:
+            if deduct:
+                # 新使用者先寫入預設值，再從預設特休扣除
+                self.ingest_backend_data(user_id, {})
+            row = conn.execute(
+                'SELECT value FROM user_data_current WHERE user_id = ? AND data_type = ?',
+                (user_id, data_type)
+            ).fetchone()
+            previous = row['value'] if row else 0
+            remaining = previous
+            updated = False
+            if deduct and row:
+                row = conn.execute('''
+                    UPDATE user_data_current
+                       SET value = MAX(0.0, value - ?), value_num = MAX(0.0, value - ?), updated_at = ?
                      WHERE user_id = ? AND data_type = ?
-                ''', (value, unit, description, now, user_id, data_type))
-                if cur.rowcount == 0:
-                    conn.execute('''
-                        INSERT INTO user_data (user_id, data_type, value, unit, description, updated_at)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (user_id, data_type, value, unit, description, now))
+                    RETURNING value, unit, description
+                ''', (days, days, now, user_id, data_type)).fetchone()
+                remaining = float(row['value'])
+                updated = True
+                if self.keep_history:
+                    conn.execute(INSERT_HISTORY_SQL, (user_id, data_type, remaining, remaining, None, row['unit'],
+                                                      row['description'], now, now))
+                self._record_changes(conn, [(user_id, data_type, remaining, row['unit'], row['description'])], now)
+
+            record = {
+                'user_id': user_id,
+                'leave_type': leave_type,
+                'start_date': start_date,
+                'end_date': end_date,
+                'days': days,
+                'reason': reason,
+                'approved_by': approved_by,
+                'approved_at': approved_at or datetime.now().isoformat(),
+                'recorded_at': datetime.now().isoformat(),
+                'previous_leave_days': previous,
+                'remaining_leave_days': remaining
+            }
+            cur = conn.execute('''
+                INSERT INTO leave_history (user_id, leave_type, start_date, end_date, days, reason,
+                                           approved_by, approved_at, previous_leave_days,
+                                           remaining_leave_days, recorded_at)
+                VALUES (:user_id, :leave_type, :start_date, :end_date, :days, :reason,
+                        :approved_by, :approved_at, :previous_leave_days,
+                        :remaining_leave_days, :recorded_at)
+            ''', record)
+            record['id'] = cur.lastrowid
+            record['database_updated'] = updated
+
+        if updated:
+            self._notify_write(user_id, [data_type])
+        return record
+
+    def get_leave_history(self, user_id: str, start_date: Optional[str] = None,
+                          end_date: Optional[str] = None, leave_type: Optional[str] = None,
+                          limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+        """依開始日期區間查詢請假紀錄 (新到舊)，由 (user_id, start_date) 索引提供"""
+        start_date, end_date = parse_date_range(start_date, end_date)
+        conditions = ['user_id = ?']
+        params = [user_id]
+        if start_date:
+            conditions.append('start_date >= ?')
+            params.append(start_date)
+        if end_date:
+            conditions.append('start_date <= ?')
+            params.append(end_date)
+        if leave_type:
+            conditions.append('leave_type = ?')
+            params.append(leave_type)
+        with self.pool.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT * FROM leave_history
+                WHERE {' AND '.join(conditions)}
+                ORDER BY start_date DESC, id DESC
+                LIMIT ? OFFSET ?
+            ''', params + [limit + 1, offset]).fetchall()
+        records = [dict(row) for row in rows[:limit]]
+        return {
+            'records': records,
+            'has_more': len(rows) > limit,
+            'next_offset': offset + limit if len(rows) > limit else None
+        }
+
+    def compact_history(self, retention_days: int = 90, day_retention_days: int = 400,
+                        batch_size: int = 1000, max_batches: Optional[int] = None,
+                        pause: float = 0.01, change_retention_days: int = 7) -> Dict[str, Any]:
+        """
+        把 updated_at 早於 retention_days 天前的歷史紀錄併入每日與每月彙總後刪除
+        每批 batch_size 筆各自一個短交易，批次之間暫停 pause 秒讓其他寫入取得鎖；
+        max_batches 限制這次最多處理幾批，剩下的下次再處理 (remaining=True)
+        每日彙總只保留 day_retention_days 天，每月彙總永久保留；變更紀錄只保留 change_retention_days 天
+        """
+        started = time.perf_counter()
+        now = datetime.now()
+        cutoff = (now - timedelta(days=retention_days)).isoformat(sep=' ')
+        day_cutoff = (now - timedelta(days=day_retention_days)).strftime('%Y-%m-%d')
+        change_cutoff = (now - timedelta(days=change_retention_days)).isoformat(sep=' ')
+        report = {'cutoff': cutoff, 'rows_compacted': 0, 'buckets_written': 0,
+                  'day_buckets_pruned': 0, 'changes_pruned': 0, 'batches': 0, 'remaining': False}
+
+        while True:
+            if max_batches is not None and report['batches'] >= max_batches:
+                report['remaining'] = True
+                break
+            with self.pool.transaction() as conn:
+                rows = conn.execute('''
+                    SELECT id, user_id, data_type, value, unit, updated_at FROM user_data
+                    WHERE updated_at < ?
+                    ORDER BY updated_at, id
+                    LIMIT ?
+                ''', (cutoff, batch_size)).fetchall()
+                if rows:
+                    values = [tuple(row)[1:] for row in rows]
+                    rollups = []
+                    for period, width in ROLLUP_PERIODS.items():
+                        for (user_id, data_type, bucket), agg in _aggregate_rows(values, width).items():
+                            rollups.append((
+                                user_id, data_type, period, bucket, agg['unit'],
+                                agg['first_value'], agg['first_at'], agg['last_value'], agg['last_at'],
+                                agg['min_value'], agg['max_value'], agg['sum_value'], agg['samples']
+                            ))
+                    conn.executemany(UPSERT_ROLLUP_SQL, rollups)
+                    conn.executemany('DELETE FROM user_data WHERE id = ?', [(row['id'],) for row in rows])
+                    report['rows_compacted'] += len(rows)
+                    report['buckets_written'] += len(rollups)
+                    report['batches'] += 1
+            if len(rows) < batch_size:
+                break
+            time.sleep(pause)
+
+        if not report['remaining']:
+            with self.pool.transaction() as conn:
+                report['day_buckets_pruned'] = conn.execute(
+                    "DELETE FROM user_data_rollup WHERE period = 'day' AND bucket < ?", (day_cutoff,)
+                ).rowcount
+                report['changes_pruned'] = conn.execute(
+                    'DELETE FROM user_data_changes WHERE changed_at < ?', (change_cutoff,)
+                ).rowcount
+        if report['rows_compacted']:
+            with self.pool.connection() as conn:
+                conn.execute('PRAGMA optimize')
+        report['took_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return report
+
+    def sync_staff(self, source_path: str, today: Optional[str] = None) -> Dict[str, Any]:
+        """
+        把 company.db 的 staff 匯入 staff_profile，並以 today (預設今天) 計算年資與部門內年資排名
+        只改寫內容有變的員工，並對他們通知 write listener (changed_fields=['staff'])；
+        年資每天變動，所以換日後第一次匯入會改寫所有員工
+        """
+        started = time.perf_counter()
+        as_of = date.fromisoformat(today) if today else date.today()
+        source = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True)
+        try:
+            rows = source.execute(f"SELECT {', '.join(STAFF_SOURCE_COLUMNS)} FROM staff").fetchall()
+        finally:
+            source.close()
+        profiles = _build_staff_profiles(rows, as_of)
+
+        now = self._now()
+        with self.pool.transaction() as conn:
+            existing = {
+                row[0]: tuple(row)
+                for row in conn.execute(f"SELECT {', '.join(STAFF_PROFILE_COLUMNS)} FROM staff_profile")
+            }
+            changed = [profile for profile in profiles if existing.get(profile[0]) != profile]
+            removed = sorted(existing.keys() - {profile[0] for profile in profiles})
+            conn.executemany(UPSERT_STAFF_SQL, [profile + (now,) for profile in changed])
+            conn.executemany('DELETE FROM staff_profile WHERE staff_id = ?', [(staff_id,) for staff_id in removed])
+        for staff_id in [profile[0] for profile in changed] + removed:
+            self._notify_write(staff_id, ['staff'])
+        return {
+            'staff': len(profiles),
+            'changed': len(changed),
+            'removed': len(removed),
+            'tenure_as_of': as_of.isoformat(),
+            'took_ms': round((time.perf_counter() - started) * 1000, 3)
+        }
+
+    def get_profile(self, user_id: str) -> Dict[str, Any]:
+        """
+        員工資料 (staff_profile) 與目前的資料值 (user_data_current) 以一次查詢合併
+        回傳 {'staff': 員工欄位或 None, 'data': 與 get_user_data 相同的格式}
+        """
+        pending = self._pending_for([user_id]).get(user_id)
+        staff_fields = STAFF_PROFILE_COLUMNS + ('synced_at',)
+        staff_columns = ', '.join(f's.{column}' for column in staff_fields)
+        with self.pool.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT {staff_columns}, c.data_type, c.value, c.unit, c.description, c.updated_at
+                  FROM (SELECT ? AS user_id) u
+                  LEFT JOIN staff_profile s ON s.staff_id = u.user_id
+                  LEFT JOIN user_data_current c ON c.user_id = u.user_id
+                 ORDER BY c.data_type
+            ''', (user_id,)).fetchall()
+        first = rows[0]
+        staff = {column: first[column] for column in staff_fields} if first['staff_id'] is not None else None
+        data = {row['data_type']: self._profile_entry(row) for row in rows if row['data_type'] is not None}
+        if pending:
+            data = self._apply_pending(user_id, data, pending)
+        return {'staff': staff, 'data': data}
+
+    @staticmethod
+    def _rebuild_aggregates(conn: sqlite3.Connection) -> None:
+        conn.execute('DELETE FROM dept_aggregate')
+        conn.execute('DELETE FROM dept_date_aggregate')
+        conn.execute(f'INSERT INTO dept_aggregate (dept_name, data_type, members, value_sum) {DEPT_NUMERIC_SQL}')
+        conn.execute(f'INSERT INTO dept_date_aggregate (dept_name, data_type, value_date, members) {DEPT_DATE_SQL}')
+
+    def rebuild_aggregates(self, verify_only: bool = False, max_examples: int = 20) -> Dict[str, Any]:
+        """
+        以完整掃描重新計算部門彙總並與 trigger 維護的結果比對
+        verify_only=False 時再以重新計算的結果取代 (同一個交易內)
+        """
+        started = time.perf_counter()
+        mismatches = []
+        with self.pool.transaction() as conn:
+            for table, sql, key_columns, value_columns in (
+                ('dept_aggregate', DEPT_NUMERIC_SQL, ('dept_name', 'data_type'), ('members', 'value_sum')),
+                ('dept_date_aggregate', DEPT_DATE_SQL, ('dept_name', 'data_type', 'value_date'), ('members',))
+            ):
+                expected = {tuple(row[c] for c in key_columns): tuple(row[c] for c in value_columns)
+                            for row in conn.execute(sql)}
+                actual = {tuple(row[c] for c in key_columns): tuple(row[c] for c in value_columns)
+                          for row in conn.execute(f'SELECT * FROM {table}')}
+                for key in sorted(expected.keys() | actual.keys()):
+                    want, got = expected.get(key), actual.get(key)
+                    # 總和經過多次加減會有浮點誤差
+                    if want is None or got is None or want[0] != got[0] or any(
+                            abs(a - b) > 1e-6 * max(1.0, abs(a)) for a, b in zip(want[1:], got[1:])):
+                        mismatches.append({'table': table, 'key': list(key), 'expected': want, 'actual': got})
+            if not verify_only:
+                self._rebuild_aggregates(conn)
+            departments = conn.execute('SELECT COUNT(DISTINCT dept_name) FROM dept_aggregate').fetchone()[0]
+        return {
+            'departments': departments,
+            'mismatches': len(mismatches),
+            'examples': mismatches[:max_examples],
+            'rebuilt': not verify_only,
+            'took_ms': round((time.perf_counter() - started) * 1000, 3)
+        }
+
+    def get_department_aggregates(self, dept_name: Optional[str] = None, upcoming_limit: int = 5,
+                                  today: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        從彙總表讀取各部門 (或單一部門) 的數值欄位人數 / 總和 / 平均，
+        以及日期欄位中 today (預設今天) 起最近的 upcoming_limit 個日期與人數；查詢量與部門人數無關
+        """
+        today = today or date.today().isoformat()
+        units = {data_type: unit for data_type, unit, _ in DATA_MAPPING.values()}
+        where, params = ('WHERE dept_name = ?', [dept_name]) if dept_name is not None else ('', [])
+        result = {}
+        with self.pool.connection() as conn:
+            for row in conn.execute(f'SELECT * FROM dept_aggregate {where} ORDER BY dept_name, data_type', params):
+                department = result.setdefault(row['dept_name'], {'metrics': {}, 'upcoming': {}})
+                department['metrics'][row['data_type']] = {
+                    'members': row['members'],
+                    'total': round(row['value_sum'], 4),
+                    'average': round(row['value_sum'] / row['members'], 2),
+                    'unit': units.get(row['data_type'])
+                }
+            rows = conn.execute(f'''
+                SELECT dept_name, data_type, value_date, members FROM (
+                    SELECT *, ROW_NUMBER() OVER (PARTITION BY dept_name, data_type ORDER BY value_date) AS n
+                      FROM dept_date_aggregate
+                     {where + ' AND' if where else 'WHERE'} value_date >= ?
+                ) WHERE n <= ?
+                ORDER BY dept_name, data_type, value_date
+            ''', params + [today, upcoming_limit])
+            for row in rows:
+                department = result.setdefault(row['dept_name'], {'metrics': {}, 'upcoming': {}})
+                department['upcoming'].setdefault(row['data_type'], []).append(
+                    {'date': row['value_date'], 'members': row['members']}
+                )
+        return result
+
+    def get_upcoming(self, data_type: str, start: str, end: str, limit: int = 1000) -> List[Dict[str, Any]]:
+        """
+        日期欄位落在 [start, end] (YYYY-MM-DD) 的使用者，依日期、user_id 排序
+        走 idx_current_type_date 的範圍掃描；有員工資料時附上姓名、email 與部門
+        """
+        with self.pool.connection() as conn:
+            rows = conn.execute('''
+                SELECT c.user_id, c.value_date, c.description, c.updated_at,
+                       s.full_name, s.email, s.dept_name
+                  FROM user_data_current c
+                  LEFT JOIN staff_profile s ON s.staff_id = c.user_id
+                 WHERE c.data_type = ? AND c.value_date IS NOT NULL AND c.value_date BETWEEN ? AND ?
+                 ORDER BY c.value_date, c.user_id
+                 LIMIT ?
+            ''', (data_type, start, end, limit)).fetchall()
+        return [{
+            'user_id': row['user_id'],
+            'date': row['value_date'],
+            'description': row['description'],
+            'updated_at': row['updated_at'],
+            'full_name': row['full_name'],
+            'email': row['email'],
+            'dept_name': row['dept_name']
+        } for row in rows]
+
+    def get_changes(self, user_id: str, after_seq: int, limit: int = 500) -> List[Dict[str, Any]]:
+        """seq 大於 after_seq 的變更紀錄 (依 seq 由舊到新)"""
+        with self.pool.connection() as conn:
+            rows = conn.execute('''
+                SELECT seq, data_type, value, unit, description, changed_at AS updated_at
+                FROM user_data_changes
+                WHERE user_id = ? AND seq > ?
+                ORDER BY seq
+                LIMIT ?
+            ''', (user_id, after_seq, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def change_log_bounds(self, user_id: Optional[str] = None):
+        """
+        回傳 (oldest, latest)：仍保留的最舊 seq 與目前已配發的最大 seq
+        seq 小於 oldest - 1 的續傳位置可能有已清除的紀錄，需要重新取得完整資料
+        user_id 供分片時選擇檔案用 (見 sharding.py)，單一檔案時整個資料庫共用同一組 seq
+        """
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'user_data_changes'").fetchone()
+            latest = row['seq'] if row else 0
+            oldest = conn.execute('SELECT MIN(seq) FROM user_data_changes').fetchone()[0]
+        return (oldest if oldest is not None else latest + 1), latest
+
+    def get_trend(self, user_id: str, data_type: str, period: str = 'month',
+                  start: Optional[str] = None, end: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        依日 / 月列出某個欄位的變化 (first / last / min / max / avg / samples)
+        已壓縮的區間讀彙總表，保留期限內的區間由歷史紀錄即時彙總，跨越兩者的 bucket 會合併
+        start / end 為 bucket 字串 (含)，例如 period=month 時的 2025-01
+        """
+        if period not in ROLLUP_PERIODS:
+            raise ValueError(f'period must be one of: {", ".join(ROLLUP_PERIODS)}')
+        width = ROLLUP_PERIODS[period]
+        conditions = ['user_id = ?', 'data_type = ?', 'period = ?']
+        params = [user_id, data_type, period]
+        if start:
+            conditions.append('bucket >= ?')
+            params.append(start)
+        if end:
+            conditions.append('bucket <= ?')
+            params.append(end)
+
+        buckets = {}
+        with self.pool.connection() as conn:
+            for row in conn.execute(f'''
+                SELECT bucket, unit, first_value, first_at, last_value, last_at,
+                       min_value, max_value, sum_value, samples
+                FROM user_data_rollup
+                WHERE {' AND '.join(conditions)}
+            ''', params):
+                buckets[row['bucket']] = dict(row)
+            raw = conn.execute(f'''
+                SELECT user_id, data_type, value, unit, updated_at FROM user_data
+                WHERE user_id = ? AND data_type = ?{' AND updated_at >= ?' if start else ''}
+                ORDER BY updated_at, id
+            ''', [user_id, data_type] + ([start] if start else [])).fetchall()
+
+        for (_, _, bucket), agg in _aggregate_rows([tuple(row) for row in raw], width).items():
+            if end and bucket > end:
+                continue
+            buckets[bucket] = _merge_bucket(buckets.pop(bucket), agg) if bucket in buckets else agg
+
+        trend = []
+        for bucket in sorted(buckets):
+            agg = buckets[bucket]
+            trend.append({
+                'bucket': bucket,
+                'unit': agg['unit'],
+                'first': agg['first_value'],
+                'last': agg['last_value'],
+                'min': agg['min_value'],
+                'max': agg['max_value'],
+                'avg': round(agg['sum_value'] / agg['samples'], 4) if agg['sum_value'] is not None else None,
+                'samples': agg['samples'],
+                'last_updated': agg['last_at']
+            })
+        return trend
+
+    @staticmethod
+    def _profile_entry(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            'value': row['value'],
+            'unit': row['unit'],
+            'description': row['description'],
+            'updated_at': row['updated_at']
+        }
+
+    def _read_profile(self, conn: sqlite3.Connection, user_id: str) -> Dict[str, Any]:
+        cursor = conn.execute('''
+            SELECT data_type, value, unit, description, updated_at
+            FROM user_data_current
+            WHERE user_id = ?
+            ORDER BY data_type
+        ''', (user_id,))
+        result = {}
+        for row in cursor.fetchall():
+            result[row['data_type']] = self._profile_entry(row)
+        return result
+
+    def get_users_data(self, user_ids: List[str], chunk_size: int = 500) -> Dict[str, Dict[str, Any]]:
+        """一次查詢多位使用者的完整資料 (IN 查詢)，沒有資料的使用者不會出現在結果中"""
+        result = {}
+        unique_ids = list(dict.fromkeys(user_ids))
+        # 先取待寫入的值再讀資料庫：期間完成的 flush 只會讓兩邊的值相同，不會漏掉
+        pending = self._pending_for(unique_ids)
+        with self.pool.connection() as conn:
+            for start in range(0, len(unique_ids), chunk_size):
+                chunk = unique_ids[start:start + chunk_size]
+                placeholders = ','.join('?' * len(chunk))
+                cursor = conn.execute(f'''
+                    SELECT user_id, data_type, value, unit, description, updated_at
+                    FROM user_data_current
+                    WHERE user_id IN ({placeholders})
+                    ORDER BY user_id, data_type
+                ''', chunk)
+                for row in cursor:
+                    result.setdefault(row['user_id'], {})[row['data_type']] = self._profile_entry(row)
+        for user_id, entry in pending.items():
+            result[user_id] = self._apply_pending(user_id, result.get(user_id, {}), entry)
+        return result
+
+    def iter_export(self, table: str = 'current', updated_from: Optional[str] = None,
+                    updated_to: Optional[str] = None, data_types: Optional[List[str]] = None,
+                    cursor: Optional[str] = None, page_size: int = 1000, fetch_size: int = 200):
+        """
+        依 (updated_at, id) 順序逐筆產生要匯出的資料列 (dict)，updated_from 含、updated_to 不含
+        每頁是一個獨立的短查詢：以 fetchmany 讀完一頁就歸還連線，傳送資料期間不持有讀取交易，
+        記憶體中最多只有一頁；下一頁從上一頁最後一筆的 (updated_at, id) 之後接著讀
+        """
+        if table not in EXPORT_TABLES:
+            raise ValueError(f'table must be one of: {", ".join(EXPORT_TABLES)}')
+        conditions = []
+        params = []
+        if updated_from:
+            conditions.append('updated_at >= ?')
+            params.append(updated_from)
+        if updated_to:
+            conditions.append('updated_at < ?')
+            params.append(updated_to)
+        if data_types:
+            conditions.append(f"data_type IN ({','.join('?' * len(data_types))})")
+            params.extend(data_types)
+        after = decode_export_cursor(cursor) if cursor else None
+
+        while True:
+            page_conditions = list(conditions)
+            page_params = list(params)
+            if after:
+                # 拆成 updated_at >= ? 才能用 updated_at 索引做範圍掃描
+                page_conditions.append('updated_at >= ? AND (updated_at > ? OR id > ?)')
+                page_params.extend([after[0], after[0], after[1]])
+            where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ''
+            page = []
+            with self.pool.connection() as conn:
+                cur = conn.execute(f'''
+                    SELECT {', '.join(EXPORT_COLUMNS)} FROM {EXPORT_TABLES[table]}
+                    {where}
+                    ORDER BY updated_at, id
+                    LIMIT ?
+                ''', page_params + [page_size])
+                while True:
+                    rows = cur.fetchmany(fetch_size)
+                    if not rows:
+                        break
+                    page.extend(rows)
+            for row in page:
+                yield dict(row)
+            if len(page) < page_size:
+                return
+            after = (page[-1]['updated_at'], page[-1]['id'])
 
     def get_user_data(self, user_id: str, data_type: Optional[str] = None) -> Dict[str, Any]:
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        pending = self._pending_for([user_id]).get(user_id)
+        with self.pool.connection() as conn:
             if data_type:
-                cursor = conn.execute('''
-                    SELECT * FROM user_data 
+                cursor = conn.execute(f'''
+                    SELECT {', '.join(USER_DATA_COLUMNS)} FROM user_data_current
                     WHERE user_id = ? AND data_type = ?
-                    ORDER BY updated_at DESC LIMIT 1
                 ''', (user_id, data_type))
                 row = cursor.fetchone()
-                return dict(row) if row else {}
-            else:
-                cursor = conn.execute('''
-                    SELECT data_type, value, unit, description, updated_at
-                    FROM user_data
-                    WHERE user_id = ?
-                      AND updated_at = (
-                        SELECT MAX(updated_at)
-                        FROM user_data ud2
-                        WHERE ud2.user_id = user_data.user_id AND ud2.data_type = user_data.data_type
-                      )
-                    ORDER BY data_type
-                ''', (user_id,))
-                result = {}
-                for row in cursor.fetchall():
-                    result[row['data_type']] = {
-                        'value': row['value'],
-                        'unit': row['unit'],
-                        'description': row['description'],
-                        'updated_at': row['updated_at']
-                    }
-                return result
+                row = dict(row) if row else {}
+                if not pending:
+                    return row
+            profile = self._read_profile(conn, user_id)
+        if pending:
+            profile = self._apply_pending(user_id, profile, pending)
+        if data_type:
+            entry = profile.get(data_type)
+            if not entry:
+                return {}
+            # 待寫入的值套在資料列上，欄位與沒有待寫資料時相同；尚未寫入過的欄位沒有 id
+            row = row or {'id': None, 'user_id': user_id, 'data_type': data_type, 'created_at': entry['updated_at']}
+            return {column: entry.get(column, row.get(column)) for column in USER_DATA_COLUMNS}
+        return profile
+
+
+class HistoryCompactor:
+    """
+    定期在背景執行 compact_history 的執行緒 (每次最多 max_batches 批，剩下的下一輪繼續)
+    錯誤只記錄下來，下一輪會再試
+    """
+
+    def __init__(self, handler: UserDataHandler, interval: float = 3600, logger=None, **options):
+        self.handler = handler
+        self.interval = interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.options = options
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.last_report = self.handler.compact_history(**self.options)
+                if self.last_report['rows_compacted']:
+                    self.logger.info(
+                        f"History compaction: {self.last_report['rows_compacted']} rows into "
+                        f"{self.last_report['buckets_written']} buckets in {self.last_report['took_ms']} ms"
+                    )
+            except Exception as e:
+                self.logger.error(f"History compaction failed: {e}")
+
+    def start(self) -> 'HistoryCompactor':
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='history-compactor', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class StaffSync:
+    """
+    定期從 company.db 匯入員工資料的背景執行緒
+    來源檔案 (含 WAL) 的修改時間或大小改變、或換日 (年資需要重算) 時才呼叫 sync_staff
+    來源檔案不存在時只記一次警告並略過，檔案出現後下一次檢查就會匯入
+    """
+
+    def __init__(self, handler: UserDataHandler, source_path: str, interval: float = 60, logger=None):
+        self.handler = handler
+        self.source_path = source_path
+        self.interval = interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.last_report: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[str] = None
+        self._signature = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _source_signature(self):
+        signature = [date.today().isoformat()]
+        for path in (self.source_path, self.source_path + '-wal'):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def sync(self, force: bool = False) -> Optional[Dict[str, Any]]:
+        """來源有變 (或 force) 時匯入並回傳報告，否則回傳 None"""
+        signature = self._source_signature()
+        if signature[1] is None:
+            raise FileNotFoundError(f'Staff database not found: {self.source_path}')
+        if not force and signature == self._signature:
+            return None
+        self.last_report = self.handler.sync_staff(self.source_path)
+        self._signature = signature
+        self.last_error = None
+        if self.last_report['changed'] or self.last_report['removed']:
+            self.logger.info(
+                f"Staff sync: {self.last_report['changed']} changed, {self.last_report['removed']} removed "
+                f"of {self.last_report['staff']} in {self.last_report['took_ms']} ms"
+            )
+        return self.last_report
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.sync()
+            except FileNotFoundError as e:
+                # 尚未建立 company.db (例如還沒執行 db.js) 不算錯誤
+                if str(e) != self.last_error:
+                    self.logger.warning(f"Staff sync skipped: {e}")
+                self.last_error = str(e)
+            except Exception as e:
+                if str(e) != self.last_error:
+                    self.logger.error(f"Staff sync failed: {e}")
+                self.last_error = str(e)
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self) -> 'StaffSync':
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='staff-sync', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='user_data.db maintenance')
+    parser.add_argument('--db', default=os.getenv('DB_PATH', 'user_data.db'))
+    sub = parser.add_subparsers(dest='command', required=True)
+    aggregates = sub.add_parser('rebuild-aggregates', help='recompute the department aggregates from scratch')
+    aggregates.add_argument('--verify', action='store_true',
+                            help='only compare with the maintained aggregates, exit 1 on mismatch')
+    args = parser.parse_args()
+
+    handler = UserDataHandler(args.db, pool_size=1)
+    try:
+        report = handler.rebuild_aggregates(verify_only=args.verify)
+    finally:
+        handler.close()
+    print(json.dumps(report, ensure_ascii=False))
+    if args.verify and report['mismatches']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
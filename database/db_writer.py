@@ -0,0 +1,435 @@
+"""
+單一 writer 模式：多個 worker process 共用一個負責寫入 SQLite 的 process
+
+    # 啟動端 (serve.py)
+    writer = WriterProcess('user_data.db').start()   # 設定 DB_WRITER_ADDRESS / DB_WRITER_AUTHKEY
+    ...                                               # 啟動 worker (繼承環境變數)
+    writer.stop()
+
+    # worker 端 (api_server.py)
+    db_handler = RemoteWriteHandler(address, authkey, db_path='user_data.db')
+
+worker 直接以 WAL 讀取 SQLite；WRITE_METHODS 經本機 IPC (Unix socket / Windows named pipe)
+送到 writer process 依序執行，不會有多個 process 同時搶寫入鎖。writer 把同時送達的呼叫
+(最多 batch_size 個、最多等 batch_wait 秒) 放在同一個交易內 commit，每個呼叫各自一個 SAVEPOINT，
+單一呼叫失敗不影響同批的其他呼叫。commit 後把寫入通知廣播給所有 worker，
+因此各 worker 的快取失效與 SSE 推送也涵蓋其他 worker 的寫入。
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import secrets
+import signal
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from typing import Any, Dict, List, Optional
+
+from data_handler import UserDataHandler
+
+logger = logging.getLogger(__name__)
+
+# 在 writer 的批次交易中執行的方法
+WRITE_METHODS = ('ingest_backend_data', 'ingest_backend_batch', 'batch_update_data', 'record_leave', 'seed_defaults',
+                 'sync_staff', 'rebuild_aggregates')
+# 不進批次、由連線的執行緒直接執行的方法 (本身已分成多個短交易)
+DIRECT_METHODS = ('compact_history',)
+
+
+class WriterError(RuntimeError):
+    """writer process 無法連線、逾時，或執行時發生 ValueError 以外的錯誤"""
+
+
+def default_address() -> str:
+    name = f'flabba-writer-{os.getpid()}-{secrets.token_hex(4)}'
+    if sys.platform == 'win32':
+        return rf'\\.\pipe\{name}'
+    return os.path.join(tempfile.gettempdir(), f'{name}.sock')
+
+
+def _error(e: Exception):
+    return type(e).__name__, str(e)
+
+
+def _raise(error) -> None:
+    name, message = error
+    if name == 'ValueError':
+        raise ValueError(message)
+    raise WriterError(f'{name}: {message}')
+
+
+# === writer process ===
+class WriterServer:
+    def __init__(self, handler: UserDataHandler, address: str, authkey: bytes,
+                 batch_size: int = 64, batch_wait: float = 0.002):
+        self.handler = handler
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.started_at = time.time()
+        self._requests = queue.Queue()
+        self._connections: Dict[Any, threading.Lock] = {}
+        self._connections_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._outbox = []
+        self._counters = {'calls': 0, 'batches': 0, 'errors': 0, 'largest_batch': 0}
+        # 寫入通知在 commit 後 (同一個執行緒) 觸發，先收集起來再廣播
+        handler.add_write_listener(lambda user_id, fields: self._outbox.append(('write', user_id, fields)))
+        handler.add_change_listener(lambda user_id, events: self._outbox.append(('changes', user_id, events)))
+        self._listener = Listener(address, authkey=authkey)
+
+    def serve(self, stop_event) -> None:
+        """處理請求直到 stop_event 被設定；結束前會寫完已收到的呼叫"""
+        accept = threading.Thread(target=self._accept, name='writer-accept', daemon=True)
+        batches = threading.Thread(target=self._run_batches, name='writer-batches')
+        accept.start()
+        batches.start()
+        stop_event.wait()
+        self._stop.set()
+        self._listener.close()
+        batches.join()
+        with self._connections_lock:
+            connections = list(self._connections)
+        for conn in connections:
+            conn.close()
+
+    def _accept(self) -> None:
+        while not self._stop.is_set():
+            try:
+                conn = self._listener.accept()
+            except Exception as e:
+                if self._stop.is_set():
+                    return
+                logger.warning(f"DB writer rejected a connection: {e}")
+                continue
+            with self._connections_lock:
+                self._connections[conn] = threading.Lock()
+            threading.Thread(target=self._serve_connection, args=(conn,), name='writer-conn', daemon=True).start()
+
+    def _serve_connection(self, conn) -> None:
+        try:
+            while True:
+                kind, req_id, method, args, kwargs = conn.recv()
+                if method in WRITE_METHODS:
+                    self._requests.put((conn, req_id, method, args, kwargs))
+                    continue
+                try:
+                    if method in DIRECT_METHODS:
+                        value = getattr(self.handler, method)(*args, **kwargs)
+                    elif method == 'stats':
+                        value = self.stats()
+                    else:
+                        raise ValueError(f'Unknown writer method: {method}')
+                    self._send(conn, ('result', req_id, True, value))
+                except Exception as e:
+                    self._send(conn, ('result', req_id, False, _error(e)))
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._connections_lock:
+                self._connections.pop(conn, None)
+            conn.close()
+
+    def _send(self, conn, message) -> None:
+        with self._connections_lock:
+            lock = self._connections.get(conn)
+        if lock is None:
+            return
+        try:
+            with lock:
+                conn.send(message)
+        except (OSError, ValueError):
+            with self._connections_lock:
+                self._connections.pop(conn, None)
+
+    def _run_batches(self) -> None:
+        while True:
+            try:
+                first = self._requests.get(timeout=0.2)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._requests.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._execute(batch)
+
+    def _execute(self, batch: List[tuple]) -> None:
+        replies = []
+        self._outbox = []
+        try:
+            with self.handler.pool.transaction():
+                for conn, req_id, method, args, kwargs in batch:
+                    try:
+                        with self.handler.pool.transaction():
+                            value = getattr(self.handler, method)(*args, **kwargs)
+                        replies.append((conn, ('result', req_id, True, value)))
+                    except Exception as e:
+                        replies.append((conn, ('result', req_id, False, _error(e))))
+        except Exception as e:
+            # commit 失敗時整批都沒有寫入
+            logger.error(f"DB writer batch of {len(batch)} failed: {e}")
+            self._outbox = []
+            replies = [(conn, ('result', req_id, False, _error(e))) for conn, req_id, *_ in batch]
+
+        events, self._outbox = self._outbox, []
+        if events:
+            with self._connections_lock:
+                connections = list(self._connections)
+            for conn in connections:
+                self._send(conn, ('events', events))
+        for conn, message in replies:
+            self._send(conn, message)
+        self._counters['calls'] += len(batch)
+        self._counters['batches'] += 1
+        self._counters['errors'] += sum(1 for _, message in replies if not message[2])
+        self._counters['largest_batch'] = max(self._counters['largest_batch'], len(batch))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._connections_lock:
+            connections = len(self._connections)
+        return {
+            'pid': os.getpid(),
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'connections': connections,
+            'queued': self._requests.qsize(),
+            'batch_size': self.batch_size,
+            'avg_batch': round(self._counters['calls'] / self._counters['batches'], 2) if self._counters['batches'] else 0,
+            **self._counters
+        }
+
+
+def run_writer(address: str, authkey: bytes, ready, stop, handler_options: Dict[str, Any],
+               server_options: Dict[str, Any]) -> None:
+    """writer process 的進入點"""
+    # Ctrl+C 會送到整個 process group；writer 要等 worker 都寫完才由啟動端關閉
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    logging.basicConfig(level=logging.INFO)
+    handler = UserDataHandler(**handler_options)
+    try:
+        server = WriterServer(handler, address, authkey, **server_options)
+        ready.set()
+        logger.info(f"DB writer [{os.getpid()}] listening on {address}")
+        server.serve(stop)
+    finally:
+        handler.close()
+        logger.info(f"DB writer [{os.getpid()}] stopped")
+
+
+class WriterProcess:
+    """啟動端：啟動 writer process、意外結束時重新啟動、依序關閉"""
+
+    def __init__(self, db_path: str = 'user_data.db', address: Optional[str] = None,
+                 busy_timeout: int = 5000, batch_size: int = 64, batch_wait: float = 0.002,
+                 start_timeout: float = 30.0, check_interval: float = 1.0):
+        self.address = address or default_address()
+        self.authkey = secrets.token_bytes(16)
+        self.handler_options = {'db_path': db_path, 'pool_size': 2, 'busy_timeout': busy_timeout}
+        self.server_options = {'batch_size': batch_size, 'batch_wait': batch_wait}
+        self.start_timeout = start_timeout
+        self.check_interval = check_interval
+        self.restarts = 0
+        # fork 不會重新 import 啟動端的 __main__；Windows 只能 spawn
+        self._context = multiprocessing.get_context('fork' if sys.platform != 'win32' else 'spawn')
+        self._process = None
+        self._stop_event = None
+        self._stopping = threading.Event()
+        self._monitor = None
+
+    def _remove_socket(self) -> None:
+        if sys.platform != 'win32' and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def _spawn(self) -> None:
+        self._remove_socket()
+        ready = self._context.Event()
+        self._stop_event = self._context.Event()
+        process = self._context.Process(
+            target=run_writer, name='db-writer',
+            args=(self.address, self.authkey, ready, self._stop_event, self.handler_options, self.server_options)
+        )
+        process.start()
+        if not ready.wait(self.start_timeout):
+            process.terminate()
+            raise WriterError(f'DB writer did not start within {self.start_timeout}s (exit code {process.exitcode})')
+        self._process = process
+
+    def start(self) -> 'WriterProcess':
+        self._spawn()
+        os.environ['DB_WRITER_ADDRESS'] = self.address
+        os.environ['DB_WRITER_AUTHKEY'] = self.authkey.hex()
+        self._monitor = threading.Thread(target=self._watch, name='db-writer-monitor', daemon=True)
+        self._monitor.start()
+        return self
+
+    def _watch(self) -> None:
+        while not self._stopping.wait(self.check_interval):
+            if self._process.is_alive():
+                continue
+            logger.error(f"DB writer exited unexpectedly (exit code {self._process.exitcode}), restarting")
+            try:
+                self._spawn()
+                self.restarts += 1
+            except Exception as e:
+                logger.error(f"DB writer restart failed: {e}")
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """等已收到的寫入完成後結束 writer；逾時才強制終止"""
+        self._stopping.set()
+        if self._monitor is not None:
+            self._monitor.join()
+        if self._process is not None:
+            self._stop_event.set()
+            self._process.join(timeout)
+            if self._process.is_alive():
+                logger.error('DB writer did not stop in time, terminating')
+                self._process.terminate()
+                self._process.join()
+        self._remove_socket()
+
+
+# === worker 端 ===
+class RemoteWriteHandler(UserDataHandler):
+    """
+    讀取沿用 UserDataHandler (本機連線池，WAL 下可與 writer 同時進行)；寫入送到 writer process
+    writer 廣播的寫入通知會轉給本機註冊的 write / change listener
+    """
+
+    def __init__(self, address: str, authkey: bytes, timeout: float = 30.0,
+                 connect_timeout: float = 10.0, **options):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._conn = None
+        self._connect_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._waiting: Dict[int, list] = {}
+        self._ids = itertools.count(1)
+        super().__init__(**options)
+
+    def init_database(self):
+        # 建表與遷移由 writer process 負責，worker 不寫入
+        pass
+
+    def close(self):
+        with self._connect_lock:
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+        super().close()
+
+    def _connection(self):
+        with self._connect_lock:
+            if self._conn is not None:
+                return self._conn
+            deadline = time.monotonic() + self.connect_timeout
+            while True:
+                try:
+                    conn = Client(self.address, authkey=self.authkey)
+                    break
+                except (OSError, EOFError) as e:
+                    # writer 重新啟動中
+                    if time.monotonic() >= deadline:
+                        raise WriterError(f'DB writer unavailable at {self.address}: {e}') from e
+                    time.sleep(0.1)
+            self._conn = conn
+            threading.Thread(target=self._read, args=(conn,), name='db-writer-reader', daemon=True).start()
+            return conn
+
+    def _read(self, conn) -> None:
+        try:
+            while True:
+                message = conn.recv()
+                if message[0] == 'result':
+                    waiter = self._waiting.get(message[1])
+                    if waiter is not None:
+                        waiter[1] = (message[2], message[3])
+                        waiter[0].set()
+                elif message[0] == 'events':
+                    self._dispatch_events(message[1])
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._connect_lock:
+                if self._conn is conn:
+                    self._conn = None
+            conn.close()
+            # 等待中的呼叫無法確定是否已寫入，一律回報錯誤
+            for waiter in list(self._waiting.values()):
+                if waiter[1] is None:
+                    waiter[1] = (False, ('ConnectionError', 'DB writer connection lost'))
+                    waiter[0].set()
+
+    def _dispatch_events(self, events: List[tuple]) -> None:
+        for kind, user_id, payload in events:
+            listeners = self._write_listeners if kind == 'write' else self._change_listeners
+            for listener in listeners:
+                try:
+                    listener(user_id, payload)
+                except Exception as e:
+                    logger.error(f"Remote {kind} listener error for {user_id}: {e}")
+
+    def _call(self, method: str, *args, **kwargs):
+        conn = self._connection()
+        req_id = next(self._ids)
+        waiter = [threading.Event(), None]
+        self._waiting[req_id] = waiter
+        try:
+            try:
+                with self._send_lock:
+                    conn.send(('call', req_id, method, args, kwargs))
+            except (OSError, ValueError) as e:
+                raise WriterError(f'DB writer unavailable: {e}') from e
+            if not waiter[0].wait(self.timeout):
+                raise WriterError(f'DB writer did not answer {method} within {self.timeout}s')
+        finally:
+            self._waiting.pop(req_id, None)
+        ok, value = waiter[1]
+        if not ok:
+            _raise(value)
+        return value
+
+    def writer_status(self) -> Dict[str, Any]:
+        """writer 的統計資料與一次往返的耗時 (毫秒)，給健康檢查使用"""
+        started = time.perf_counter()
+        stats = self._call('stats')
+        stats['latency_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        return stats
+
+    def ingest_backend_data(self, user_id: str, backend_response: Dict[str, Any],
+                            as_of: Optional[str] = None) -> Dict[str, Any]:
+        return self._call('ingest_backend_data', user_id, backend_response, as_of=as_of)
+
+    def ingest_backend_batch(self, items: list, chunk_size: int = 500) -> List[Dict[str, Any]]:
+        return self._call('ingest_backend_batch', items, chunk_size=chunk_size)
+
+    def batch_update_data(self, updates: list):
+        return self._call('batch_update_data', updates)
+
+    def seed_defaults(self, user_id: str) -> None:
+        return self._call('seed_defaults', user_id)
+
+    def record_leave(self, user_id: str, leave_type: str, start_date: str, end_date: str,
+                     days: float, reason: str = '', approved_by: str = 'system',
+                     approved_at: Optional[str] = None) -> Dict[str, Any]:
+        return self._call('record_leave', user_id, leave_type, start_date, end_date, days,
+                          reason=reason, approved_by=approved_by, approved_at=approved_at)
+
+    def compact_history(self, **options) -> Dict[str, Any]:
+        return self._call('compact_history', **options)
+
+    def sync_staff(self, source_path: str, today: Optional[str] = None) -> Dict[str, Any]:
+        return self._call('sync_staff', os.path.abspath(source_path), today=today)
+
+    def rebuild_aggregates(self, verify_only: bool = False, max_examples: int = 20) -> Dict[str, Any]:
+        return self._call('rebuild_aggregates', verify_only=verify_only, max_examples=max_examples)
@@ -1,6 +1,84 @@
-from fastapi import FastAPI
+"""
+Database API 的 ASGI 版本
 
-app = FastAPI()
+路由與回應格式都由 api_server.py (Flask) 定義，經由 WSGI 轉接在有上限的 thread pool (DB_THREADS) 中執行，
+兩種啟動方式的行為不會分歧。只有 SSE 變更推送是原生 ASGI：等待通知時不佔用執行緒，
+大量長時間連線也不會用完 thread pool。/ 與 /job_tenure 只在 ASGI 版提供。
+
+正式環境啟動 (多個 worker):
+    python main.py
+    # 或 uvicorn main:app --host 0.0.0.0 --port 5001 --workers 4
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+from a2wsgi import WSGIMiddleware
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount
+
+import api_server
+from api_server import (
+    db_handler, change_feed, get_staff_profile_entry, SSE_HEADERS, SSE_POLL_INTERVAL
+)
+from change_feed import UserEventStream, parse_event_id
+from metrics import end_trace, start_trace
+
+logger = logging.getLogger(__name__)
+
+DB_THREADS = int(os.getenv('DB_THREADS', str(db_handler.pool.pool_size)))
+db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='db')
+api_server.SERVER_INFO.update(server='asgi', db_threads=DB_THREADS)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    db_executor.shutdown(wait=True)
+    # 關閉資料庫前先寫完 write-behind 佇列
+    if api_server.write_queue is not None:
+        api_server.write_queue.close()
+    api_server.staff_sync.stop()
+    db_handler.close()
+
+
+app = FastAPI(title='Database API', lifespan=lifespan)
+
+
+async def run_db(func, *args, **kwargs):
+    """在 DB thread pool 執行阻塞的資料庫呼叫 (帶著目前的 context，SQL 耗時才會記到這個請求上)"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(db_executor, partial(context.run, func, *args, **kwargs))
+
+
+@app.middleware('http')
+async def track_requests(request: Request, call_next):
+    """原生 ASGI 路由的請求計時；交給 Flask 的路由由 Flask 自己的 hook 記錄，這裡略過以免重複"""
+    started = time.perf_counter()
+    trace, token = start_trace()
+    try:
+        response = await call_next(request)
+    finally:
+        end_trace(token)
+    route = request.scope.get('route')
+    if route is not None and not isinstance(route, Mount):
+        elapsed = time.perf_counter() - started
+        api_server.record_request(request.method, route.path, response.status_code, elapsed, trace)
+        response.headers['Server-Timing'] = (
+            f'db;dur={trace.query_seconds * 1000:.2f}, total;dur={elapsed * 1000:.2f}'
+        )
+    return response
+
+
+def error_response(status_code, error, **extra):
+    return JSONResponse({'success': False, 'error': error, **extra}, status_code=status_code)
 
 
 @app.get("/")
@@ -8,5 +86,71 @@ async def root():
     return {"message": "Hello World"}
 
 @app.get("/job_tenure")
-async def get_job_tenure():
-    return {"job_tenure": "5"}
+async def get_job_tenure(user_id: str = ''):
+    """預先計算的年資 (由 company.db 的到職日匯入時算好)"""
+    if not user_id:
+        # 舊版不帶參數、固定回傳 5；保留給還沒改傳 user_id 的呼叫端
+        return {"job_tenure": "5"}
+    try:
+        entry = await run_db(get_staff_profile_entry, user_id)
+    except Exception as e:
+        logger.error(f"Job tenure query error: {e}")
+        return error_response(500, str(e))
+
+    staff = entry['staff']
+    if not staff or staff['tenure_years'] is None:
+        return error_response(404, 'No hire date found for this user', user_id=user_id)
+    return {
+        'user_id': user_id,
+        'job_tenure': str(staff['tenure_years']),
+        'tenure_months': staff['tenure_months'],
+        'tenure_days': staff['tenure_days'],
+        'seniority_rank': staff['seniority_rank'],
+        'dept_headcount': staff['dept_headcount'],
+        'as_of': staff['tenure_as_of']
+    }
+
+
+# === 資料變更推送 (SSE) ===
+@app.get('/api/frontend/users/{user_id}/events')
+async def frontend_user_events(user_id: str, request: Request):
+    """SSE 變更推送；等待通知時不佔用 DB thread，只有讀取變更時才丟到 thread pool"""
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+    last_event_id = parse_event_id(request.headers.get('last-event-id') or request.query_params.get('last_event_id'))
+    stream = UserEventStream(db_handler, change_feed, user_id, last_event_id,
+                             lambda: loop.call_soon_threadsafe(wakeup.set))
+    try:
+        first = await run_db(stream.open)
+    except Exception as e:
+        stream.close()
+        logger.error(f"Event stream error: {e}")
+        return error_response(500, str(e))
+
+    async def generate():
+        try:
+            for chunk in first:
+                yield chunk
+            while not await request.is_disconnected():
+                try:
+                    await asyncio.wait_for(wakeup.wait(), SSE_POLL_INTERVAL)
+                    timed_out = False
+                except asyncio.TimeoutError:
+                    timed_out = True
+                wakeup.clear()
+                for chunk in await run_db(stream.poll, timed_out):
+                    yield chunk
+        finally:
+            stream.close()
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+
+# 其餘路由 (含 /health 與 404 / 405 回應格式) 都交給 Flask 處理
+app.mount('/', WSGIMiddleware(api_server.app, workers=DB_THREADS))
+
+
+if __name__ == '__main__':
+    import serve
+
+    serve.main()
@@ -0,0 +1,255 @@
+"""
+輕量的 metrics 收集與 Prometheus 文字格式輸出 (不依賴 prometheus_client)
+
+    registry.inc('http_requests_total', {'route': '/health', 'status': '200'})
+    registry.observe('http_request_duration_seconds', {'route': '/health'}, 0.003)
+    registry.add_collector(lambda: [...])   # 輸出時才讀取的 gauge (連線池、快取等)
+    registry.render()                       # GET /metrics 的內容
+
+另外提供以 contextvars 保存的請求追蹤 (RequestTrace)，讓 SQL hook 把每個語句的耗時
+記在目前的請求上，請求太慢時可以列出最慢的語句。
+"""
+import contextvars
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+METRIC_PREFIX = 'flabba_'
+
+# 秒；涵蓋 SQLite 單筆查詢 (sub-ms) 到慢請求 (數秒)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Optional[Dict[str, Any]]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in (labels or {}).items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """由 bucket 以線性內插估算分位數 (與 Prometheus histogram_quantile 相同做法)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        lower = 0.0
+        for upper, count in zip(self.buckets, self.counts):
+            if cumulative + count >= rank:
+                return lower + (upper - lower) * ((rank - cumulative) / count if count else 0)
+            cumulative += count
+            lower = upper
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = METRIC_PREFIX):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict[str, Any], float]]]] = []
+        self.started_at = time.time()
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def inc(self, name: str, labels: Optional[Dict[str, Any]] = None, amount: float = 1) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, labels: Optional[Dict[str, Any]], value: float) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, Dict[str, Any], float]]]) -> None:
+        """collector() 回傳 (name, type, help, labels, value) 的序列，在輸出時才呼叫"""
+        self._collectors.append(collector)
+
+    def histogram_summary(self, name: str, label: str) -> Dict[str, Dict[str, Any]]:
+        """依某個 label 彙總的次數與估算分位數 (毫秒)，給 /health 使用"""
+        with self._lock:
+            series = dict(self._histograms.get(name, {}))
+        merged: Dict[str, Histogram] = {}
+        for key, histogram in series.items():
+            value = dict(key).get(label, '')
+            target = merged.setdefault(value, Histogram(histogram.buckets))
+            target.counts = [a + b for a, b in zip(target.counts, histogram.counts)]
+            target.count += histogram.count
+            target.sum += histogram.sum
+        return {
+            value: {
+                'count': histogram.count,
+                'mean_ms': round(histogram.sum / histogram.count * 1000, 3),
+                'p50_ms': round(histogram.quantile(0.5) * 1000, 3),
+                'p95_ms': round(histogram.quantile(0.95) * 1000, 3),
+                'p99_ms': round(histogram.quantile(0.99) * 1000, 3),
+            }
+            for value, histogram in sorted(merged.items()) if histogram.count
+        }
+
+    def render(self) -> str:
+        lines = []
+
+        def header(name, kind, help_text=None):
+            full = self.prefix + name
+            lines.append(f'# HELP {full} {help_text or self._help.get(name, name)}')
+            lines.append(f'# TYPE {full} {kind}')
+            return full
+
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {
+                name: {key: (h.buckets, list(h.counts), h.count, h.sum) for key, h in series.items()}
+                for name, series in self._histograms.items()
+            }
+
+        for name in sorted(counters):
+            full = header(name, 'counter')
+            for key, value in sorted(counters[name].items()):
+                lines.append(f'{full}{_format_labels(key)} {_format_value(value)}')
+
+        for name in sorted(histograms):
+            full = header(name, 'histogram')
+            for key, (buckets, counts, count, total) in sorted(histograms[name].items()):
+                cumulative = 0
+                for upper, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{full}_bucket{_format_labels(key, ("le", _format_value(upper)))} {cumulative}')
+                lines.append(f'{full}_bucket{_format_labels(key, ("le", "+Inf"))} {count}')
+                lines.append(f'{full}_sum{_format_labels(key)} {_format_value(total)}')
+                lines.append(f'{full}_count{_format_labels(key)} {count}')
+
+        gauges: Dict[str, Tuple[str, str, List[Tuple[LabelKey, float]]]] = {}
+        for collector in self._collectors:
+            for name, kind, help_text, labels, value in collector():
+                gauges.setdefault(name, (kind, help_text, []))[2].append((_label_key(labels), value))
+        gauges['process_uptime_seconds'] = ('gauge', 'Seconds since the metrics registry was created',
+                                            [((), time.time() - self.started_at)])
+        for name in sorted(gauges):
+            kind, help_text, samples = gauges[name]
+            full = header(name, kind, help_text)
+            for key, value in samples:
+                lines.append(f'{full}{_format_labels(key)} {_format_value(value)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+# === SQL 語句命名 ===
+_SQL_TABLE_RE = re.compile(r'\b(?:INTO|UPDATE|FROM)\s+([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+_query_names: Dict[str, str] = {}
+
+
+def sql_query_name(sql: str) -> str:
+    """
+    由 SQL 推出低基數的名稱，例如 select:user_data_current、upsert:user_data_current、begin
+    同一段 SQL 文字只解析一次
+    """
+    name = _query_names.get(sql)
+    if name is not None:
+        return name
+    words = sql.split(None, 2)
+    verb = words[0].lower() if words else ''
+    if verb == 'insert' and 'ON CONFLICT' in sql.upper():
+        verb = 'upsert'
+    if verb in ('select', 'insert', 'upsert', 'update', 'delete', 'with'):
+        match = _SQL_TABLE_RE.search(sql)
+        name = f'{verb}:{match.group(1)}' if match else verb
+    elif verb == 'pragma' and len(words) > 1:
+        name = f"pragma:{words[1].split('=')[0].strip().lower()}"
+    else:
+        name = verb or 'unknown'
+    if len(_query_names) < 1024:
+        _query_names[sql] = name
+    return name
+
+
+# === 路由標籤 ===
+_ROUTE_PARAM_RE = re.compile(r'\{([A-Za-z_][A-Za-z0-9_]*)(?::[^}]*)?\}|<(?:[^:<>]+:)?([A-Za-z_][A-Za-z0-9_]*)>')
+
+
+def normalize_route(route: str) -> str:
+    """
+    把路由樣板的參數統一寫成 <name>：FastAPI 的 {user_id} 與 Flask 的 <user_id>、<int:id>
+    記成同一個 route label，兩種伺服器的 metrics 才能合併比較
+    """
+    return _ROUTE_PARAM_RE.sub(lambda match: f'<{match.group(1) or match.group(2)}>', route)
+
+
+# === 請求追蹤 ===
+class RequestTrace:
+    """一個請求期間執行過的 SQL (最多保留 max_queries 筆)"""
+
+    def __init__(self, max_queries: int = 200):
+        self.max_queries = max_queries
+        self.queries: List[Tuple[str, Any, float]] = []
+        self.query_count = 0
+        self.query_seconds = 0.0
+
+    def record(self, sql: str, params: Any, seconds: float) -> None:
+        self.query_count += 1
+        self.query_seconds += seconds
+        if len(self.queries) < self.max_queries:
+            self.queries.append((sql, params, seconds))
+
+    def slowest(self, n: int = 3) -> List[Tuple[str, Any, float]]:
+        return sorted(self.queries, key=lambda item: item[2], reverse=True)[:n]
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('request_trace', default=None)
+
+
+def start_trace() -> Tuple[RequestTrace, contextvars.Token]:
+    trace = RequestTrace()
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token: contextvars.Token) -> None:
+    _current_trace.reset(token)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
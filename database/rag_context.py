@@ -0,0 +1,142 @@
+"""
+給 LLM 的 grounding context：依 token 預算挑選福利文件段落，可附上使用者資料
+
+流程：查詢正規化 → 檢索候選 chunk → 去除重複 → 依分數在預算內裝箱
+候選清單 (檢索 + 去重，與使用者無關) 以 (正規化查詢, 語料版本, 檢索參數) 為 key 快取；
+裝箱只是依預算挑選，每次請求重新計算，不同使用者的資料與預算可共用同一份快取。
+"""
+import hashlib
+import math
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+from rag_search import CJK_RE, tokenize
+
+NON_WORD_RE = re.compile(r'[^\w]+')
+NEAR_DUPLICATE_JACCARD = 0.85
+MIN_TRUNCATED_TOKENS = 32
+TRUNCATION_MARK = '…'
+
+
+def normalize_query(query: str) -> str:
+    """全形轉半形、小寫、去除標點與多餘空白；「特休幾天？」與「特休幾天」得到相同的 key"""
+    text = unicodedata.normalize('NFKC', query).lower()
+    return ' '.join(NON_WORD_RE.sub(' ', text).split())
+
+
+def estimate_tokens(text: str) -> int:
+    """不依賴特定 tokenizer 的估算：CJK 字元約 1 token，其餘字元約 4 個一個 token"""
+    cjk = len(CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def format_chunk(chunk: Dict[str, Any]) -> str:
+    return f"### {chunk['heading']} ({chunk['source']})\n{chunk['text'].strip()}"
+
+
+def dedupe_chunks(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    依分數順序保留第一次出現的內容：chunk_id 相同、正規化後全文相同，
+    或詞集合 Jaccard 相似度超過門檻的視為重複
+    """
+    kept = []
+    kept_terms = []
+    seen = set()
+    for chunk in chunks:
+        digest = hashlib.sha1(normalize_query(chunk['text']).encode('utf-8')).hexdigest()
+        if chunk['chunk_id'] in seen or digest in seen:
+            continue
+        terms = set(tokenize(chunk['text']))
+        if any(terms and len(terms & other) / len(terms | other) >= NEAR_DUPLICATE_JACCARD
+               for other in kept_terms):
+            continue
+        seen.update((chunk['chunk_id'], digest))
+        kept.append(chunk)
+        kept_terms.append(terms)
+    return kept
+
+
+def build_candidates(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """檢索結果去重並預先算好每段的格式化文字與 token 數 (快取的內容)"""
+    candidates = []
+    for chunk in dedupe_chunks(results):
+        block = format_chunk(chunk)
+        candidates.append({
+            'chunk_id': chunk['chunk_id'],
+            'source': chunk['source'],
+            'heading': chunk['heading'],
+            'score': chunk['score'],
+            'block': block,
+            'tokens': estimate_tokens(block)
+        })
+    return candidates
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) + 1 <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low].rstrip() + TRUNCATION_MARK
+
+
+def format_profile(user_id: str, user_data: Dict[str, Dict[str, Any]]) -> str:
+    lines = [f'## 使用者資料 ({user_id})']
+    for data_type in sorted(user_data):
+        info = user_data[data_type]
+        label = info.get('description') or data_type
+        unit = info.get('unit') or ''
+        lines.append(f"- {label}: {info.get('value')} {unit}".rstrip())
+    return '\n'.join(lines)
+
+
+def pack_context(candidates: List[Dict[str, Any]], max_tokens: int,
+                 profile_block: Optional[str] = None, separator: str = '\n\n') -> Dict[str, Any]:
+    """
+    依分數由高到低把段落放進預算，放不下的跳過、繼續嘗試後面較短的段落
+    使用者資料優先放入；若連最高分的段落都放不下，截斷它以免回傳空的 context
+    """
+    sep_tokens = estimate_tokens(separator)
+    blocks = []
+    selected = []
+    used = 0
+    truncated = False
+
+    if profile_block:
+        profile_block = truncate_to_tokens(profile_block, max_tokens)
+        blocks.append(profile_block)
+        used += estimate_tokens(profile_block)
+
+    for candidate in candidates:
+        cost = candidate['tokens'] + (sep_tokens if blocks else 0)
+        if used + cost > max_tokens:
+            continue
+        blocks.append(candidate['block'])
+        selected.append(candidate)
+        used += cost
+
+    if not selected and candidates:
+        remaining = max_tokens - used - (sep_tokens if blocks else 0)
+        if remaining >= MIN_TRUNCATED_TOKENS:
+            best = candidates[0]
+            block = truncate_to_tokens(best['block'], remaining)
+            blocks.append(block)
+            selected.append(dict(best, tokens=estimate_tokens(block)))
+            used += estimate_tokens(block) + (sep_tokens if len(blocks) > 1 else 0)
+            truncated = True
+
+    return {
+        'context': separator.join(blocks),
+        'chunks': [
+            {key: chunk[key] for key in ('chunk_id', 'source', 'heading', 'score', 'tokens')}
+            for chunk in selected
+        ],
+        'tokens': used,
+        'truncated': truncated
+    }
@@ -0,0 +1,247 @@
+"""
+福利文件索引的增量重建
+
+rag_index/manifest.json 記錄每個檔案的內容 hash (以及 size / mtime，用來略過未變動檔案的 hash 計算)
+與每個 chunk 的 chunk_id / 內容 hash。重建時：
+    - 未變動的檔案不重新讀取與切塊，chunk 與詞頻直接取自目前的 BM25 索引
+    - 變動的檔案重新切塊，只有新的 chunk 需要斷詞；內容相同的 chunk 保留原本的 chunk_id
+    - 向量矩陣中 chunk_id 不變的列直接沿用
+BM25 的 idf / 平均長度是全域統計，所以詞權重仍會全部重算 (只是算術，不需重新斷詞)。
+
+寫入順序為 BM25 索引 → 向量 → manifest，每個檔案都是寫暫存檔再 rename；
+manifest 最後寫入，三者的 corpus_version 不一致時視為不完整，整份重建。
+"""
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from rag_search import (
+    BM25Index, DEFAULT_CORPUS_DIR, DEFAULT_INDEX_DIR, chunk_markdown, chunk_tokens,
+    combine_digests, corpus_files, file_digest
+)
+from rag_vector import DEFAULT_N_FEATURES, VectorIndex
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+BM25_NAME = 'bm25.idx'
+
+
+def read_manifest(index_dir: str = DEFAULT_INDEX_DIR) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(index_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def write_manifest(manifest: Dict[str, Any], index_dir: str = DEFAULT_INDEX_DIR) -> None:
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def scan_corpus(corpus_dir: str = DEFAULT_CORPUS_DIR,
+                manifest: Optional[Dict[str, Any]] = None) -> Dict[str, Dict[str, Any]]:
+    """回傳 {檔名: {sha1, size, mtime_ns}}；size 與 mtime 都沒變的檔案沿用 manifest 的 hash"""
+    known = (manifest or {}).get('files', {})
+    files = {}
+    for path in corpus_files(corpus_dir):
+        name = os.path.basename(path)
+        stat = os.stat(path)
+        previous = known.get(name)
+        if previous and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns:
+            sha1 = previous['sha1']
+        else:
+            sha1 = file_digest(path)
+        files[name] = {'sha1': sha1, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    return files
+
+
+def load_current(index_dir: str = DEFAULT_INDEX_DIR,
+                 n_features: int = DEFAULT_N_FEATURES) -> Tuple[Optional[Dict[str, Any]], Optional[BM25Index],
+                                                                 Optional[VectorIndex]]:
+    """載入磁碟上的 manifest 與索引；三者不一致時回傳 (None, None, None)"""
+    manifest = read_manifest(index_dir)
+    if manifest is None:
+        return None, None, None
+    try:
+        index = BM25Index.load(os.path.join(index_dir, BM25_NAME))
+    except (OSError, ValueError):
+        return None, None, None
+    try:
+        vector_index = VectorIndex.load(index_dir)
+    except (OSError, ValueError):
+        vector_index = None
+    version = manifest['corpus_version']
+    if index.corpus_version != version:
+        index.close()
+        return None, None, None
+    if vector_index is not None and (vector_index.corpus_version != version
+                                     or vector_index.n_features != n_features):
+        vector_index = None
+    return manifest, index, vector_index
+
+
+def reindex(corpus_dir: str = DEFAULT_CORPUS_DIR, index_dir: str = DEFAULT_INDEX_DIR,
+            current: Optional[Tuple[Dict[str, Any], BM25Index, Optional[VectorIndex]]] = None,
+            force: bool = False, n_features: int = DEFAULT_N_FEATURES) -> Dict[str, Any]:
+    """
+    依 manifest 增量重建索引
+    current: 目前使用中的 (manifest, BM25Index, VectorIndex)；未提供時從 index_dir 載入
+    force: 忽略既有索引整份重建
+    回傳 {'manifest', 'index', 'vector_index', 'report'}；沒有變動時回傳的就是 current
+    """
+    started = time.perf_counter()
+    if force:
+        manifest, old_index, old_vectors = None, None, None
+    elif current is not None:
+        manifest, old_index, old_vectors = current
+    else:
+        manifest, old_index, old_vectors = load_current(index_dir, n_features)
+
+    files = scan_corpus(corpus_dir, manifest)
+    version = combine_digests({name: info['sha1'] for name, info in files.items()})
+    old_files = (manifest or {}).get('files', {})
+    unchanged_files = [name for name, info in files.items()
+                       if name in old_files and old_files[name]['sha1'] == info['sha1']]
+    report = {
+        'corpus_version': version,
+        'previous_version': manifest['corpus_version'] if manifest else None,
+        'files_added': sorted(set(files) - set(old_files)),
+        'files_changed': sorted(name for name in files
+                                if name in old_files and name not in unchanged_files),
+        'files_removed': sorted(set(old_files) - set(files)),
+    }
+
+    if manifest is not None and old_index is not None and old_vectors is not None \
+            and manifest['corpus_version'] == version:
+        if files != old_files:
+            # 只有 mtime 變動 (例如 touch)：更新 manifest 即可
+            manifest = dict(manifest, files={
+                name: dict(old_files[name], **info) for name, info in files.items()
+            })
+            write_manifest(manifest, index_dir)
+        report.update(chunks_total=old_index.n_docs, chunks_kept=old_index.n_docs, chunks_added=0,
+                      chunks_removed=0, rebuilt=False,
+                      took_ms=round((time.perf_counter() - started) * 1000, 3))
+        return {'manifest': manifest, 'index': old_index, 'vector_index': old_vectors, 'report': report}
+
+    # 目前索引中每個 chunk 的位置與詞頻，供沿用
+    old_docs = {}
+    old_terms = []
+    if old_index is not None:
+        old_terms = old_index.doc_terms()
+        old_docs = {meta['chunk_id']: doc_id for doc_id, meta in enumerate(old_index.chunks)}
+
+    chunks: List[Dict[str, Any]] = []
+    doc_terms: List[Counter] = []
+    manifest_files = {}
+    kept = 0
+    for name, info in files.items():
+        previous = old_files.get(name)
+        if name in unchanged_files and all(chunk['chunk_id'] in old_docs for chunk in previous['chunks']):
+            file_chunks = []
+            for entry in previous['chunks']:
+                meta = old_index.chunks[old_docs[entry['chunk_id']]]
+                file_chunks.append({
+                    'chunk_id': entry['chunk_id'],
+                    'sha1': entry['sha1'],
+                    'source': meta['source'],
+                    'heading': meta['heading'],
+                    'text': old_index.chunk_text(old_docs[entry['chunk_id']])
+                })
+        else:
+            with open(os.path.join(corpus_dir, name), encoding='utf-8') as f:
+                file_chunks = chunk_markdown(f.read(), name)
+
+        for chunk in file_chunks:
+            doc_id = old_docs.get(chunk['chunk_id'])
+            if doc_id is not None:
+                doc_terms.append(old_terms[doc_id])
+                kept += 1
+            else:
+                doc_terms.append(Counter(chunk_tokens(chunk)))
+            chunks.append(chunk)
+        manifest_files[name] = dict(info, chunks=[
+            {'chunk_id': chunk['chunk_id'], 'sha1': chunk['sha1']} for chunk in file_chunks
+        ])
+
+    index = BM25Index.build(chunks, corpus_version=version, doc_terms=doc_terms)
+    index.save(os.path.join(index_dir, BM25_NAME))
+    vector_index = VectorIndex.build(chunks, n_features, version, doc_terms=doc_terms, previous=old_vectors)
+    vector_index.save(index_dir)
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'corpus_version': version,
+        'updated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'files': manifest_files
+    }
+    write_manifest(manifest, index_dir)
+
+    report.update(chunks_total=len(chunks), chunks_kept=kept, chunks_added=len(chunks) - kept,
+                  chunks_removed=len(old_docs) - kept, rebuilt=True,
+                  took_ms=round((time.perf_counter() - started) * 1000, 3))
+    return {
+        'manifest': manifest,
+        'index': BM25Index.load(os.path.join(index_dir, BM25_NAME)),
+        'vector_index': VectorIndex.load(index_dir),
+        'report': report
+    }
+
+
+class CorpusWatcher:
+    """
+    以輪詢方式監看語料目錄 (不需額外套件)：檔名、大小或 mtime 有變動時呼叫 on_change()
+    on_change 內的錯誤只記錄下來，下一輪會再試
+    """
+
+    def __init__(self, corpus_dir: str, on_change, interval: float = 5.0, logger=None):
+        self.corpus_dir = corpus_dir
+        self.on_change = on_change
+        self.interval = interval
+        self.logger = logger
+        self._stop = threading.Event()
+        self._thread = None
+        self._snapshot = self._stat()
+
+    def _stat(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        for path in corpus_files(self.corpus_dir):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[os.path.basename(path)] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            snapshot = self._stat()
+            if snapshot == self._snapshot:
+                continue
+            try:
+                self.on_change()
+                self._snapshot = snapshot
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"RAG reindex failed: {e}")
+
+    def start(self) -> 'CorpusWatcher':
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='rag-corpus-watcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
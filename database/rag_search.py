@@ -0,0 +1,433 @@
+"""
+本機 BM25 檢索：把 RAG/tsmc_benefits 的 markdown 依標題切塊，建立倒排索引
+
+索引檔格式 (native endian，section 以 4 bytes 對齊)：
+    magic 'BM25IDX1' | uint32 header 長度 | header JSON
+    | doc_ids  uint32[total_postings]    每個詞的 posting 依 doc id 排序
+    | weights  float32[total_postings]   預先算好的 BM25 詞權重
+    | freqs    uint16[total_postings]    詞頻 (增量重建時還原未變動 chunk 的詞頻用)
+    | text     utf-8                     各 chunk 原文
+查詢時只讀 header，postings 與原文透過 mmap 存取。
+
+使用方式:
+    python rag_search.py build
+    python rag_search.py search "特休 天數" -k 5
+    python rag_search.py reindex [--watch 5]
+"""
+import argparse
+import glob
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import time
+from array import array
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS_DIR = os.path.normpath(os.path.join(BASE_DIR, '..', 'RAG', 'tsmc_benefits'))
+DEFAULT_INDEX_DIR = os.path.join(BASE_DIR, 'rag_index')
+DEFAULT_INDEX_PATH = os.path.join(DEFAULT_INDEX_DIR, 'bm25.idx')
+
+MAGIC = b'BM25IDX1'
+INDEX_VERSION = 2
+
+# 英數字為一個詞；CJK 連續字串切成相鄰兩字 (bigram)，單一字則保留單字
+CJK_RANGES = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+TOKEN_RE = re.compile(f'[a-z0-9]+|[{CJK_RANGES}]+')
+CJK_RE = re.compile(f'[{CJK_RANGES}]')
+HEADING_RE = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+
+MAX_CHUNK_CHARS = 1200
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for run in TOKEN_RE.findall(text.lower()):
+        if CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def _split_long(body: str) -> List[str]:
+    if len(body) <= MAX_CHUNK_CHARS:
+        return [body]
+    parts, current = [], ''
+    for paragraph in re.split(r'\n\s*\n', body):
+        if current and len(current) + len(paragraph) > MAX_CHUNK_CHARS:
+            parts.append(current)
+            current = ''
+        current = f'{current}\n\n{paragraph}' if current else paragraph
+    if current:
+        parts.append(current)
+    return parts
+
+
+def chunk_markdown(text: str, source: str) -> List[Dict[str, Any]]:
+    """依 markdown 標題切塊；每塊帶有完整標題路徑 (例如 年假制度 > 給假標準)"""
+    chunks = []
+    path = []
+    body_lines = []
+    seen = Counter()
+
+    def flush():
+        body = '\n'.join(body_lines).strip()
+        body_lines.clear()
+        if not body:
+            return
+        heading = ' > '.join(title for _, title in path)
+        for part in _split_long(body):
+            digest = hashlib.sha1(f'{heading}\n{part}'.encode('utf-8')).hexdigest()
+            # chunk_id 只由內容決定，內容不變 id 就不變；同一檔案內完全相同的段落依出現順序加上編號
+            seen[digest] += 1
+            chunk_id = f'{os.path.splitext(source)[0]}:{digest[:12]}'
+            if seen[digest] > 1:
+                chunk_id = f'{chunk_id}-{seen[digest]}'
+            chunks.append({
+                'chunk_id': chunk_id,
+                'sha1': digest,
+                'source': source,
+                'heading': heading,
+                'text': part
+            })
+
+    for line in text.splitlines():
+        match = HEADING_RE.match(line)
+        if match:
+            flush()
+            level = len(match.group(1))
+            while path and path[-1][0] >= level:
+                path.pop()
+            path.append((level, match.group(2)))
+        else:
+            body_lines.append(line)
+    flush()
+    return chunks
+
+
+def corpus_files(corpus_dir: str = DEFAULT_CORPUS_DIR) -> List[str]:
+    return sorted(glob.glob(os.path.join(corpus_dir, '*.md')))
+
+
+def load_corpus(corpus_dir: str = DEFAULT_CORPUS_DIR) -> List[Dict[str, Any]]:
+    chunks = []
+    for path in corpus_files(corpus_dir):
+        with open(path, encoding='utf-8') as f:
+            chunks.extend(chunk_markdown(f.read(), os.path.basename(path)))
+    return chunks
+
+
+def chunk_tokens(chunk: Dict[str, Any]) -> List[str]:
+    # 標題也納入索引，讓「年假」之類的查詢能命中標題下的內容
+    return tokenize(f"{chunk['heading']}\n{chunk['text']}")
+
+
+def _pad4(data: bytes) -> bytes:
+    return data + b'\0' * (-len(data) % 4)
+
+
+class BM25Index:
+    """
+    BM25 倒排索引 (Okapi BM25，k1 / b 可調)
+    每個 posting 存的是預先算好的詞權重，查詢時只需累加
+    """
+
+    def __init__(self, header: Dict[str, Any], doc_ids, weights, freqs, text_blob, mm: Optional[mmap.mmap] = None,
+                 view: Optional[memoryview] = None):
+        self.header = header
+        self.terms = header['terms']
+        self.chunks = header['chunks']
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.freqs = freqs
+        self.text_blob = text_blob
+        self._mm = mm
+        self._view = view
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.chunks)
+
+    @property
+    def corpus_version(self) -> str:
+        return self.header.get('corpus_version', '')
+
+    @classmethod
+    def build(cls, chunks: List[Dict[str, Any]], k1: float = 1.5, b: float = 0.75,
+              corpus_version: str = '', doc_terms: Optional[List[Counter]] = None) -> 'BM25Index':
+        """doc_terms 可傳入已算好的詞頻 (與 chunks 對應)，省去重新斷詞"""
+        if doc_terms is None:
+            doc_terms = [Counter(chunk_tokens(chunk)) for chunk in chunks]
+        doc_lens = [sum(tf.values()) for tf in doc_terms]
+        n_docs = len(chunks)
+        avgdl = sum(doc_lens) / n_docs if n_docs else 0.0
+
+        postings = {}
+        for doc_id, tf in enumerate(doc_terms):
+            for term, freq in tf.items():
+                postings.setdefault(term, []).append((doc_id, freq))
+
+        doc_ids = array('I')
+        weights = array('f')
+        freqs = array('H')
+        terms = {}
+        for term in sorted(postings):
+            plist = postings[term]
+            df = len(plist)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            terms[term] = [len(doc_ids), df]
+            for doc_id, freq in plist:
+                norm = k1 * (1 - b + b * doc_lens[doc_id] / avgdl)
+                doc_ids.append(doc_id)
+                weights.append(idf * freq * (k1 + 1) / (freq + norm))
+                freqs.append(min(freq, 0xFFFF))
+
+        text_blob = bytearray()
+        chunk_meta = []
+        for chunk in chunks:
+            encoded = chunk['text'].encode('utf-8')
+            chunk_meta.append({
+                'chunk_id': chunk['chunk_id'],
+                'source': chunk['source'],
+                'heading': chunk['heading'],
+                'text_offset': len(text_blob),
+                'text_length': len(encoded)
+            })
+            text_blob.extend(encoded)
+
+        header = {
+            'version': INDEX_VERSION,
+            'k1': k1,
+            'b': b,
+            'avgdl': avgdl,
+            'total_postings': len(doc_ids),
+            'corpus_version': corpus_version,
+            'chunks': chunk_meta,
+            'terms': terms
+        }
+        return cls(header, memoryview(doc_ids), memoryview(weights), memoryview(freqs),
+                   memoryview(bytes(text_blob)))
+
+    def save(self, path: str) -> None:
+        """寫到暫存檔再 rename，讀取中的舊索引不會讀到寫一半的檔案"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        header = json.dumps(self.header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        prefix = _pad4(MAGIC + struct.pack('<I', len(header)) + header)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(prefix)
+            f.write(self.doc_ids.tobytes())
+            f.write(self.weights.tobytes())
+            f.write(self.freqs.tobytes())
+            f.write(self.text_blob.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'BM25Index':
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm[:len(MAGIC)] != MAGIC:
+            mm.close()
+            raise ValueError(f'Not a BM25 index file: {path}')
+        (header_len,) = struct.unpack_from('<I', mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(mm[start:start + header_len].decode('utf-8'))
+        if header.get('version') != INDEX_VERSION:
+            mm.close()
+            raise ValueError(f'Unsupported index version: {header.get("version")}')
+
+        offset = start + header_len + (-(start + header_len) % 4)
+        total = header['total_postings']
+        view = memoryview(mm)
+        doc_ids = view[offset:offset + 4 * total].cast('I')
+        offset += 4 * total
+        weights = view[offset:offset + 4 * total].cast('f')
+        offset += 4 * total
+        freqs = view[offset:offset + 2 * total].cast('H')
+        offset += 2 * total
+        return cls(header, doc_ids, weights, freqs, view[offset:], mm, view)
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self.doc_ids.release()
+            self.weights.release()
+            self.freqs.release()
+            self.text_blob.release()
+            self._view.release()
+            self._mm.close()
+            self._mm = None
+
+    def chunk_text(self, doc_id: int) -> str:
+        meta = self.chunks[doc_id]
+        start = meta['text_offset']
+        return bytes(self.text_blob[start:start + meta['text_length']]).decode('utf-8')
+
+    def doc_terms(self) -> List[Counter]:
+        """從 postings 還原每個 chunk 的詞頻 (與 chunks 同順序)"""
+        doc_terms = [Counter() for _ in self.chunks]
+        for term, (start, df) in self.terms.items():
+            for doc_id, freq in zip(self.doc_ids[start:start + df], self.freqs[start:start + df]):
+                doc_terms[doc_id][term] = freq
+        return doc_terms
+
+    def score(self, query: str) -> Dict[int, float]:
+        scores = {}
+        for term, qtf in Counter(tokenize(query)).items():
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            start, df = entry
+            doc_ids = self.doc_ids[start:start + df]
+            weights = self.weights[start:start + df]
+            for doc_id, weight in zip(doc_ids, weights):
+                scores[doc_id] = scores.get(doc_id, 0.0) + qtf * weight
+        return scores
+
+    def search(self, query: str, k: int = 5, with_text: bool = True) -> List[Dict[str, Any]]:
+        scores = self.score(query)
+        top = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+        results = []
+        for doc_id, score in top:
+            meta = self.chunks[doc_id]
+            result = {
+                'chunk_id': meta['chunk_id'],
+                'source': meta['source'],
+                'heading': meta['heading'],
+                'score': round(score, 4)
+            }
+            if with_text:
+                result['text'] = self.chunk_text(doc_id)
+            results.append(result)
+        return results
+
+
+def naive_search(chunks: List[Dict[str, Any]], query: str, k: int = 5,
+                 k1: float = 1.5, b: float = 0.75) -> List[Dict[str, Any]]:
+    """不建索引、每次重新掃過全部 chunk 計算 BM25 (基準測試用)"""
+    doc_terms = [Counter(chunk_tokens(chunk)) for chunk in chunks]
+    n_docs = len(chunks)
+    avgdl = sum(sum(tf.values()) for tf in doc_terms) / n_docs
+    query_terms = Counter(tokenize(query))
+    df = {term: sum(1 for tf in doc_terms if term in tf) for term in query_terms}
+
+    scored = []
+    for doc_id, tf in enumerate(doc_terms):
+        dl = sum(tf.values())
+        score = 0.0
+        for term, qtf in query_terms.items():
+            freq = tf.get(term)
+            if not freq:
+                continue
+            idf = math.log(1 + (n_docs - df[term] + 0.5) / (df[term] + 0.5))
+            score += qtf * idf * freq * (k1 + 1) / (freq + k1 * (1 - b + b * dl / avgdl))
+        if score > 0:
+            scored.append((score, -doc_id))
+    top = heapq.nlargest(k, scored)
+    return [{'chunk_id': chunks[-neg_id]['chunk_id'], 'score': round(score, 4)} for score, neg_id in top]
+
+
+def file_digest(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def combine_digests(file_digests: Dict[str, str]) -> str:
+    """由 {檔名: 內容 sha1} 算出語料版本"""
+    digest = hashlib.sha1()
+    for name in sorted(file_digests):
+        digest.update(name.encode('utf-8'))
+        digest.update(bytes.fromhex(file_digests[name]))
+    return digest.hexdigest()[:16]
+
+
+def corpus_version(corpus_dir: str = DEFAULT_CORPUS_DIR) -> str:
+    return combine_digests({os.path.basename(path): file_digest(path) for path in corpus_files(corpus_dir)})
+
+
+def build_index(corpus_dir: str = DEFAULT_CORPUS_DIR, index_path: str = DEFAULT_INDEX_PATH) -> BM25Index:
+    index = BM25Index.build(load_corpus(corpus_dir), corpus_version=corpus_version(corpus_dir))
+    index.save(index_path)
+    return index
+
+
+def load_or_build_index(corpus_dir: str = DEFAULT_CORPUS_DIR,
+                        index_path: str = DEFAULT_INDEX_PATH) -> BM25Index:
+    """索引檔存在且與語料版本一致時直接 mmap 載入，否則重建"""
+    if os.path.exists(index_path):
+        try:
+            index = BM25Index.load(index_path)
+            if index.corpus_version == corpus_version(corpus_dir):
+                return index
+            index.close()
+        except ValueError:
+            pass
+    build_index(corpus_dir, index_path)
+    return BM25Index.load(index_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BM25 search over RAG/tsmc_benefits')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_DIR)
+    parser.add_argument('--index', default=DEFAULT_INDEX_PATH)
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('build', help='rebuild the index file')
+    search = sub.add_parser('search', help='query the index')
+    search.add_argument('query')
+    search.add_argument('-k', type=int, default=5)
+    reindex = sub.add_parser('reindex', help='re-index only the documents that changed')
+    reindex.add_argument('--force', action='store_true', help='ignore the manifest and rebuild everything')
+    reindex.add_argument('--watch', type=float, default=0, metavar='SECONDS',
+                         help='keep running and re-index whenever a document changes')
+    args = parser.parse_args()
+
+    if args.command == 'reindex':
+        # rag_indexer 依賴 rag_search，在這裡才匯入以免循環匯入
+        from rag_indexer import CorpusWatcher, reindex as run_reindex
+
+        index_dir = os.path.dirname(args.index)
+        state = {}
+
+        def run(force=False):
+            current = state.get('current')
+            result = run_reindex(args.corpus, index_dir, current=current, force=force)
+            state['current'] = (result['manifest'], result['index'], result['vector_index'])
+            print(json.dumps(result['report'], ensure_ascii=False))
+
+        run(args.force)
+        if args.watch > 0:
+            print(f'Watching {args.corpus} every {args.watch:g}s (Ctrl+C to stop)')
+            watcher = CorpusWatcher(args.corpus, run, args.watch).start()
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                watcher.stop()
+    elif args.command == 'build':
+        started = time.perf_counter()
+        index = build_index(args.corpus, args.index)
+        print(f'Indexed {index.n_docs} chunks, {len(index.terms)} terms '
+              f'in {(time.perf_counter() - started) * 1000:.1f} ms -> {args.index}')
+    else:
+        index = load_or_build_index(args.corpus, args.index)
+        started = time.perf_counter()
+        results = index.search(args.query, args.k)
+        took = (time.perf_counter() - started) * 1000
+        for result in results:
+            print(f"{result['score']:8.3f}  {result['source']}  {result['heading']}")
+        print(f'({took:.3f} ms)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+API 用的福利文件檢索服務：延遲載入 BM25 與向量索引，提供 bm25 / vector / hybrid 三種模式
+
+索引以 (manifest, BM25Index, VectorIndex) 一組快照保存，重建完成後一次替換參考；
+進行中的查詢持有舊快照直到結束，舊的 mmap 在沒有參考後由 GC 關閉。
+"""
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from rag_indexer import CorpusWatcher, reindex
+from rag_search import BM25Index, DEFAULT_CORPUS_DIR, DEFAULT_INDEX_DIR
+from rag_vector import DEFAULT_N_FEATURES, VectorIndex, hybrid_scores, top_k
+
+SEARCH_MODES = ('bm25', 'vector', 'hybrid')
+
+
+class RagSnapshot:
+    def __init__(self, manifest: Dict[str, Any], index: BM25Index, vector_index: VectorIndex):
+        self.manifest = manifest
+        self.index = index
+        self.vector_index = vector_index
+
+    @property
+    def corpus_version(self) -> str:
+        return self.manifest['corpus_version']
+
+
+class RagService:
+    def __init__(self, corpus_dir: str = DEFAULT_CORPUS_DIR, index_dir: str = DEFAULT_INDEX_DIR,
+                 n_features: int = DEFAULT_N_FEATURES, watch_interval: float = 0, logger=None):
+        self.corpus_dir = corpus_dir
+        self.index_dir = index_dir
+        self.n_features = n_features
+        self.logger = logger
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._snapshot: Optional[RagSnapshot] = None
+        self._lock = threading.Lock()
+        self._watcher = None
+        if watch_interval > 0:
+            self._watcher = CorpusWatcher(corpus_dir, self.reindex, watch_interval, logger).start()
+
+    @property
+    def snapshot(self) -> RagSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.reindex()
+            snapshot = self._snapshot
+        return snapshot
+
+    @property
+    def index(self) -> BM25Index:
+        return self.snapshot.index
+
+    @property
+    def loaded(self) -> bool:
+        return self._snapshot is not None
+
+    def reindex(self, force: bool = False) -> Dict[str, Any]:
+        """重建有變動的文件並替換快照；同一時間只會有一個重建在進行"""
+        with self._lock:
+            current = self._snapshot
+            result = reindex(
+                self.corpus_dir, self.index_dir,
+                current=(current.manifest, current.index, current.vector_index) if current else None,
+                force=force, n_features=self.n_features
+            )
+            self._snapshot = RagSnapshot(result['manifest'], result['index'], result['vector_index'])
+            self.last_report = result['report']
+        if self.logger and result['report']['rebuilt']:
+            report = result['report']
+            self.logger.info(
+                f"RAG index {report['corpus_version']}: {report['chunks_total']} chunks "
+                f"({report['chunks_added']} added, {report['chunks_removed']} removed) "
+                f"in {report['took_ms']} ms"
+            )
+        return result['report']
+
+    @staticmethod
+    def _result(snapshot: RagSnapshot, doc_id: int, score: float) -> Dict[str, Any]:
+        meta = snapshot.index.chunks[doc_id]
+        return {
+            'chunk_id': meta['chunk_id'],
+            'source': meta['source'],
+            'heading': meta['heading'],
+            'score': round(float(score), 4),
+            'text': snapshot.index.chunk_text(doc_id)
+        }
+
+    def search(self, query: str, k: int = 5, mode: str = 'bm25', alpha: float = 0.5) -> List[Dict[str, Any]]:
+        return self.search_many([query], k, mode, alpha)[0]
+
+    def search_many(self, queries: List[str], k: int = 5, mode: str = 'bm25',
+                    alpha: float = 0.5, snapshot: Optional[RagSnapshot] = None) -> List[List[Dict[str, Any]]]:
+        """一次處理多個查詢；vector / hybrid 模式以一次矩陣乘法計算所有查詢"""
+        if mode not in SEARCH_MODES:
+            raise ValueError(f'mode must be one of {SEARCH_MODES}')
+        snapshot = snapshot or self.snapshot
+        index = snapshot.index
+        if mode == 'bm25':
+            return [index.search(query, k) for query in queries]
+
+        scores = snapshot.vector_index.similarities(queries)
+        if mode == 'hybrid':
+            keyword = np.zeros_like(scores)
+            for row, query in enumerate(queries):
+                for doc_id, score in index.score(query).items():
+                    keyword[row, doc_id] = score
+            scores = hybrid_scores(scores, keyword, alpha)
+
+        results = []
+        for row, doc_ids in enumerate(top_k(scores, k)):
+            results.append([
+                self._result(snapshot, int(doc_id), scores[row, doc_id])
+                for doc_id in doc_ids if scores[row, doc_id] > 0
+            ])
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            'loaded': snapshot is not None,
+            'corpus_version': snapshot.corpus_version if snapshot else None,
+            'chunks': snapshot.index.n_docs if snapshot else 0,
+            'watching': self._watcher is not None,
+            'last_reindex': self.last_report
+        }
+
+    def close(self) -> None:
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+        with self._lock:
+            if self._snapshot is not None:
+                self._snapshot.index.close()
+                self._snapshot = None
@@ -0,0 +1,150 @@
+"""
+福利文件的向量檢索 (純 NumPy，不需網路或 GPU)
+
+每個 chunk 以 hashing TF-IDF 編碼成固定維度向量 (L2 正規化)，
+全部存成一個連續的 float32 矩陣 (.npy，以 mmap 載入)。
+查詢時把多個查詢一次編碼成矩陣，以矩陣乘法算 cosine 相似度，再用 argpartition 取 top-k。
+"""
+import json
+import math
+import os
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from rag_search import DEFAULT_INDEX_DIR, chunk_tokens, tokenize
+
+DEFAULT_N_FEATURES = 4096
+VECTOR_INDEX_VERSION = 1
+
+
+def _bucket(token: str, n_features: int) -> int:
+    # crc32 在不同 process / 不同機器上結果一致 (內建 hash() 會隨機化)
+    return zlib.crc32(token.encode('utf-8')) % n_features
+
+
+def hashed_counts(tokens: List[str], n_features: int) -> Dict[int, int]:
+    counts = Counter()
+    for token in tokens:
+        counts[_bucket(token, n_features)] += 1
+    return counts
+
+
+class VectorIndex:
+    def __init__(self, matrix: np.ndarray, idf: np.ndarray, meta: Dict[str, Any]):
+        self.matrix = matrix
+        self.idf = idf
+        self.meta = meta
+        self.chunk_ids = meta['chunk_ids']
+        self.n_features = meta['n_features']
+
+    @property
+    def corpus_version(self) -> str:
+        return self.meta.get('corpus_version', '')
+
+    @classmethod
+    def build(cls, chunks: List[Dict[str, Any]], n_features: int = DEFAULT_N_FEATURES,
+              corpus_version: str = '', doc_terms: Optional[List[Counter]] = None,
+              previous: Optional['VectorIndex'] = None) -> 'VectorIndex':
+        """
+        doc_terms 可傳入已算好的詞頻；傳入 previous 時，chunk_id 相同的列直接沿用舊矩陣
+        (舊列除以舊 idf 即為 tf 的方向，乘上新 idf 後重新正規化結果相同)
+        """
+        n_docs = len(chunks)
+        reuse = {}
+        if previous is not None and previous.n_features == n_features:
+            reuse = {chunk_id: row for row, chunk_id in enumerate(previous.chunk_ids)}
+
+        matrix = np.zeros((n_docs, n_features), dtype=np.float32)
+        for row, chunk in enumerate(chunks):
+            old_row = reuse.get(chunk['chunk_id'])
+            if old_row is not None:
+                matrix[row] = previous.matrix[old_row] / previous.idf
+                continue
+            if doc_terms is not None:
+                counts = Counter()
+                for term, freq in doc_terms[row].items():
+                    counts[_bucket(term, n_features)] += freq
+            else:
+                counts = hashed_counts(chunk_tokens(chunk), n_features)
+            for bucket, freq in counts.items():
+                matrix[row, bucket] = 1 + math.log(freq)
+
+        df = np.count_nonzero(matrix, axis=0).astype(np.float32)
+        idf = (np.log((1 + n_docs) / (1 + df)) + 1).astype(np.float32)
+        matrix *= idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.maximum(norms, 1e-12)
+
+        meta = {
+            'version': VECTOR_INDEX_VERSION,
+            'n_features': n_features,
+            'corpus_version': corpus_version,
+            'chunk_ids': [chunk['chunk_id'] for chunk in chunks]
+        }
+        return cls(np.ascontiguousarray(matrix), idf, meta)
+
+    def save(self, index_dir: str = DEFAULT_INDEX_DIR, name: str = 'vectors') -> None:
+        """先寫暫存檔再 rename，metadata 最後寫入，確保讀到的是完整的一組檔案"""
+        os.makedirs(index_dir, exist_ok=True)
+        for suffix, array in (('.npy', self.matrix), ('_idf.npy', self.idf)):
+            path = os.path.join(index_dir, name + suffix)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+        meta_path = os.path.join(index_dir, name + '.json')
+        tmp_path = f'{meta_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        os.replace(tmp_path, meta_path)
+
+    @classmethod
+    def load(cls, index_dir: str = DEFAULT_INDEX_DIR, name: str = 'vectors') -> 'VectorIndex':
+        with open(os.path.join(index_dir, name + '.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != VECTOR_INDEX_VERSION:
+            raise ValueError(f'Unsupported vector index version: {meta.get("version")}')
+        matrix = np.load(os.path.join(index_dir, name + '.npy'), mmap_mode='r')
+        idf = np.load(os.path.join(index_dir, name + '_idf.npy'))
+        if matrix.shape != (len(meta['chunk_ids']), meta['n_features']):
+            raise ValueError('Vector matrix does not match its metadata')
+        return cls(matrix, idf, meta)
+
+    def encode(self, queries: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(queries), self.n_features), dtype=np.float32)
+        for row, query in enumerate(queries):
+            for bucket, freq in hashed_counts(tokenize(query), self.n_features).items():
+                vectors[row, bucket] = 1 + math.log(freq)
+        vectors *= self.idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.maximum(norms, 1e-12)
+        return vectors
+
+    def similarities(self, queries: List[str]) -> np.ndarray:
+        """回傳 (查詢數, chunk 數) 的 cosine 相似度矩陣"""
+        return self.encode(queries) @ self.matrix.T
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """對每一列取分數最高的 k 個欄位 (已依分數排序)"""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def hybrid_scores(vector_scores: np.ndarray, keyword_scores: np.ndarray,
+                  alpha: float = 0.5) -> np.ndarray:
+    """
+    向量與關鍵字分數混合：關鍵字分數先除以每列最大值縮放到 0~1
+    alpha=1 只看向量、alpha=0 只看關鍵字
+    """
+    peak = keyword_scores.max(axis=1, keepdims=True)
+    keyword_scores = np.divide(keyword_scores, peak, out=np.zeros_like(keyword_scores), where=peak > 0)
+    return alpha * vector_scores + (1 - alpha) * keyword_scores
+
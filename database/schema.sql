@@ -2,7 +2,9 @@ CREATE TABLE user_data (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id TEXT NOT NULL,
     data_type TEXT NOT NULL, -- 'leave', 'meal', 'overtime', 'salary', 'bonus'
-    value REAL NOT NULL,     -- 數值
+    value REAL NOT NULL,     -- API 回傳的值：數值，日期欄位為 'YYYY-MM-DD' 字串 (型別不固定，查詢請用下面兩欄)
+    value_num REAL,          -- 數值欄位的值 (日期欄位為 NULL)
+    value_date TEXT,         -- 日期欄位的值 'YYYY-MM-DD' (其他欄位為 NULL)
     unit TEXT,               -- 'days', 'ntd', 'hours', 'date'
     description TEXT,        
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -12,15 +14,39 @@ CREATE TABLE user_data (
 CREATE INDEX idx_user_data_type ON user_data(user_id, data_type);
 CREATE INDEX idx_updated_at ON user_data(updated_at);
 
-INSERT INTO user_data (user_id, data_type, value, unit, description) VALUES 
-('user001', 'leave', 12.5, 'days', '剩餘特休天數'),
-('user001', 'meal', 1500, 'ntd', '剩餘餐補'),
-('user001', 'overtime', 25.5, 'hours', '累積加班時數'),
-('user001', 'salary', 50000, 'ntd', '月薪'),
-('user001', 'bonus', 20251215, 'date', '下次獎金發放時間');
+-- 目前值：每個 (user_id, data_type) 只有一筆，寫入使用 INSERT ... ON CONFLICT DO UPDATE
+CREATE TABLE user_data_current (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    data_type TEXT NOT NULL,
+    value REAL NOT NULL,
+    value_num REAL,
+    value_date TEXT,
+    unit TEXT,
+    description TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(user_id, data_type)
+);
+
+-- 依日期範圍查詢 (例如 30 天內發放獎金的使用者)
+CREATE INDEX idx_current_type_date ON user_data_current(data_type, value_date, user_id) WHERE value_date IS NOT NULL;
+
+INSERT INTO user_data (user_id, data_type, value, value_num, value_date, unit, description) VALUES 
+('user001', 'leave', 12.5, 12.5, NULL, 'days', '剩餘特休天數'),
+('user001', 'meal', 1500, 1500, NULL, 'ntd', '剩餘餐補'),
+('user001', 'overtime', 25.5, 25.5, NULL, 'hours', '累積加班時數'),
+('user001', 'salary', 50000, 50000, NULL, 'ntd', '月薪'),
+('user001', 'bonus', '2025-12-15', NULL, '2025-12-15', 'date', '下次獎金發放時間');
+
+INSERT INTO user_data_current (user_id, data_type, value, value_num, value_date, unit, description)
+SELECT user_id, data_type, value, value_num, value_date, unit, description FROM user_data WHERE user_id = 'user001';
 
 SELECT * FROM user_data WHERE user_id = 'user001' ORDER BY updated_at DESC;
 
-SELECT * FROM user_data 
-WHERE user_id = 'user001' AND data_type = 'leave' 
-ORDER BY updated_at DESC LIMIT 1;
\ No newline at end of file
+SELECT * FROM user_data_current
+WHERE user_id = 'user001' AND data_type = 'leave';
+
+SELECT user_id, value_date FROM user_data_current
+WHERE data_type = 'bonus' AND value_date BETWEEN date('now') AND date('now', '+30 days')
+ORDER BY value_date, user_id;
\ No newline at end of file
@@ -0,0 +1,53 @@
+"""
+正式環境啟動程式：python serve.py
+
+API_WORKERS > 1 時預設 DB_WRITER=process：先啟動單一 writer process，再以 uvicorn 啟動 worker，
+worker 經 DB_WRITER_ADDRESS 把寫入送給 writer (見 db_writer.py)。
+DB_WRITER=local 時各 worker 自行寫入 SQLite (靠 busy_timeout 排隊)。
+DB_SHARDS > 1 (見 sharding.py) 時寫入已分散到多個檔案，預設 DB_WRITER=local。
+"""
+import logging
+import os
+
+import uvicorn
+
+from db_writer import WriterProcess
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    workers = int(os.getenv('API_WORKERS', str(os.cpu_count() or 1)))
+    sharded = int(os.getenv('DB_SHARDS', '1')) > 1 or len(os.getenv('DB_SHARD_PATHS', '').split(',')) > 1
+    mode = os.getenv('DB_WRITER', 'process' if workers > 1 and not sharded else 'local')
+    if mode == 'process' and sharded:
+        raise SystemExit('DB_WRITER=process manages a single database file; use DB_WRITER=local with DB_SHARDS')
+
+    writer = None
+    if mode == 'process':
+        writer = WriterProcess(
+            db_path=os.getenv('DB_PATH', 'user_data.db'),
+            busy_timeout=int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000')),
+            batch_size=int(os.getenv('DB_WRITER_BATCH', '64')),
+            batch_wait=float(os.getenv('DB_WRITER_BATCH_WAIT_MS', '2')) / 1000
+        ).start()
+    elif workers > 1:
+        # 各 worker 的快取只會被自己的寫入失效，多 worker 時預設加上短 TTL
+        os.environ.setdefault('PROFILE_CACHE_TTL', '2')
+
+    try:
+        uvicorn.run(
+            'main:app',
+            host=os.getenv('API_HOST', '0.0.0.0'),
+            port=int(os.getenv('API_PORT', '5001')),
+            workers=workers,
+            timeout_graceful_shutdown=int(os.getenv('API_SHUTDOWN_TIMEOUT', '30')),
+            log_level='info'
+        )
+    finally:
+        # worker 都結束後才關閉 writer，確保已送出的寫入都已 commit
+        if writer is not None:
+            writer.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,545 @@
+"""
+把 user_data 依 user_id 分散到多個 SQLite 檔案 (水平分片)
+
+    handler = ShardedUserDataHandler('user_data.db', shards=4)
+    # -> user_data.0-of-4.db ... user_data.3-of-4.db，API 與 UserDataHandler 相同
+
+    python sharding.py rebalance --from-shards 1 --to-shards 4    # 調整分片數 (服務需先停止)
+
+每位使用者的所有資料 (目前值、歷史、請假、變更紀錄、彙總) 只存在 shard_index(user_id) 那個檔案，
+單一使用者的讀寫只碰一個檔案，各檔案有自己的寫入鎖與 WAL，寫入量可隨檔案 (磁碟) 數增加。
+多位使用者或全體的查詢 (批次寫入、部門彙總、日期範圍、匯出、壓縮) 以 thread pool 同時送到
+各分片再合併結果。staff_profile 在每個分片都有完整的一份 (部門彙總需要每位使用者的部門)。
+
+注意：
+    - 變更紀錄的 seq 是各分片各自遞增；同一位使用者永遠在同一個分片，SSE 續傳不受影響
+    - 匯出的 id 是 分片內 id * 分片數 + 分片編號，cursor 仍以 (updated_at, id) 續傳
+    - 單一 writer 模式 (db_writer.py) 只管理一個檔案，分片時各 worker 直接寫入各分片
+"""
+import argparse
+import contextvars
+import glob
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from data_handler import (DEPT_AGGREGATE_TRIGGERS, UserDataHandler, batch_error, decode_export_cursor,
+                          encode_export_cursor)
+
+logger = logging.getLogger(__name__)
+
+# 依 user_id 分片的資料表 (搬移時不保留自動編號的 id / seq)
+USER_TABLES = ('user_data', 'user_data_current', 'leave_history', 'user_data_changes', 'user_data_rollup')
+# 每個分片都有完整一份的資料表
+REPLICATED_TABLES = ('staff_profile',)
+
+
+class ShardLayoutError(RuntimeError):
+    """分片檔案與設定的分片數不一致 (需要先執行 rebalance)"""
+
+
+def shard_index(user_id: str, shards: int) -> int:
+    """user_id 對應的分片編號；使用固定的雜湊 (不受 PYTHONHASHSEED 影響)"""
+    if shards == 1:
+        return 0
+    digest = hashlib.blake2b(str(user_id).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shards
+
+
+def shard_paths(db_path: str, shards: int) -> List[str]:
+    """分片檔案路徑：user_data.db -> user_data.0-of-4.db ...；只有一個分片時就是 db_path 本身"""
+    if shards < 1:
+        raise ValueError('shards must be >= 1')
+    if shards == 1:
+        return [db_path]
+    root, ext = os.path.splitext(db_path)
+    return [f'{root}.{index}-of-{shards}{ext}' for index in range(shards)]
+
+
+def _other_layouts(db_path: str, paths: List[str]) -> List[str]:
+    """db_path 旁邊不屬於 paths 的資料庫檔案 (未分片的原檔或其他分片數的檔案)"""
+    root, ext = os.path.splitext(db_path)
+    candidates = [db_path] + glob.glob(f'{glob.escape(root)}.*-of-*{ext}')
+    return sorted(path for path in set(candidates) if path not in paths and os.path.exists(path))
+
+
+def _check_shard_info(conn: sqlite3.Connection, path: str, index: int, shards: int) -> None:
+    """新檔案寫入分片編號；既有檔案的編號與分片數不符時拋出 ShardLayoutError"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS shard_info (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            shard_index INTEGER NOT NULL,
+            shard_count INTEGER NOT NULL
+        )
+    ''')
+    row = conn.execute('SELECT shard_index, shard_count FROM shard_info').fetchone()
+    if row is None:
+        conn.execute('INSERT INTO shard_info (id, shard_index, shard_count) VALUES (1, ?, ?)', (index, shards))
+    elif tuple(row) != (index, shards):
+        raise ShardLayoutError(
+            f'{path} holds shard {row[0]} of {row[1]}, expected shard {index} of {shards}; '
+            f'run `python sharding.py rebalance` to change the shard count'
+        )
+
+
+class ShardPools:
+    """各分片連線池的合計 (提供與 SQLiteConnectionPool 相同的 pool_size / stats)"""
+
+    def __init__(self, shards: List[UserDataHandler]):
+        self._shards = shards
+
+    @property
+    def pool_size(self) -> int:
+        return sum(shard.pool.pool_size for shard in self._shards)
+
+    def stats(self) -> Dict[str, int]:
+        total = {}
+        for shard in self._shards:
+            for key, value in shard.pool.stats().items():
+                total[key] = total.get(key, 0) + value
+        return total
+
+
+class ShardedUserDataHandler:
+    """
+    以多個 UserDataHandler 組成、介面相同的 handler
+    單一使用者的操作轉給所屬分片；多位使用者的操作依分片分組後平行執行，全體查詢送到所有分片後合併
+    """
+
+    def __init__(self, db_path: str = "user_data.db", shards: int = 2, paths: Optional[List[str]] = None,
+                 threads: Optional[int] = None, **options):
+        self.db_path = db_path
+        self.paths = list(paths) if paths else shard_paths(db_path, shards)
+        self.shard_count = len(self.paths)
+        existing = [path for path in self.paths if os.path.exists(path)]
+        if not existing and not paths:
+            others = _other_layouts(db_path, self.paths)
+            if others:
+                raise ShardLayoutError(
+                    f'No shard files for {self.shard_count} shards but found {", ".join(others)}; '
+                    f'run `python sharding.py rebalance --to-shards {self.shard_count}` first'
+                )
+        elif existing and len(existing) < self.shard_count:
+            missing = sorted(set(self.paths) - set(existing))
+            raise ShardLayoutError(f'Missing shard files: {", ".join(missing)}')
+
+        self.shards: List[UserDataHandler] = []
+        try:
+            for index, path in enumerate(self.paths):
+                shard = UserDataHandler(path, **options)
+                self.shards.append(shard)
+                with shard.pool.transaction() as conn:
+                    _check_shard_info(conn, path, index, self.shard_count)
+        except Exception:
+            for shard in self.shards:
+                shard.close()
+            raise
+        self.pool = ShardPools(self.shards)
+        self._executor = ThreadPoolExecutor(max_workers=threads or self.shard_count,
+                                            thread_name_prefix='db-shard')
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for shard in self.shards:
+            shard.close()
+
+    # === 分派 ===
+    def shard_for(self, user_id: str) -> UserDataHandler:
+        return self.shards[shard_index(user_id, self.shard_count)]
+
+    def _map(self, calls: Dict[int, Callable[[UserDataHandler], Any]],
+             on_error: Optional[Callable[[int, Exception], Any]] = None) -> Dict[int, Any]:
+        """
+        calls = {分片編號: func(shard)}，平行執行並回傳 {分片編號: 結果}
+        任一分片失敗時拋出第一個例外；有 on_error 時改以 on_error(分片編號, 例外) 作為該分片的結果
+        """
+        def run(index, func):
+            try:
+                return func(self.shards[index])
+            except Exception as e:
+                if on_error is None:
+                    raise
+                return on_error(index, e)
+
+        if len(calls) == 1:
+            (index, func), = calls.items()
+            return {index: run(index, func)}
+        # 每個工作各自複製 contextvars，SQL 追蹤仍會記到目前的請求
+        futures = {
+            index: self._executor.submit(contextvars.copy_context().run, run, index, func)
+            for index, func in calls.items()
+        }
+        return {index: future.result() for index, future in futures.items()}
+
+    def _map_all(self, func: Callable[[UserDataHandler], Any]) -> List[Any]:
+        results = self._map({index: func for index in range(self.shard_count)})
+        return [results[index] for index in range(self.shard_count)]
+
+    def _group(self, items: list, key: Callable[[Any], Any]) -> Dict[int, list]:
+        groups = {}
+        for item in items:
+            groups.setdefault(shard_index(key(item), self.shard_count), []).append(item)
+        return groups
+
+    # === 通知與健康檢查 ===
+    def add_write_listener(self, listener: Callable[[str, List[str]], None]) -> None:
+        for shard in self.shards:
+            shard.add_write_listener(listener)
+
+    def add_change_listener(self, listener: Callable[[str, List[Dict[str, Any]]], None]) -> None:
+        for shard in self.shards:
+            shard.add_change_listener(listener)
+
+    def set_pending_reader(self, reader: Optional[Callable[[str], Optional[Dict[str, Any]]]]) -> None:
+        for shard in self.shards:
+            shard.set_pending_reader(reader)
+
+    def ping(self) -> float:
+        """所有分片都可讀時回傳最慢的耗時 (毫秒)"""
+        return max(self._map_all(lambda shard: shard.ping()))
+
+    def explain(self, sql: str, params: Any = ()) -> List[str]:
+        # 各分片的結構相同，查詢計畫也相同
+        return self.shards[0].explain(sql, params)
+
+    def init_database(self):
+        for shard in self.shards:
+            shard.init_database()
+
+    # === 單一使用者 ===
+    def seed_defaults(self, user_id: str) -> None:
+        return self.shard_for(user_id).seed_defaults(user_id)
+
+    def ingest_backend_data(self, user_id: str, backend_response: Dict[str, Any],
+                            as_of: Optional[str] = None) -> Dict[str, Any]:
+        return self.shard_for(user_id).ingest_backend_data(user_id, backend_response, as_of=as_of)
+
+    def process_backend_data(self, user_id: str, backend_response: Dict[str, Any]):
+        return self.shard_for(user_id).process_backend_data(user_id, backend_response)
+
+    def record_leave(self, user_id: str, *args, **kwargs) -> Dict[str, Any]:
+        return self.shard_for(user_id).record_leave(user_id, *args, **kwargs)
+
+    def get_leave_history(self, user_id: str, *args, **kwargs) -> Dict[str, Any]:
+        return self.shard_for(user_id).get_leave_history(user_id, *args, **kwargs)
+
+    def get_profile(self, user_id: str) -> Dict[str, Any]:
+        return self.shard_for(user_id).get_profile(user_id)
+
+    def get_changes(self, user_id: str, after_seq: int, limit: int = 500) -> List[Dict[str, Any]]:
+        return self.shard_for(user_id).get_changes(user_id, after_seq, limit)
+
+    def change_log_bounds(self, user_id: Optional[str] = None):
+        """seq 是各分片各自遞增，只有同一分片 (同一位使用者) 的 seq 可以比較"""
+        shard = self.shard_for(user_id) if user_id is not None else self.shards[0]
+        return shard.change_log_bounds(user_id)
+
+    def get_trend(self, user_id: str, *args, **kwargs) -> List[Dict[str, Any]]:
+        return self.shard_for(user_id).get_trend(user_id, *args, **kwargs)
+
+    def get_user_data(self, user_id: str, data_type: Optional[str] = None) -> Dict[str, Any]:
+        return self.shard_for(user_id).get_user_data(user_id, data_type)
+
+    # === 多位使用者 ===
+    def ingest_backend_batch(self, items: list, chunk_size: int = 500) -> List[Dict[str, Any]]:
+        """
+        依分片分組後平行寫入，結果的 index 仍對應原本 items 的位置
+        某個分片失敗時只有該分片的項目回報錯誤 (retryable)，其他分片照常 commit
+        """
+        def raw_user_of(position):
+            item = items[position]
+            return item.get('user_id') if isinstance(item, dict) else None
+
+        def user_of(position):
+            user_id = raw_user_of(position)
+            # 沒有合法 user_id 的項目隨便交給一個分片，由它回報錯誤
+            return user_id if isinstance(user_id, str) and user_id else ''
+
+        groups = self._group(list(range(len(items))), user_of)
+        results = self._map({
+            index: (lambda shard, positions=positions:
+                    shard.ingest_backend_batch([items[p] for p in positions], chunk_size))
+            for index, positions in groups.items()
+        }, on_error=lambda index, e: [batch_error(i, raw_user_of(p), e) for i, p in enumerate(groups[index])])
+        merged = [None] * len(items)
+        for index, positions in groups.items():
+            for result in results[index]:
+                result['index'] = positions[result['index']]
+                merged[result['index']] = result
+        missing = RuntimeError('shard returned no result')
+        return [result or batch_error(position, raw_user_of(position), missing)
+                for position, result in enumerate(merged)]
+
+    def batch_update_data(self, updates: list):
+        groups = self._group(updates, lambda row: row[0])
+        self._map({
+            index: (lambda shard, rows=rows: shard.batch_update_data(rows))
+            for index, rows in groups.items()
+        })
+
+    def get_users_data(self, user_ids: List[str], chunk_size: int = 500) -> Dict[str, Dict[str, Any]]:
+        groups = self._group(list(dict.fromkeys(user_ids)), lambda user_id: user_id)
+        results = self._map({
+            index: (lambda shard, ids=ids: shard.get_users_data(ids, chunk_size))
+            for index, ids in groups.items()
+        })
+        merged = {}
+        for index in sorted(results):
+            merged.update(results[index])
+        return merged
+
+    # === 全體 ===
+    def compact_history(self, **options) -> Dict[str, Any]:
+        started = time.perf_counter()
+        reports = self._map_all(lambda shard: shard.compact_history(**options))
+        merged = {'cutoff': reports[0]['cutoff'], 'remaining': any(report['remaining'] for report in reports)}
+        for key in ('rows_compacted', 'buckets_written', 'day_buckets_pruned', 'changes_pruned', 'batches'):
+            merged[key] = sum(report[key] for report in reports)
+        merged['took_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return merged
+
+    def sync_staff(self, source_path: str, today: Optional[str] = None) -> Dict[str, Any]:
+        """每個分片都匯入完整的員工資料；各分片的內容相同，回報取變動最多的分片"""
+        started = time.perf_counter()
+        reports = self._map_all(lambda shard: shard.sync_staff(source_path, today))
+        report = dict(max(reports, key=lambda report: (report['changed'], report['removed'])))
+        report['took_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        return report
+
+    def rebuild_aggregates(self, verify_only: bool = False, max_examples: int = 20) -> Dict[str, Any]:
+        started = time.perf_counter()
+        reports = self._map_all(lambda shard: shard.rebuild_aggregates(verify_only, max_examples))
+        examples = [dict(example, shard=index) for index, report in enumerate(reports) for example in report['examples']]
+        return {
+            'departments': max(report['departments'] for report in reports),
+            'mismatches': sum(report['mismatches'] for report in reports),
+            'examples': examples[:max_examples],
+            'rebuilt': not verify_only,
+            'shards': self.shard_count,
+            'took_ms': round((time.perf_counter() - started) * 1000, 3)
+        }
+
+    def get_department_aggregates(self, dept_name: Optional[str] = None, upcoming_limit: int = 5,
+                                  today: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        各分片的部門彙總相加：人數與總和直接相加後重算平均；
+        各分片各自取最近的 upcoming_limit 個日期，同一天的人數相加後再取前 upcoming_limit 個
+        """
+        results = self._map_all(lambda shard: shard.get_department_aggregates(dept_name, upcoming_limit, today))
+        metrics, upcoming, units = {}, {}, {}
+        for result in results:
+            for dept, department in result.items():
+                for data_type, metric in department['metrics'].items():
+                    totals = metrics.setdefault(dept, {}).setdefault(data_type, [0, 0.0])
+                    totals[0] += metric['members']
+                    totals[1] += metric['total']
+                    units[data_type] = metric['unit']
+                for data_type, days in department['upcoming'].items():
+                    counts = upcoming.setdefault(dept, {}).setdefault(data_type, {})
+                    for day in days:
+                        counts[day['date']] = counts.get(day['date'], 0) + day['members']
+        merged = {}
+        for dept in sorted(metrics.keys() | upcoming.keys()):
+            merged[dept] = {
+                'metrics': {
+                    data_type: {
+                        'members': members,
+                        'total': round(total, 4),
+                        'average': round(total / members, 2),
+                        'unit': units[data_type]
+                    }
+                    for data_type, (members, total) in sorted(metrics.get(dept, {}).items())
+                },
+                'upcoming': {
+                    data_type: [{'date': day, 'members': counts[day]} for day in sorted(counts)[:upcoming_limit]]
+                    for data_type, counts in sorted(upcoming.get(dept, {}).items())
+                }
+            }
+        return merged
+
+    def get_upcoming(self, data_type: str, start: str, end: str, limit: int = 1000) -> List[Dict[str, Any]]:
+        results = self._map_all(lambda shard: shard.get_upcoming(data_type, start, end, limit))
+        merged = heapq.merge(*results, key=lambda row: (row['date'], row['user_id']))
+        return list(itertools.islice(merged, limit))
+
+    def iter_export(self, table: str = 'current', updated_from: Optional[str] = None,
+                    updated_to: Optional[str] = None, data_types: Optional[List[str]] = None,
+                    cursor: Optional[str] = None, page_size: int = 1000, fetch_size: int = 200):
+        """
+        各分片依 (updated_at, id) 讀取後合併；id 換成 分片內 id * 分片數 + 分片編號，
+        因此合併後的 (updated_at, id) 仍是唯一且遞增的續傳位置
+        """
+        count = self.shard_count
+        after = decode_export_cursor(cursor) if cursor else None
+
+        def rows(index, shard):
+            shard_cursor = None
+            if after:
+                # 合併後 id > c 等同於分片內 id > (c - index) // count
+                shard_cursor = encode_export_cursor(after[0], (after[1] - index) // count)
+            for row in shard.iter_export(table, updated_from, updated_to, data_types,
+                                         shard_cursor, page_size, fetch_size):
+                row['id'] = row['id'] * count + index
+                yield row
+
+        yield from heapq.merge(*(rows(index, shard) for index, shard in enumerate(self.shards)),
+                               key=lambda row: (row['updated_at'], row['id']))
+
+
+# === 調整分片數 ===
+def _table_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def _row_counts(path: str, tables) -> Dict[str, int]:
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in tables}
+    finally:
+        conn.close()
+
+
+def rebalance(source_paths: List[str], target_paths: List[str], busy_timeout: int = 5000) -> Dict[str, Any]:
+    """
+    把 source_paths 的資料依 shard_index(user_id, len(target_paths)) 重新分配到 target_paths
+    目標檔案必須不存在或是空的；來源檔案不會被修改，確認無誤後再自行刪除
+    服務需先停止 (搬移期間的寫入不會被帶到新檔案)
+    """
+    started = time.perf_counter()
+    overlap = set(map(os.path.abspath, source_paths)) & set(map(os.path.abspath, target_paths))
+    if overlap:
+        raise ShardLayoutError(f'Target files overlap with the source files: {", ".join(sorted(overlap))}; '
+                               f'move the old files aside first')
+    for path in source_paths:
+        if not os.path.exists(path):
+            raise ShardLayoutError(f'Source shard not found: {path}')
+        # 開啟一次讓舊版資料庫升級到目前的結構
+        UserDataHandler(path, pool_size=1, busy_timeout=busy_timeout).close()
+    shards = len(target_paths)
+    tables = USER_TABLES + REPLICATED_TABLES
+
+    for path in target_paths:
+        UserDataHandler(path, pool_size=1, busy_timeout=busy_timeout).close()
+        counts = _row_counts(path, tables)
+        if any(counts.values()):
+            raise ShardLayoutError(f'Target {path} is not empty; remove it before rebalancing')
+
+    # 新檔案的變更 seq 從所有來源的最大值之後開始，舊的 Last-Event-ID 只會觸發重新取得完整資料
+    last_seq = 0
+    for path in source_paths:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        try:
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'user_data_changes'").fetchone()
+            last_seq = max(last_seq, row[0] if row else 0)
+        finally:
+            conn.close()
+
+    for index, path in enumerate(target_paths):
+        conn = sqlite3.connect(path, isolation_level=None)
+        try:
+            conn.execute(f'PRAGMA busy_timeout = {busy_timeout}')
+            conn.create_function('flabba_shard', 1, lambda user_id: shard_index(user_id, shards),
+                                 deterministic=True)
+            conn.execute('BEGIN IMMEDIATE')
+            # 搬移期間不逐筆維護部門彙總，最後一次重算
+            for name in DEPT_AGGREGATE_TRIGGERS:
+                conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = 'user_data_changes'")
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('user_data_changes', ?)", (last_seq,))
+            conn.execute('COMMIT')
+
+            for source in source_paths:
+                # ATTACH 不能在交易內執行，每個來源各自一個交易
+                conn.execute('ATTACH DATABASE ? AS source', (source,))
+                conn.execute('BEGIN IMMEDIATE')
+                for table in REPLICATED_TABLES:
+                    conn.execute(f'INSERT OR IGNORE INTO main.{table} SELECT * FROM source.{table}')
+                for table in USER_TABLES:
+                    columns = _table_columns(conn, table)
+                    # 依原本的寫入順序搬移，新的 id / seq 仍與時間順序一致
+                    order = f'ORDER BY {columns[0]}' if columns[0] in ('id', 'seq') else ''
+                    columns = ', '.join(column for column in columns if column not in ('id', 'seq'))
+                    conn.execute(f'''
+                        INSERT INTO main.{table} ({columns})
+                        SELECT {columns} FROM source.{table}
+                         WHERE flabba_shard(user_id) = ?
+                         {order}
+                    ''', (index,))
+                conn.execute('COMMIT')
+                conn.execute('DETACH DATABASE source')
+
+            conn.execute('BEGIN IMMEDIATE')
+            UserDataHandler._rebuild_aggregates(conn)
+            for name, body in DEPT_AGGREGATE_TRIGGERS.items():
+                conn.execute(f'CREATE TRIGGER {name} {body}')
+            if shards > 1:
+                _check_shard_info(conn, path, index, shards)
+            conn.execute('COMMIT')
+            conn.execute('PRAGMA optimize')
+        finally:
+            conn.close()
+
+    # 確認每個分片資料表的總筆數與來源相同、每個目標都有完整的員工資料
+    before = {table: 0 for table in USER_TABLES}
+    staff = set()
+    for path in source_paths:
+        for table, count in _row_counts(path, USER_TABLES).items():
+            before[table] += count
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        try:
+            staff.update(row[0] for row in conn.execute('SELECT staff_id FROM staff_profile'))
+        finally:
+            conn.close()
+    after = {table: 0 for table in USER_TABLES}
+    for path in target_paths:
+        counts = _row_counts(path, tables)
+        for table in USER_TABLES:
+            after[table] += counts[table]
+        if counts['staff_profile'] != len(staff):
+            raise ShardLayoutError(f'{path} has {counts["staff_profile"]} staff rows, expected {len(staff)}')
+    if before != after:
+        raise ShardLayoutError(f'Row counts differ after rebalancing: source {before}, target {after}')
+
+    return {
+        'sources': list(source_paths),
+        'targets': list(target_paths),
+        'rows': after,
+        'staff': len(staff),
+        'took_ms': round((time.perf_counter() - started) * 1000, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='user_data.db sharding maintenance')
+    parser.add_argument('--db', default=os.getenv('DB_PATH', 'user_data.db'))
+    sub = parser.add_subparsers(dest='command', required=True)
+    move = sub.add_parser('rebalance', help='redistribute users into a new number of shard files')
+    move.add_argument('--from-shards', type=int, default=int(os.getenv('DB_SHARDS', '1')))
+    move.add_argument('--to-shards', type=int, required=True)
+    sub.add_parser('status', help='show the shard files and row counts')
+    args = parser.parse_args()
+
+    if args.command == 'rebalance':
+        report = rebalance(shard_paths(args.db, args.from_shards), shard_paths(args.db, args.to_shards))
+        print(json.dumps(report, ensure_ascii=False))
+        print(f'Done. Set DB_SHARDS={args.to_shards} and restart; the old files are kept as a backup.',
+              file=sys.stderr)
+        return
+
+    root, ext = os.path.splitext(args.db)
+    for path in sorted({args.db, *glob.glob(f'{glob.escape(root)}.*-of-*{ext}')}):
+        if os.path.exists(path):
+            counts = _row_counts(path, ('user_data_current', 'user_data', 'staff_profile'))
+            print(path, json.dumps(counts))
+
+
+if __name__ == '__main__':
+    main()
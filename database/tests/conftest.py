@@ -0,0 +1,143 @@
+"""
+共用 fixture：每個測試使用 tmp_path 下自己的資料庫、員工資料與 journal
+
+api_server 在 import 時依環境變數建立 db_handler 與背景元件，
+make_server(**env) 設定環境變數後重新 import，測試結束時關閉
+"""
+import contextlib
+import importlib
+import os
+import sqlite3
+import sys
+
+import pytest
+
+DATABASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if DATABASE_DIR not in sys.path:
+    sys.path.insert(0, DATABASE_DIR)
+
+# 與 db.js 的 staff 表相同的欄位 (salary 等未匯入的欄位省略)
+STAFF = [
+    ('user001', 'John', 'Doe', 'john.doe@company.com', '2020-01-15', 'Senior Engineer', 'Engineering', '555-0101', None),
+    ('EMP002', 'Jane', 'Smith', 'jane.smith@company.com', '2019-03-20', 'Marketing Manager', 'Marketing', '555-0102', 'user001'),
+    ('EMP003', 'Bob', 'Johnson', 'bob.johnson@company.com', '2021-06-10', 'HR Specialist', 'Human Resources', '555-0103', 'EMP002'),
+    ('EMP005', 'Charlie', 'Brown', 'charlie.b@company.com', '2021-08-15', 'Software Developer', 'Engineering', '555-0105', 'user001'),
+]
+
+# 每次重新 import 時都要重新讀取的環境變數
+SERVER_ENV = ('DB_PATH', 'DB_SHARDS', 'DB_SHARD_PATHS', 'DB_WRITER_ADDRESS', 'WRITE_BEHIND', 'WRITE_BEHIND_DIR',
+              'WRITE_BEHIND_INTERVAL_MS', 'STAFF_DB_PATH', 'STAFF_SYNC_INTERVAL', 'SSE_POLL_INTERVAL',
+              'RAG_CORPUS_DIR', 'RAG_INDEX_DIR', 'HISTORY_RETENTION_DAYS', 'PROFILE_CACHE_TTL', 'SLOW_REQUEST_MS')
+
+# 小型福利文件語料，檢索測試不依賴 RAG/tsmc_benefits 的實際內容
+CORPUS = {
+    '01_salary.md': (
+        '# 薪資制度\n\n## 發薪日\n每月 5 日發放薪資 (salary)，遇假日提前一天。\n\n'
+        '## 加班費\n平日加班前兩小時以 1.34 倍計算加班費。\n'
+    ),
+    '02_bonus.md': '# 獎金制度\n\n## 年終獎金\n年終獎金 (bonus) 於農曆年前發放，依績效調整。\n',
+    '09_annual_leave.md': (
+        '# 年假制度\n\n## 給假標準\n到職滿一年享有 7 天特休 (annual leave)，滿兩年 10 天。\n\n'
+        '## 未休處理\n未休完的特休於年底折算工資。\n'
+    ),
+}
+
+
+def create_company_db(path, staff=STAFF):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE staff (
+            staff_id TEXT PRIMARY KEY, first_name TEXT NOT NULL, last_name TEXT NOT NULL, email TEXT UNIQUE,
+            hire_date DATE, job_title TEXT, dept_name TEXT NOT NULL, phone TEXT, manager_id TEXT,
+            status TEXT DEFAULT 'active'
+        )
+    ''')
+    conn.executemany('''
+        INSERT INTO staff (staff_id, first_name, last_name, email, hire_date, job_title, dept_name, phone, manager_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', staff)
+    conn.commit()
+    conn.close()
+    return path
+
+
+@contextlib.contextmanager
+def lock_database(path):
+    """由另一個連線持有寫入鎖，模擬鎖住時間超過 busy_timeout"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def write_corpus(corpus_dir, files=CORPUS):
+    os.makedirs(corpus_dir, exist_ok=True)
+    for name, text in files.items():
+        with open(os.path.join(corpus_dir, name), 'w', encoding='utf-8') as f:
+            f.write(text)
+    return corpus_dir
+
+
+@pytest.fixture
+def corpus_dir(tmp_path):
+    return write_corpus(str(tmp_path / 'corpus'))
+
+
+@pytest.fixture
+def company_db(tmp_path):
+    return create_company_db(str(tmp_path / 'company.db'))
+
+
+@pytest.fixture
+def handler(tmp_path):
+    from data_handler import UserDataHandler
+    handler = UserDataHandler(str(tmp_path / 'user_data.db'))
+    yield handler
+    handler.close()
+
+
+@pytest.fixture
+def make_server(tmp_path, monkeypatch, company_db):
+    servers = []
+
+    def make(**env):
+        for name in SERVER_ENV:
+            monkeypatch.delenv(name, raising=False)
+        defaults = {
+            'DB_PATH': str(tmp_path / 'user_data.db'),
+            'STAFF_DB_PATH': company_db,
+            'STAFF_SYNC_INTERVAL': '0',
+            'WRITE_BEHIND_DIR': str(tmp_path / 'journal'),
+            'SSE_POLL_INTERVAL': '0.05',
+            'RAG_INDEX_DIR': str(tmp_path / 'rag_index'),
+        }
+        for name, value in {**defaults, **env}.items():
+            monkeypatch.setenv(name, str(value))
+        for module in ('main', 'api_server'):
+            sys.modules.pop(module, None)
+        server = importlib.import_module('api_server')
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        if server.write_queue is not None:
+            server.write_queue.close()
+        server.staff_sync.stop()
+        server.rag_service.close()
+        server.db_handler.close()
+    for module in ('main', 'api_server'):
+        sys.modules.pop(module, None)
+
+
+@pytest.fixture
+def server(make_server):
+    return make_server()
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
@@ -0,0 +1,66 @@
+"""trigger 維護的部門彙總與完整重算一致"""
+import random
+import sqlite3
+import subprocess
+import sys
+
+from conftest import DATABASE_DIR, STAFF, create_company_db
+
+
+def test_trigger_maintained_aggregates_match_a_rebuild(handler, tmp_path, company_db):
+    handler.sync_staff(company_db, today='2025-10-01')
+    rng = random.Random(20)
+    users = [row[0] for row in STAFF] + ['no_staff_row']
+    for _ in range(200):
+        user_id = rng.choice(users)
+        if rng.random() < 0.2:
+            handler.record_leave(user_id, 'annual_leave', '2025-10-01', '2025-10-01', rng.choice([0.5, 1, 2]))
+        else:
+            handler.ingest_backend_data(user_id, {
+                rng.choice(['leave_days', 'overtime_hours', 'salary']): rng.randint(0, 50000),
+                'next_bonus_date': f'2025-{rng.randint(10, 12)}-{rng.randint(1, 28):02d}'
+            })
+
+    # 換部門、離職、新進員工都會移動彙總
+    moved = [('EMP002',) + STAFF[1][1:6] + ('Engineering',) + STAFF[1][7:]] + STAFF[2:]
+    moved.append(('EMP009', 'Dana', 'Lee', 'dana@company.com', '2024-02-01', 'Recruiter', 'Human Resources',
+                  '555-0109', 'EMP003'))
+    handler.sync_staff(create_company_db(str(tmp_path / 'company2.db'), moved), today='2025-10-02')
+    handler.ingest_backend_data('EMP009', {'salary': 30000})
+
+    report = handler.rebuild_aggregates(verify_only=True)
+    assert report['mismatches'] == 0, report['examples']
+    departments = handler.get_department_aggregates(today='2025-10-01')
+    assert sorted(departments) == ['Engineering', 'Human Resources']
+    assert departments['Engineering']['metrics']['salary']['members'] == 2
+
+
+def test_verify_cli_exits_non_zero_on_mismatch(handler, company_db):
+    handler.sync_staff(company_db)
+    handler.ingest_backend_data('user001', {'salary': 40000})
+    command = [sys.executable, 'data_handler.py', '--db', handler.db_path, 'rebuild-aggregates', '--verify']
+    assert subprocess.run(command, cwd=DATABASE_DIR, capture_output=True).returncode == 0
+
+    conn = sqlite3.connect(handler.db_path)
+    conn.execute("UPDATE dept_aggregate SET value_sum = value_sum + 1 WHERE data_type = 'salary'")
+    conn.commit()
+    conn.close()
+    result = subprocess.run(command, cwd=DATABASE_DIR, capture_output=True, text=True)
+    assert result.returncode == 1
+    assert '"mismatches": 1' in result.stdout
+
+    # 不加 --verify 時重建後恢復一致
+    subprocess.run(command[:-1], cwd=DATABASE_DIR, check=True, capture_output=True)
+    assert handler.rebuild_aggregates(verify_only=True)['mismatches'] == 0
+
+
+def test_rebuild_endpoint(client):
+    assert client.post('/api/staff/sync').get_json()['report']['staff'] == len(STAFF)
+    client.post('/api/llm/callback', json={'user_id': 'user001', 'extracted_data': {'salary': 40000}})
+    body = client.post('/api/aggregates/rebuild', json={'verify_only': True}).get_json()
+    assert body['report']['mismatches'] == 0
+    assert body['report']['rebuilt'] is False
+    assert client.post('/api/aggregates/rebuild', json={'verify_only': 'yes'}).status_code == 400
+    engineering = client.get('/api/aggregates/departments/Engineering').get_json()
+    assert engineering['metrics']['salary']['total'] == 40000
+    assert client.get('/api/aggregates/departments/Nowhere').status_code == 404
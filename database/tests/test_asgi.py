@@ -0,0 +1,70 @@
+"""ASGI (main.py) 與 Flask 的路由與回應一致"""
+import importlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+from metrics import normalize_route
+
+LEAVE = {'user_id': 'u1', 'leave_type': 'annual_leave', 'start_date': '2025-10-01', 'end_date': '2025-10-01'}
+
+
+@pytest.fixture
+def asgi(server):
+    main = importlib.import_module('main')
+    yield TestClient(main.app)
+    main.db_executor.shutdown(wait=True)
+
+
+@pytest.mark.parametrize('body, status', [
+    ({**LEAVE, 'days': 'abc'}, 400),
+    ({**LEAVE, 'days': True}, 400),
+    ({**LEAVE, 'days': -1}, 400),
+    ({**LEAVE, 'days': 1}, 200),
+])
+def test_leave_days_validation_matches(client, asgi, body, status):
+    flask_response = client.post('/api/leave/record', json=body)
+    asgi_response = asgi.post('/api/leave/record', json=body)
+    assert flask_response.status_code == asgi_response.status_code == status
+    if status == 400:
+        assert flask_response.get_json() == asgi_response.json()
+
+
+def test_invalid_json_is_a_client_error(client, asgi):
+    for path in ('/api/leave/record', '/api/llm/callback'):
+        assert client.post(path, data='{', content_type='application/json').status_code == 400
+        assert asgi.post(path, content='{', headers={'Content-Type': 'application/json'}).status_code == 400
+
+
+def test_same_responses_and_route_labels(client, asgi, server):
+    asgi.post('/api/llm/callback', json={'user_id': 'u1', 'extracted_data': {'leave_days': 12}})
+    flask_response = client.get('/api/frontend/users/u1/data')
+    asgi_response = asgi.get('/api/frontend/users/u1/data')
+    assert flask_response.headers['ETag'] == asgi_response.headers['ETag']
+    assert asgi.get('/api/frontend/users/u1/data', headers={'If-None-Match': asgi_response.headers['ETag']}).status_code == 304
+
+    health = asgi.get('/health').json()
+    assert (health['server'], health['db_threads']) == ('asgi', server.db_handler.pool.pool_size)
+    assert asgi.get('/job_tenure', params={'user_id': 'nobody'}).status_code == 404
+
+    metrics = asgi.get('/metrics').text
+    assert 'route="/api/frontend/users/<user_id>/data"' in metrics
+    assert 'route="/job_tenure"' in metrics
+    assert '{user_id}' not in metrics
+
+
+def test_normalize_route():
+    assert normalize_route('/api/frontend/users/{user_id}/events') == '/api/frontend/users/<user_id>/events'
+    assert normalize_route('/files/{path:path}') == '/files/<path>'
+    assert normalize_route('/api/leave/history/<user_id>') == '/api/leave/history/<user_id>'
+    assert normalize_route('/items/<int:item_id>') == '/items/<item_id>'
+
+
+
+def test_job_tenure(asgi, client):
+    # 不帶 user_id 時與舊版相同
+    assert asgi.get('/job_tenure').json() == {'job_tenure': '5'}
+    client.post('/api/staff/sync')
+    body = asgi.get('/job_tenure', params={'user_id': 'user001'}).json()
+    assert body['user_id'] == 'user001'
+    assert int(body['job_tenure']) >= 5
@@ -0,0 +1,69 @@
+"""批次回調的逐筆錯誤與多使用者查詢"""
+from conftest import lock_database
+from data_handler import UserDataHandler
+
+
+def test_batch_reports_errors_per_item(client):
+    response = client.post('/api/llm/callback/batch', json={'items': [
+        {'user_id': 'u1', 'extracted_data': {'leave_days': 10}},
+        {'extracted_data': {'leave_days': 3}},
+        {'user_id': 'u2', 'extracted_data': 'not an object'},
+        {'user_id': 'u3', 'extracted_data': {'next_bonus_date': 'someday'}},
+        'not an object',
+        {'user_id': 'u4', 'extracted_data': {'salary': 50000, 'next_bonus_date': '2025/12/15'}},
+    ], 'chunk_size': 2})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body['total'], body['succeeded'], body['failed']) == (6, 2, 4)
+
+    results = body['results']
+    assert [r['index'] for r in results] == list(range(6))
+    assert [r['success'] for r in results] == [True, False, False, False, False, True]
+    assert results[1]['error'] == 'user_id is required'
+    assert results[2]['error'] == 'extracted_data must be an object'
+    assert results[3]['error'] == "Invalid date: 'someday'"
+    assert results[5]['changed_fields'] == ['bonus', 'leave', 'meal', 'overtime', 'salary']
+
+    # 失敗的項目沒有寫入任何資料，其他項目不受影響
+    data = client.get('/api/frontend/users/data?ids=u1,u2,u3,u4').get_json()
+    assert sorted(data['data']) == ['u1', 'u4']
+    assert data['missing'] == ['u2', 'u3']
+    assert data['data']['u1']['leave']['value'] == 10.0
+    assert data['data']['u4']['bonus']['value'] == '2025-12-15'
+
+
+def test_locked_database_reports_every_item(tmp_path):
+    db_path = str(tmp_path / 'user_data.db')
+    handler = UserDataHandler(db_path, busy_timeout=50)
+    try:
+        items = [{'user_id': 'u1', 'extracted_data': {'leave_days': 10}}, {'user_id': 'u2', 'extracted_data': {}}]
+        with lock_database(db_path):
+            results = handler.ingest_backend_batch(items)
+        assert [(r['index'], r['user_id'], r['success'], r['retryable']) for r in results] == [
+            (0, 'u1', False, True), (1, 'u2', False, True)
+        ]
+        assert 'locked' in results[0]['error']
+        assert handler.get_user_data('u1') == {}
+        # 鎖解除後重送同一批即可寫入
+        assert [r['success'] for r in handler.ingest_backend_batch(items)] == [True, True]
+    finally:
+        handler.close()
+
+
+def test_batch_rejects_invalid_requests(client):
+    assert client.post('/api/llm/callback/batch', json={'items': []}).status_code == 400
+    assert client.post('/api/llm/callback/batch', json={'items': [{}], 'chunk_size': 0}).status_code == 400
+    assert client.post('/api/llm/callback/batch', data='nope', content_type='application/json').status_code == 400
+
+
+def test_bulk_summary_and_id_limits(client, server):
+    client.post('/api/llm/callback/batch', json={'items': [
+        {'user_id': f'u{i}', 'extracted_data': {'overtime_hours': i}} for i in range(3)
+    ]})
+    body = client.get('/api/frontend/users/summary?ids=u0,u1&ids=u2,missing').get_json()
+    assert [body['summaries'][f'u{i}']['work_status']['overtime_hours'] for i in range(3)] == [0, 1, 2]
+    assert body['missing'] == ['missing']
+
+    assert client.get('/api/frontend/users/summary').status_code == 400
+    too_many = ','.join(f'u{i}' for i in range(server.BULK_MAX_IDS + 1))
+    assert client.get(f'/api/frontend/users/data?ids={too_many}').status_code == 400
@@ -0,0 +1,61 @@
+"""前端資料快取、ETag / 304 與寫入失效"""
+
+
+def callback(client, user_id, **fields):
+    response = client.post('/api/llm/callback', json={'user_id': user_id, 'extracted_data': fields})
+    assert response.status_code == 200
+    return response
+
+
+def test_etag_returns_304_until_data_changes(client):
+    callback(client, 'u1', leave_days=12)
+    first = client.get('/api/frontend/users/u1/data')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    again = client.get('/api/frontend/users/u1/data', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+
+    callback(client, 'u1', leave_days=11)
+    changed = client.get('/api/frontend/users/u1/data', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.get_json()['data']['leave']['value'] == 11.0
+
+
+def test_variants_have_different_etags(client):
+    callback(client, 'u1', leave_days=12)
+    detailed = client.get('/api/frontend/users/u1/data').headers['ETag']
+    simple = client.get('/api/frontend/users/u1/data?format=simple').headers['ETag']
+    summary = client.get('/api/frontend/users/u1/summary').headers['ETag']
+    assert len({detailed, simple, summary}) == 3
+
+
+def test_writes_invalidate_cached_summary(client, server):
+    callback(client, 'u1', overtime_hours=5)
+    assert client.get('/api/frontend/users/u1/summary').get_json()['summary']['work_status']['overtime_hours'] == 5
+    assert client.get('/api/frontend/users/u1/summary').status_code == 200
+    hits = server.profile_cache.stats()['hits']
+    assert hits >= 1
+
+    callback(client, 'u1', overtime_hours=8)
+    assert client.get('/api/frontend/users/u1/summary').get_json()['summary']['work_status']['overtime_hours'] == 8
+
+    # 扣除特休也會讓快取失效
+    client.post('/api/leave/record', json={
+        'user_id': 'u1', 'leave_type': 'annual_leave', 'start_date': '2025-10-01', 'end_date': '2025-10-01',
+        'days': 1
+    })
+    summary = client.get('/api/frontend/users/u1/summary').get_json()['summary']
+    assert summary['work_status']['leave_days'] == 14
+    assert server.profile_cache.stats()['invalidations'] >= 2
+
+
+def test_unchanged_write_keeps_etag(client):
+    callback(client, 'u1', leave_days=12)
+    etag = client.get('/api/frontend/users/u1/data').headers['ETag']
+    # 值沒有改變時不會寫入，updated_at 不變，ETag 仍然有效
+    callback(client, 'u1', leave_days=12)
+    assert client.get('/api/frontend/users/u1/data', headers={'If-None-Match': etag}).status_code == 304
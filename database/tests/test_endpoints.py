@@ -0,0 +1,20 @@
+"""/health 與 404 回應列出的端點一致，並涵蓋所有路由"""
+import re
+
+
+def test_endpoint_lists_match(client):
+    endpoints = client.get('/health').get_json()['endpoints']
+    available = client.get('/nope').get_json()['available_endpoints']
+    # jsonify 會排序 key，只比較內容
+    assert sorted(entry.split(' ', 1)[1] for entry in available) == sorted(endpoints.values())
+    assert 'GET /api/frontend/users/<user_id>/profile' in available
+
+
+def test_every_route_is_listed(client, server):
+    listed = set()
+    for _, _, path in server.ENDPOINTS:
+        path = path.split('?')[0]
+        # /api/aggregates/departments[/<dept_name>] 代表兩個路由
+        listed.update({re.sub(r'\[.*\]', '', path), path.replace('[', '').replace(']', '')})
+    routes = {rule.rule for rule in server.app.url_map.iter_rules() if rule.endpoint != 'static'}
+    assert routes <= listed, sorted(routes - listed)
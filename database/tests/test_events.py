@@ -0,0 +1,89 @@
+"""SSE 變更推送與 Last-Event-ID 續傳"""
+import json
+
+
+def open_stream(client, user_id, last_event_id=None):
+    headers = {'Last-Event-ID': str(last_event_id)} if last_event_id is not None else {}
+    response = client.get(f'/api/frontend/users/{user_id}/events', headers=headers, buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    return response, iter(response.response)
+
+
+def next_events(chunks, count):
+    """讀到 count 個事件為止 (略過 retry 與 keepalive)"""
+    events = []
+    while len(events) < count:
+        chunk = next(chunks)
+        chunk = chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
+        if chunk.startswith((':', 'retry:')):
+            continue
+        event = {}
+        for line in chunk.strip().splitlines():
+            name, value = line.split(': ', 1)
+            event[name] = json.loads(value) if name == 'data' else value
+        events.append(event)
+    return events
+
+
+def callback(client, user_id, **fields):
+    assert client.post('/api/llm/callback', json={'user_id': user_id, 'extracted_data': fields}).status_code == 200
+
+
+def test_snapshot_then_live_changes(client):
+    callback(client, 'u1', leave_days=12)
+    response, chunks = open_stream(client, 'u1')
+    try:
+        snapshot, = next_events(chunks, 1)
+        assert snapshot['event'] == 'snapshot'
+        assert snapshot['data']['data']['leave']['value'] == 12.0
+
+        callback(client, 'u1', leave_days=11)
+        callback(client, 'other', leave_days=1)
+        change, = next_events(chunks, 1)
+        assert change['event'] == 'change'
+        assert int(change['id']) > int(snapshot['id'])
+        assert list(change['data']['changes']) == ['leave']
+        assert change['data']['changes']['leave']['value'] == 11.0
+    finally:
+        response.close()
+
+
+def test_last_event_id_resumes_missed_changes(client):
+    callback(client, 'u1', leave_days=12)
+    response, chunks = open_stream(client, 'u1')
+    snapshot, = next_events(chunks, 1)
+    response.close()
+
+    # 斷線期間的變更在重新連線時補送，同一欄位只送最後的值
+    callback(client, 'u1', leave_days=11)
+    callback(client, 'u1', meal_allowance=50)
+    callback(client, 'u1', leave_days=10)
+
+    response, chunks = open_stream(client, 'u1', last_event_id=snapshot['id'])
+    try:
+        change, = next_events(chunks, 1)
+        assert change['event'] == 'change'
+        assert change['data']['changes']['leave']['value'] == 10.0
+        assert change['data']['changes']['meal']['value'] == 50.0
+        last_id = change['id']
+    finally:
+        response.close()
+
+    # 已經是最新的位置：不送 snapshot，只有 keepalive
+    response, chunks = open_stream(client, 'u1', last_event_id=last_id)
+    try:
+        assert next(chunks).startswith(b'retry:')
+        assert next(chunks) == b': keepalive\n\n'
+    finally:
+        response.close()
+
+
+def test_unknown_or_future_event_id_gets_snapshot(client):
+    callback(client, 'u1', leave_days=12)
+    for last_event_id in ('garbage', 10 ** 9):
+        response, chunks = open_stream(client, 'u1', last_event_id=last_event_id)
+        try:
+            assert next_events(chunks, 1)[0]['event'] == 'snapshot'
+        finally:
+            response.close()
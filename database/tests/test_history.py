@@ -0,0 +1,87 @@
+"""歷史紀錄壓縮成每日 / 每月彙總與趨勢查詢"""
+import pytest
+
+OLD_WRITES = [
+    ('2024-01-15 08:00:00.000000', 10),
+    ('2024-01-20 08:00:00.000000', 20),
+    ('2024-02-03 08:00:00.000000', 5),
+]
+
+
+def write_old_history(handler, user_id='u1'):
+    for at, hours in OLD_WRITES:
+        handler._now = lambda at=at: at
+        handler.ingest_backend_data(user_id, {'overtime_hours': hours})
+    del handler._now
+    handler.ingest_backend_data(user_id, {'overtime_hours': 30})
+
+
+def count_history(handler, where='1 = 1', params=()):
+    with handler.pool.connection() as conn:
+        return conn.execute(f'SELECT COUNT(*) FROM user_data WHERE {where}', params).fetchone()[0]
+
+
+def test_compaction_deletes_old_rows_and_keeps_the_trend(handler):
+    write_old_history(handler)
+    before = handler.get_trend('u1', 'overtime', 'month')
+    current = handler.get_user_data('u1')
+    old_rows = count_history(handler, 'updated_at < ?', ('2025-01-01',))
+    assert old_rows > 0
+
+    report = handler.compact_history(retention_days=90, day_retention_days=100000, batch_size=2, pause=0)
+    assert report['rows_compacted'] == old_rows
+    assert report['batches'] == (old_rows + 1) // 2
+    assert report['remaining'] is False
+    assert count_history(handler, 'updated_at < ?', ('2025-01-01',)) == 0
+    # 保留期限內的紀錄與目前值不受影響
+    assert count_history(handler, "data_type = 'overtime' AND updated_at >= ?", ('2025-01-01',)) == 1
+    assert handler.get_user_data('u1') == current
+
+    after = handler.get_trend('u1', 'overtime', 'month')
+    assert after == before
+    january, february = after[0], after[1]
+    assert (january['bucket'], january['first'], january['last'], january['min'], january['max']) == \
+        ('2024-01', 10.0, 20.0, 10.0, 20.0)
+    assert (january['avg'], january['samples']) == (15.0, 2)
+    assert (february['bucket'], february['last']) == ('2024-02', 5.0)
+    assert after[-1]['last'] == 30.0
+
+    days = handler.get_trend('u1', 'overtime', 'day', start='2024-01-01', end='2024-01-31')
+    assert [(day['bucket'], day['last']) for day in days] == [('2024-01-15', 10.0), ('2024-01-20', 20.0)]
+
+    # 已壓縮的資料不會重複計入
+    assert handler.compact_history(retention_days=90, day_retention_days=100000)['rows_compacted'] == 0
+    assert handler.get_trend('u1', 'overtime', 'month') == before
+
+
+def test_max_batches_leaves_the_rest_for_later(handler):
+    write_old_history(handler)
+    old_rows = count_history(handler, 'updated_at < ?', ('2025-01-01',))
+    report = handler.compact_history(retention_days=90, batch_size=1, max_batches=2, pause=0)
+    assert (report['rows_compacted'], report['remaining']) == (2, True)
+    assert count_history(handler, 'updated_at < ?', ('2025-01-01',)) == old_rows - 2
+
+    report = handler.compact_history(retention_days=90, batch_size=100, pause=0)
+    assert (report['rows_compacted'], report['remaining']) == (old_rows - 2, False)
+
+
+def test_old_day_buckets_are_pruned(handler):
+    write_old_history(handler)
+    handler.compact_history(retention_days=90, day_retention_days=90, pause=0)
+    assert handler.get_trend('u1', 'overtime', 'day', end='2024-12-31') == []
+    assert [month['bucket'] for month in handler.get_trend('u1', 'overtime', 'month', end='2024-12')] == \
+        ['2024-01', '2024-02']
+
+    with pytest.raises(ValueError):
+        handler.get_trend('u1', 'overtime', 'year')
+
+
+def test_compact_endpoint(server, client):
+    write_old_history(server.db_handler)
+    body = client.post('/api/history/compact', json={'retention_days': 90}).get_json()
+    assert body['success'] is True
+    assert body['report']['rows_compacted'] > 0
+    trend = client.get('/api/frontend/users/u1/trend?data_type=overtime&period=month').get_json()
+    assert [bucket['bucket'] for bucket in trend['buckets']][:2] == ['2024-01', '2024-02']
+
+    assert client.post('/api/history/compact', json={'retention_days': 0}).status_code == 400
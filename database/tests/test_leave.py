@@ -0,0 +1,99 @@
+"""請假紀錄與特休扣除"""
+import json
+import threading
+
+import pytest
+
+from data_handler import DEFAULT_VALUES
+
+
+def record(client, user_id, leave_type='annual_leave', days=1, start='2025-10-01'):
+    return client.post('/api/leave/record', json={
+        'user_id': user_id, 'leave_type': leave_type, 'start_date': start, 'end_date': start, 'days': days
+    })
+
+
+def test_annual_leave_seeds_defaults_then_deducts(client):
+    response = record(client, 'new_user', days=2)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['database_updated'] is True
+    assert body['leave_record']['previous_leave_days'] == DEFAULT_VALUES['leave_days']
+    assert body['leave_record']['remaining_leave_days'] == DEFAULT_VALUES['leave_days'] - 2
+
+    data = client.get('/api/frontend/users/new_user/data').get_json()['data']
+    assert data['leave']['value'] == DEFAULT_VALUES['leave_days'] - 2
+    # 其他欄位也一併寫入預設值
+    assert data['meal']['value'] == DEFAULT_VALUES['meal_allowance']
+
+
+def test_other_leave_types_do_not_deduct(client):
+    client.post('/api/llm/callback', json={'user_id': 'u1', 'extracted_data': {'leave_days': 10}})
+    body = record(client, 'u1', leave_type='sick_leave', days=3).get_json()
+    assert body['database_updated'] is False
+    assert body['leave_record']['remaining_leave_days'] == 10
+    history = client.get('/api/leave/history/u1').get_json()
+    assert [r['leave_type'] for r in history['records']] == ['sick_leave']
+
+
+def test_deduction_never_goes_below_zero(client):
+    client.post('/api/llm/callback', json={'user_id': 'u1', 'extracted_data': {'leave_days': 1}})
+    body = record(client, 'u1', days=3).get_json()
+    assert body['leave_record']['remaining_leave_days'] == 0
+
+
+def test_invalid_dates_and_days_are_rejected(client):
+    client.post('/api/llm/callback', json={'user_id': 'u1', 'extracted_data': {'leave_days': 10}})
+    body = {'user_id': 'u1', 'leave_type': 'annual_leave', 'start_date': '2025-10-01', 'end_date': '2025-10-02',
+            'days': 2}
+    for changes in ({'start_date': 'Jan 5'}, {'end_date': 'yesterday'}, {'start_date': 20251001},
+                    {'start_date': '2025-10-03'}, {'end_date': None}):
+        response = client.post('/api/leave/record', json={**body, **changes})
+        assert response.status_code == 400, changes
+    # Flask 的 JSON 解析接受 NaN / Infinity
+    for days in ('NaN', 'Infinity'):
+        raw = json.dumps(body).replace('"days": 2', f'"days": {days}')
+        response = client.post('/api/leave/record', data=raw, content_type='application/json')
+        assert response.status_code == 400
+        assert response.get_json()['error'] == 'Days must be a number'
+    # 沒有任何請求扣到特休
+    assert client.get('/api/frontend/users/u1/data?type=leave').get_json()['data']['value'] == 10
+
+    assert client.get('/api/leave/history/u1?start=last-week').status_code == 400
+    assert client.get('/api/leave/history/u1?start=2025-10-02&end=2025-10-01').status_code == 400
+    assert record(client, 'u1').status_code == 200
+    history = client.get('/api/leave/history/u1?start=2025-10-01&end=2025-10-01').get_json()
+    assert len(history['records']) == 1
+
+
+def test_handler_validates_leave(handler):
+    with pytest.raises(ValueError):
+        handler.record_leave('u1', 'annual_leave', '2025-10-02', '2025-10-01', 1)
+    with pytest.raises(ValueError):
+        handler.record_leave('u1', 'annual_leave', '2025-10-01', '2025-10-01', float('nan'))
+    with pytest.raises(ValueError):
+        handler.get_leave_history('u1', start_date='Jan 5')
+
+
+def test_concurrent_deductions_are_atomic(handler):
+    handler.ingest_backend_data('u1', {'leave_days': 15})
+    errors = []
+
+    def deduct(index):
+        try:
+            handler.record_leave('u1', 'annual_leave', f'2025-10-{index + 1:02d}', f'2025-10-{index + 1:02d}', 0.5)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=deduct, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert handler.get_user_data('u1', 'leave')['value'] == 5.0
+    records = handler.get_leave_history('u1', limit=50)['records']
+    assert len(records) == 20
+    # 每一筆扣除都看到前一筆的結果，沒有遺失的更新
+    assert sorted(r['remaining_leave_days'] for r in records) == [5.0 + 0.5 * i for i in range(20)]
@@ -0,0 +1,109 @@
+"""Prometheus metrics、SQL 計時與慢請求紀錄"""
+import logging
+import re
+
+from metrics import Histogram, MetricsRegistry, sql_query_name
+
+
+def sample(text, name, **labels):
+    """
+    從 /metrics 的輸出取出某個 series 的值 (label 順序依名稱排序)
+    測試中每次重新 import api_server 都會再註冊一次 collector，取最後一個 (目前的伺服器)
+    """
+    label_text = ','.join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    pattern = re.escape(f'flabba_{name}' + (f'{{{label_text}}}' if labels else '')) + r' (\S+)'
+    matches = re.findall(f'^{pattern}$', text, re.MULTILINE)
+    return float(matches[-1]) if matches else None
+
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    registry.describe('jobs_total', 'Jobs run')
+    registry.inc('jobs_total', {'kind': 'a'})
+    registry.inc('jobs_total', {'kind': 'a'}, amount=2)
+    for seconds in (0.0002, 0.003, 0.003, 2.0):
+        registry.observe('job_seconds', {'kind': 'a'}, seconds)
+    registry.add_collector(lambda: [('queue_depth', 'gauge', 'Queued jobs', {}, 7)])
+
+    text = registry.render()
+    assert '# HELP flabba_jobs_total Jobs run\n# TYPE flabba_jobs_total counter' in text
+    assert sample(text, 'jobs_total', kind='a') == 3
+    # bucket 是累積的
+    assert sample(text, 'job_seconds_bucket', kind='a', le='0.0005') == 1
+    assert sample(text, 'job_seconds_bucket', kind='a', le='0.005') == 3
+    assert sample(text, 'job_seconds_bucket', kind='a', le='+Inf') == 4
+    assert sample(text, 'job_seconds_count', kind='a') == 4
+    assert abs(sample(text, 'job_seconds_sum', kind='a') - 2.0062) < 1e-9
+    assert '# TYPE flabba_queue_depth gauge' in text and sample(text, 'queue_depth') == 7
+
+    summary = registry.histogram_summary('job_seconds', 'kind')['a']
+    assert summary['count'] == 4
+    assert summary['p50_ms'] <= summary['p95_ms'] <= summary['p99_ms']
+
+
+def test_histogram_quantile_interpolates():
+    histogram = Histogram(buckets=(1.0, 2.0, 4.0))
+    assert histogram.quantile(0.5) is None
+    for value in (0.5, 1.5, 1.5, 3.0):
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == 1.5
+    assert histogram.quantile(1.0) == 4.0
+
+
+def test_sql_query_names():
+    assert sql_query_name('SELECT value FROM user_data_current WHERE user_id = ?') == 'select:user_data_current'
+    assert sql_query_name('INSERT INTO user_data_current (a) VALUES (?) ON CONFLICT DO NOTHING') == \
+        'upsert:user_data_current'
+    assert sql_query_name('DELETE FROM user_data WHERE id = ?') == 'delete:user_data'
+    assert sql_query_name('PRAGMA busy_timeout = 5000') == 'pragma:busy_timeout'
+    assert sql_query_name('BEGIN IMMEDIATE') == 'begin'
+
+
+def test_requests_queries_and_caches_are_counted(client):
+    before = client.get('/metrics').data.decode('utf-8')
+    client.post('/api/llm/callback', json={'user_id': 'u1', 'extracted_data': {'leave_days': 12}})
+    response = client.get('/api/frontend/users/u1/data')
+    assert re.fullmatch(r'db;dur=[\d.]+, total;dur=[\d.]+', response.headers['Server-Timing'])
+    client.get('/api/frontend/users/u1/data')
+    client.get('/nope')
+
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    text = response.data.decode('utf-8')
+
+    def delta(name, **labels):
+        return (sample(text, name, **labels) or 0) - (sample(before, name, **labels) or 0)
+
+    route = '/api/frontend/users/<user_id>/data'
+    assert delta('http_requests_total', method='GET', route=route, status='200') == 2
+    assert delta('http_request_duration_seconds_count', method='GET', route=route) == 2
+    assert delta('http_requests_total', method='GET', route='unmatched', status='404') == 1
+    assert delta('db_query_duration_seconds_count', query='select:user_data_current') >= 1
+    assert delta('db_transactions_total', outcome='commit') >= 1
+    assert sample(text, 'db_connections', state='open') >= 1
+    # 第二次查詢由快取提供
+    assert sample(text, 'cache_hits_total', cache='profile') >= 1
+    assert sample(text, 'process_uptime_seconds') > 0
+
+
+def test_health_reports_readiness(client):
+    client.get('/api/frontend/users/u1/data')
+    body = client.get('/health').get_json()
+    assert (body['status'], body['ready']) == ('healthy', True)
+    assert body['checks']['database']['ok'] is True
+    assert body['checks']['db_pool']['pool_size'] >= 1
+    assert body['requests']['/api/frontend/users/<user_id>/data']['count'] >= 1
+
+
+def test_slow_requests_log_the_query_plan(make_server, caplog):
+    client = make_server(SLOW_REQUEST_MS=0).app.test_client()
+    client.post('/api/llm/callback', json={'user_id': 'u1', 'extracted_data': {'leave_days': 12}})
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger='api_server'):
+        client.get('/api/frontend/users/u1/data?type=leave')
+    message = next(record.getMessage() for record in caplog.records if 'Slow request' in record.getMessage())
+    assert 'GET /api/frontend/users/<user_id>/data' in message
+    assert 'select:user_data_current' in message
+    assert 'plan: ' in message
+    # 參數值不會寫進紀錄
+    assert "'u1'" not in message
@@ -0,0 +1,84 @@
+"""依 token 預算組出 grounding context 與候選段落快取"""
+from rag_context import (
+    build_candidates, dedupe_chunks, estimate_tokens, normalize_query, pack_context, truncate_to_tokens
+)
+
+
+def chunk(chunk_id, text, score=1.0, heading='年假制度 > 給假標準'):
+    return {'chunk_id': chunk_id, 'source': '09_annual_leave.md', 'heading': heading, 'score': score, 'text': text}
+
+
+def test_normalize_query():
+    assert normalize_query('  特休幾天？？ ') == normalize_query('特休幾天') == '特休幾天'
+    assert normalize_query('ＡＮＮＵＡＬ  Leave!') == 'annual leave'
+
+
+def test_dedupe_keeps_the_best_copy():
+    chunks = [
+        chunk('a', '到職滿一年享有 7 天特休', 3.0),
+        chunk('a', '到職滿一年享有 7 天特休', 2.5),
+        chunk('b', '到職滿一年享有 7 天特休！', 2.0),
+        chunk('c', '未休完的特休於年底折算工資', 1.0),
+    ]
+    assert [c['chunk_id'] for c in dedupe_chunks(chunks)] == ['a', 'c']
+
+
+def test_pack_respects_the_budget():
+    candidates = build_candidates([
+        chunk('long', '特休' * 200, 3.0),
+        chunk('short', '到職滿一年享有 7 天特休', 2.0),
+        chunk('other', '未休完的特休於年底折算工資', 1.0),
+    ])
+    packed = pack_context(candidates, max_tokens=80)
+    # 放不下的高分段落跳過，繼續放後面較短的段落
+    assert [c['chunk_id'] for c in packed['chunks']] == ['short', 'other']
+    assert estimate_tokens(packed['context']) <= packed['tokens'] <= 80
+    assert packed['truncated'] is False
+
+    # 連一段都放不下時截斷最高分的段落
+    packed = pack_context(candidates[:1], max_tokens=60)
+    assert packed['truncated'] is True
+    assert packed['context'].endswith('…')
+    assert estimate_tokens(packed['context']) <= 60
+
+    profile = '## 使用者資料 (u1)\n- 剩餘特休天數: 10.0 days'
+    packed = pack_context(candidates, max_tokens=80, profile_block=profile)
+    assert packed['context'].startswith(profile)
+    assert packed['tokens'] <= 80
+
+
+def test_truncate_to_tokens():
+    assert truncate_to_tokens('短句', 10) == '短句'
+    text = truncate_to_tokens('特休' * 50, 20)
+    assert text.endswith('…') and estimate_tokens(text) <= 20
+
+
+def test_context_endpoint_caches_candidates(make_server, corpus_dir):
+    server = make_server(RAG_CORPUS_DIR=corpus_dir)
+    client = server.app.test_client()
+    client.post('/api/llm/callback', json={'user_id': 'u1', 'extracted_data': {'leave_days': 10}})
+
+    first = client.post('/api/rag/context', json={'query': '特休幾天？', 'max_tokens': 200}).get_json()
+    assert first['cache'] == 'miss'
+    assert first['chunks'][0]['source'] == '09_annual_leave.md'
+    assert first['tokens'] <= 200
+    assert first['profile_included'] is False
+
+    # 標點與全形不同的同一個問題命中快取；使用者資料每次另外附上
+    second = client.post('/api/rag/context', json={'query': '特休幾天', 'max_tokens': 200, 'user_id': 'u1'}).get_json()
+    assert second['cache'] == 'hit'
+    assert second['normalized_query'] == first['normalized_query']
+    assert second['profile_included'] is True
+    assert '## 使用者資料 (u1)' in second['context']
+    assert server.rag_context_cache.stats()['hits'] == 1
+
+    # 重建索引後語料版本改變，舊的快取不再使用
+    with open(f'{corpus_dir}/09_annual_leave.md', 'a', encoding='utf-8') as f:
+        f.write('\n## 特休請假\n特休需於三天前申請。\n')
+    client.post('/api/rag/reindex')
+    third = client.post('/api/rag/context', json={'query': '特休幾天', 'max_tokens': 200}).get_json()
+    assert third['cache'] == 'miss'
+    assert third['corpus_version'] != first['corpus_version']
+
+    assert client.post('/api/rag/context', json={'query': '？？'}).status_code == 400
+    assert client.post('/api/rag/context', json={'query': '特休', 'max_tokens': 0}).status_code == 400
@@ -0,0 +1,87 @@
+"""依內容 hash 增量重建福利文件索引"""
+import os
+
+import numpy as np
+
+from conftest import CORPUS
+from rag_indexer import read_manifest, reindex
+from rag_service import RagService
+
+
+def chunk_ids(index):
+    return [meta['chunk_id'] for meta in index.chunks]
+
+
+def edit(corpus_dir, name, old, new):
+    path = os.path.join(corpus_dir, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(CORPUS[name].replace(old, new))
+
+
+def test_only_changed_files_are_rebuilt(corpus_dir, tmp_path):
+    index_dir = str(tmp_path / 'index')
+    first = reindex(corpus_dir, index_dir, n_features=256)
+    assert first['report']['rebuilt'] is True
+    assert first['report']['chunks_added'] == first['report']['chunks_total'] == 5
+    before = chunk_ids(first['index'])
+
+    # 沒有變動 (包括只改 mtime) 時沿用目前的索引
+    os.utime(os.path.join(corpus_dir, '01_salary.md'))
+    current = (first['manifest'], first['index'], first['vector_index'])
+    same = reindex(corpus_dir, index_dir, current=current, n_features=256)
+    assert same['report']['rebuilt'] is False
+    assert same['index'] is first['index']
+
+    edit(corpus_dir, '09_annual_leave.md', '折算工資', '發放代金')
+    os.remove(os.path.join(corpus_dir, '02_bonus.md'))
+    second = reindex(corpus_dir, index_dir, current=current, n_features=256)
+    report = second['report']
+    assert (report['files_changed'], report['files_removed']) == (['09_annual_leave.md'], ['02_bonus.md'])
+    assert (report['chunks_kept'], report['chunks_added'], report['chunks_removed']) == (3, 1, 2)
+    assert report['previous_version'] == first['report']['corpus_version'] != report['corpus_version']
+
+    after = chunk_ids(second['index'])
+    # 未變動的 chunk 保留原本的 id
+    assert set(before) & set(after) == {before[0], before[1], before[3]}
+    assert second['index'].search('代金', k=1)[0]['chunk_id'] == after[-1]
+    assert second['index'].search('年終獎金', k=1) == []
+
+    # 沿用的向量列與整份重建的結果相同
+    full = reindex(corpus_dir, str(tmp_path / 'full'), force=True, n_features=256)
+    np.testing.assert_allclose(second['vector_index'].matrix, full['vector_index'].matrix, atol=1e-6)
+
+    manifest = read_manifest(index_dir)
+    assert manifest['corpus_version'] == report['corpus_version']
+    assert [chunk['chunk_id'] for chunk in manifest['files']['09_annual_leave.md']['chunks']] == after[-2:]
+
+
+def test_restart_loads_the_index_from_disk(corpus_dir, tmp_path):
+    index_dir = str(tmp_path / 'index')
+    reindex(corpus_dir, index_dir, n_features=256)
+    # 重新啟動時 manifest 與索引一致，不需要重建
+    reloaded = reindex(corpus_dir, index_dir, n_features=256)
+    assert reloaded['report']['rebuilt'] is False
+    reloaded['index'].close()
+
+
+def test_service_swaps_snapshots(corpus_dir, tmp_path):
+    service = RagService(corpus_dir, str(tmp_path / 'index'), n_features=256)
+    try:
+        old = service.snapshot
+        edit(corpus_dir, '02_bonus.md', '農曆年前', '每年三月')
+        assert service.reindex()['files_changed'] == ['02_bonus.md']
+        new = service.snapshot
+        assert new is not old and new.corpus_version != old.corpus_version
+        # 查詢中的舊快照在替換後仍可使用
+        assert service.search_many(['農曆年'], k=1, snapshot=old)[0][0]['source'] == '02_bonus.md'
+        assert service.search('三月', k=1)[0]['source'] == '02_bonus.md'
+    finally:
+        service.close()
+
+
+def test_reindex_endpoint(make_server, corpus_dir):
+    client = make_server(RAG_CORPUS_DIR=corpus_dir).app.test_client()
+    assert client.post('/api/rag/reindex').get_json()['report']['chunks_total'] == 5
+    assert client.post('/api/rag/reindex').get_json()['report']['rebuilt'] is False
+    report = client.post('/api/rag/reindex', json={'force': True}).get_json()['report']
+    assert (report['rebuilt'], report['chunks_kept']) == (True, 0)
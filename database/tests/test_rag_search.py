@@ -0,0 +1,54 @@
+"""福利文件的切塊、斷詞與 BM25 索引"""
+import os
+
+from conftest import CORPUS
+from rag_search import BM25Index, chunk_markdown, load_corpus, naive_search, tokenize
+
+QUERIES = ['特休幾天', 'annual leave', '年終獎金什麼時候發', '加班費 1.34', '不存在的詞']
+
+
+def test_tokenize_mixes_cjk_bigrams_and_words():
+    assert tokenize('特休 Annual-Leave 7天') == ['特休', 'annual', 'leave', '7', '天']
+    assert tokenize('年終獎金') == ['年終', '終獎', '獎金']
+
+
+def test_chunks_follow_headings_and_keep_ids():
+    chunks = chunk_markdown(CORPUS['09_annual_leave.md'], '09_annual_leave.md')
+    assert [chunk['heading'] for chunk in chunks] == ['年假制度 > 給假標準', '年假制度 > 未休處理']
+    assert all(chunk['chunk_id'].startswith('09_annual_leave:') for chunk in chunks)
+    # 內容不變 id 就不變；改了其中一段只影響那一段
+    edited = chunk_markdown(CORPUS['09_annual_leave.md'].replace('折算工資', '發放代金'), '09_annual_leave.md')
+    assert edited[0]['chunk_id'] == chunks[0]['chunk_id']
+    assert edited[1]['chunk_id'] != chunks[1]['chunk_id']
+
+
+def test_saved_index_matches_naive_scan(corpus_dir, tmp_path):
+    chunks = load_corpus(corpus_dir)
+    path = str(tmp_path / 'bm25.idx')
+    BM25Index.build(chunks, corpus_version='v1').save(path)
+    index = BM25Index.load(path)
+    try:
+        assert (index.n_docs, index.corpus_version) == (len(chunks), 'v1')
+        for query in QUERIES:
+            expected = naive_search(chunks, query, k=3)
+            assert [(r['chunk_id'], r['score']) for r in index.search(query, k=3, with_text=False)] == \
+                [(r['chunk_id'], r['score']) for r in expected]
+        best = index.search('特休幾天', k=1)[0]
+        assert best['source'] == '09_annual_leave.md'
+        assert '特休' in best['text']
+    finally:
+        index.close()
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def test_search_endpoint(make_server, corpus_dir):
+    client = make_server(RAG_CORPUS_DIR=corpus_dir).app.test_client()
+    body = client.get('/api/rag/search', query_string={'q': '年終獎金', 'k': 2}).get_json()
+    assert body['success'] is True
+    assert body['results'][0]['heading'] == '獎金制度 > 年終獎金'
+    assert len(body['results']) <= 2
+    assert body['corpus_version']
+
+    assert client.get('/api/rag/search').status_code == 400
+    assert client.get('/api/rag/search?q=bonus&k=0').status_code == 400
+    assert client.get('/api/rag/search?q=bonus&mode=nope').status_code == 400
@@ -0,0 +1,63 @@
+"""hashing TF-IDF 向量檢索、批次查詢與 hybrid 分數"""
+import numpy as np
+
+from rag_search import load_corpus
+from rag_service import RagService
+from rag_vector import VectorIndex, hybrid_scores, top_k
+
+
+def test_saved_vectors_are_memory_mapped(corpus_dir, tmp_path):
+    chunks = load_corpus(corpus_dir)
+    built = VectorIndex.build(chunks, n_features=256, corpus_version='v1')
+    built.save(str(tmp_path))
+    loaded = VectorIndex.load(str(tmp_path))
+    assert isinstance(loaded.matrix, np.memmap)
+    assert loaded.matrix.dtype == np.float32 and loaded.matrix.flags['C_CONTIGUOUS']
+    assert loaded.chunk_ids == [chunk['chunk_id'] for chunk in chunks]
+    np.testing.assert_allclose(np.linalg.norm(loaded.matrix, axis=1), 1, rtol=1e-5)
+
+    scores = loaded.similarities(['特休 天數', '年終獎金'])
+    assert scores.shape == (2, len(chunks))
+    np.testing.assert_allclose(scores, built.similarities(['特休 天數', '年終獎金']), rtol=1e-5)
+
+
+def test_top_k_matches_full_sort():
+    scores = np.random.default_rng(0).random((4, 50)).astype(np.float32)
+    expected = np.argsort(-scores, axis=1, kind='stable')[:, :5]
+    assert top_k(scores, 5).tolist() == expected.tolist()
+    assert top_k(scores, 80).shape == (4, 50)
+    assert top_k(scores, 0).shape == (4, 0)
+
+
+def test_hybrid_scores_scale_keywords():
+    vector = np.array([[0.2, 0.4, 0.0]], dtype=np.float32)
+    keyword = np.array([[6.0, 0.0, 3.0]], dtype=np.float32)
+    np.testing.assert_allclose(hybrid_scores(vector, keyword, alpha=1), vector)
+    np.testing.assert_allclose(hybrid_scores(vector, keyword, alpha=0), [[1.0, 0.0, 0.5]])
+    # 沒有關鍵字命中的查詢不會除以零
+    np.testing.assert_allclose(hybrid_scores(vector, np.zeros_like(keyword), alpha=0.5), vector * 0.5)
+
+
+def test_batched_search_matches_single_queries(corpus_dir, tmp_path):
+    service = RagService(corpus_dir, str(tmp_path / 'index'), n_features=512)
+    try:
+        queries = ['特休幾天', '年終獎金', 'salary 發薪日']
+        for mode in ('vector', 'hybrid'):
+            batched = service.search_many(queries, k=2, mode=mode)
+            assert batched == [service.search(query, k=2, mode=mode) for query in queries]
+            assert [hits[0]['source'] for hits in batched] == ['09_annual_leave.md', '02_bonus.md', '01_salary.md']
+        assert service.search('完全無關 xyz', k=3, mode='vector') == []
+    finally:
+        service.close()
+
+
+def test_batch_endpoint(make_server, corpus_dir):
+    client = make_server(RAG_CORPUS_DIR=corpus_dir).app.test_client()
+    body = client.post('/api/rag/search/batch', json={
+        'queries': ['年終獎金', '加班費'], 'k': 1, 'mode': 'hybrid', 'alpha': 0.3
+    }).get_json()
+    assert [item['results'][0]['heading'] for item in body['results']] == ['獎金制度 > 年終獎金', '薪資制度 > 加班費']
+
+    assert client.post('/api/rag/search/batch', json={'queries': []}).status_code == 400
+    assert client.post('/api/rag/search/batch', json={'queries': ['a', '']}).status_code == 400
+    assert client.post('/api/rag/search/batch', json={'queries': ['a'], 'alpha': 2}).status_code == 400
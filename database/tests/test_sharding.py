@@ -0,0 +1,137 @@
+"""調整分片數與分片下的匯出 cursor"""
+import json
+
+import pytest
+
+from conftest import lock_database
+from data_handler import UserDataHandler, encode_export_cursor
+from sharding import ShardedUserDataHandler, ShardLayoutError, rebalance, shard_index, shard_paths
+
+USERS = [f'u{i:03d}' for i in range(40)]
+
+
+def seed(handler):
+    handler.ingest_backend_batch([
+        {'user_id': user_id, 'extracted_data': {'leave_days': i % 15, 'salary': 1000 * i}}
+        for i, user_id in enumerate(USERS)
+    ])
+    handler.record_leave('u001', 'annual_leave', '2025-10-01', '2025-10-02', 2)
+
+
+def test_rebalance_keeps_every_row(tmp_path, company_db):
+    db_path = str(tmp_path / 'user_data.db')
+    single = UserDataHandler(db_path)
+    single.sync_staff(company_db)
+    seed(single)
+    before = {user_id: single.get_user_data(user_id) for user_id in USERS}
+    history = single.get_leave_history('u001')['records']
+    single.close()
+
+    report = rebalance(shard_paths(db_path, 1), shard_paths(db_path, 3))
+    assert report['staff'] == 4
+    sharded = ShardedUserDataHandler(db_path, shards=3)
+    try:
+        for user_id in USERS:
+            # 每位使用者只存在所屬的分片
+            owners = [i for i, shard in enumerate(sharded.shards) if shard.get_user_data(user_id)]
+            assert owners == [shard_index(user_id, 3)]
+            assert sharded.get_user_data(user_id) == before[user_id]
+        assert sharded.get_leave_history('u001')['records'] == history
+        assert sharded.rebuild_aggregates(verify_only=True)['mismatches'] == 0
+    finally:
+        sharded.close()
+
+    # 目標檔案已有資料時拒絕覆寫
+    with pytest.raises(ShardLayoutError):
+        rebalance(shard_paths(db_path, 1), shard_paths(db_path, 3))
+
+
+def test_batch_with_a_failing_shard(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'user_data.db')
+    sharded = ShardedUserDataHandler(db_path, shards=3, busy_timeout=50)
+    try:
+        items = [{'user_id': user_id, 'extracted_data': {'leave_days': 5}} for user_id in USERS[:12]]
+        locked = shard_index(USERS[0], 3)
+        broken = next(i for i in range(3) if i != locked)
+
+        def shard_is_down(*args):
+            raise RuntimeError('shard is down')
+
+        monkeypatch.setattr(sharded.shards[broken], 'ingest_backend_batch', shard_is_down)
+        with lock_database(sharded.shards[locked].db_path):
+            results = sharded.ingest_backend_batch(items)
+
+        assert [r['index'] for r in results] == list(range(12))
+        assert [r['user_id'] for r in results] == USERS[:12]
+        for result in results:
+            owner = shard_index(result['user_id'], 3)
+            # 被鎖住或失敗的分片回報可重試的錯誤，其他分片照常寫入
+            assert result['success'] is (owner not in (locked, broken))
+            if owner == broken:
+                assert (result['error'], result['retryable']) == ('shard is down', True)
+            elif owner == locked:
+                assert result['retryable'] is True
+    finally:
+        sharded.close()
+
+
+def test_shard_count_mismatch_is_rejected(tmp_path):
+    db_path = str(tmp_path / 'user_data.db')
+    ShardedUserDataHandler(db_path, shards=2).close()
+    with pytest.raises(ShardLayoutError):
+        ShardedUserDataHandler(db_path, shards=3)
+
+
+def test_sharded_export_cursor_resumes(tmp_path):
+    sharded = ShardedUserDataHandler(str(tmp_path / 'user_data.db'), shards=3)
+    try:
+        seed(sharded)
+        full = list(sharded.iter_export())
+        ids = [row['id'] for row in full]
+        assert len(ids) == len(set(ids)) == len(USERS) * 5
+        keys = [(row['updated_at'], row['id']) for row in full]
+        assert keys == sorted(keys)
+
+        for stop in (1, 17, 101, len(full) - 1):
+            last = full[stop - 1]
+            rest = list(sharded.iter_export(cursor=encode_export_cursor(last['updated_at'], last['id'])))
+            assert [row['id'] for row in rest] == ids[stop:]
+    finally:
+        sharded.close()
+
+
+def test_export_endpoint_with_shards(make_server):
+    server = make_server(DB_SHARDS=3)
+    client = server.app.test_client()
+    seed(server.db_handler)
+    response = client.get('/api/export/user_data?limit=50')
+    first = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+    response = client.get('/api/export/user_data', query_string={'cursor': first[-1]['cursor']})
+    rest = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+    rows = first + rest
+    assert len(rows) == len({row['id'] for row in rows}) == len(USERS) * 5
+    assert client.get('/health').get_json()['checks']['db_pool']['shards'] == 3
+
+
+def test_write_behind_with_shards(make_server):
+    server = make_server(DB_SHARDS=2, WRITE_BEHIND=1, WRITE_BEHIND_INTERVAL_MS=60000)
+    client = server.app.test_client()
+    for user_id in USERS[:10]:
+        response = client.post('/api/llm/callback', json={'user_id': user_id, 'extracted_data': {'leave_days': 7}})
+        assert response.status_code == 202
+    # 尚未寫入時也讀得到佇列中的值
+    assert client.get('/api/frontend/users/u003/data').get_json()['data']['leave']['value'] == 7
+
+    assert server.write_queue.flush()['users'] == 10
+    assert server.write_queue.stats()['last_flush']['at']
+    for user_id in USERS[:10]:
+        shard = server.db_handler.shard_for(user_id)
+        assert shard.get_user_data(user_id, 'leave')['value'] == 7.0
+
+    # 扣除特休前先寫入佇列，結果與直接寫入相同
+    client.post('/api/llm/callback', json={'user_id': 'u001', 'extracted_data': {'leave_days': 9}})
+    body = client.post('/api/leave/record', json={
+        'user_id': 'u001', 'leave_type': 'annual_leave', 'start_date': '2025-10-01', 'end_date': '2025-10-01',
+        'days': 1
+    }).get_json()
+    assert body['leave_record']['remaining_leave_days'] == 8
@@ -0,0 +1,30 @@
+"""背景員工資料匯入在來源檔案不存在時的行為"""
+import logging
+import os
+import time
+
+from conftest import create_company_db
+from data_handler import StaffSync
+
+
+def test_missing_source_warns_once_then_imports(handler, tmp_path, caplog):
+    source = str(tmp_path / 'company.db')
+    logger = logging.getLogger('test_staff_sync')
+    staff_sync = StaffSync(handler, source, interval=0.01, logger=logger)
+    with caplog.at_level(logging.WARNING, logger='test_staff_sync'):
+        staff_sync.start()
+        try:
+            time.sleep(0.1)
+            # 建立完成後才放到來源路徑，避免讀到建立到一半的檔案
+            os.replace(create_company_db(str(tmp_path / 'building.db')), source)
+            deadline = time.monotonic() + 5
+            while staff_sync.last_report is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            staff_sync.stop()
+
+    assert [(record.levelname, record.getMessage().split(':')[0]) for record in caplog.records] == [
+        ('WARNING', 'Staff sync skipped')
+    ]
+    assert staff_sync.last_report['staff'] == 4
+    assert staff_sync.last_error is None
@@ -0,0 +1,75 @@
+"""單一欄位查詢的回傳欄位與 write-behind 待寫資料"""
+from data_handler import USER_DATA_COLUMNS
+
+
+def test_single_field_returns_public_columns_only(handler):
+    handler.ingest_backend_data('u1', {'leave_days': 12, 'next_bonus_date': '2025/12/15'})
+    leave = handler.get_user_data('u1', 'leave')
+    assert tuple(leave) == USER_DATA_COLUMNS
+    assert leave['value'] == 12.0
+    # 日期欄位的 value 是字串，型別欄位不對外回傳
+    bonus = handler.get_user_data('u1', 'bonus')
+    assert tuple(bonus) == USER_DATA_COLUMNS
+    assert bonus['value'] == '2025-12-15'
+    assert handler.get_user_data('u1', 'nope') == {}
+
+
+def test_pending_writes_keep_the_same_columns(handler, tmp_path):
+    from write_behind import WriteBehindQueue
+    handler.ingest_backend_data('u1', {'leave_days': 12})
+    stored = handler.get_user_data('u1', 'leave')
+    queue = WriteBehindQueue(handler, journal_dir=str(tmp_path / 'journal'), flush_interval=3600)
+    try:
+        queue.submit('u1', {'leave_days': 10})
+        queue.submit('u2', {'salary': 30000})
+        leave = handler.get_user_data('u1', 'leave')
+        assert tuple(leave) == USER_DATA_COLUMNS
+        assert (leave['id'], leave['created_at']) == (stored['id'], stored['created_at'])
+        assert leave['value'] == 10.0
+        assert leave['updated_at'] == queue.pending('u1')['queued_at']
+
+        # 還沒寫入過的使用者：id 為 None，created_at 是送進佇列的時間
+        salary = handler.get_user_data('u2', 'salary')
+        assert tuple(salary) == USER_DATA_COLUMNS
+        assert salary['id'] is None
+        assert salary['created_at'] == salary['updated_at']
+        assert salary['value'] == 30000.0
+    finally:
+        queue.close()
+    assert tuple(handler.get_user_data('u2', 'salary')) == USER_DATA_COLUMNS
+
+
+def test_upcoming_dates(server, client):
+    server.db_handler.sync_staff(server.STAFF_DB_PATH)
+    client.post('/api/llm/callback/batch', json={'items': [
+        {'user_id': 'user001', 'extracted_data': {'next_bonus_date': '2025/12/15'}},
+        {'user_id': 'EMP002', 'extracted_data': {'next_bonus_date': 20251201}},
+        {'user_id': 'EMP003', 'extracted_data': {'next_bonus_date': '2025-12-31T09:00:00'}},
+        {'user_id': 'EMP005', 'extracted_data': {'next_bonus_date': '2026-01-01'}},
+        {'user_id': 'u9', 'extracted_data': {'salary': 30000}},
+    ]})
+
+    body = client.get('/api/users/upcoming?data_type=bonus&from=2025-12-01&within_days=30').get_json()
+    assert (body['from'], body['to'], body['count'], body['truncated']) == ('2025-12-01', '2025-12-31', 3, False)
+    # 不同格式寫入的日期都正規化成 YYYY-MM-DD，範圍包含兩端
+    assert [(user['user_id'], user['date']) for user in body['users']] == [
+        ('EMP002', '2025-12-01'), ('user001', '2025-12-15'), ('EMP003', '2025-12-31')
+    ]
+    assert (body['users'][1]['full_name'], body['users'][1]['dept_name']) == ('John Doe', 'Engineering')
+
+    body = client.get('/api/users/upcoming?from=2025-12-01&within_days=31&limit=2').get_json()
+    assert [user['user_id'] for user in body['users']] == ['EMP002', 'user001']
+    assert (body['count'], body['truncated']) == (2, True)
+
+    for query in ('data_type=salary', 'within_days=-1', 'within_days=367', 'limit=0', 'from=tomorrow'):
+        assert client.get(f'/api/users/upcoming?{query}').status_code == 400, query
+
+
+def test_upcoming_uses_the_date_index(handler):
+    plan = handler.explain('''
+        SELECT user_id FROM user_data_current
+         WHERE data_type = ? AND value_date IS NOT NULL AND value_date BETWEEN ? AND ?
+         ORDER BY value_date, user_id
+    ''', ('bonus', '2025-12-01', '2025-12-31'))
+    assert any('idx_current_type_date' in detail for detail in plan)
+    assert not any('TEMP B-TREE' in detail for detail in plan)
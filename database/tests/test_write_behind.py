@@ -0,0 +1,183 @@
+"""write-behind 佇列的逐筆結果、dead letter 與重播"""
+import glob
+import json
+import os
+
+import pytest
+
+from conftest import lock_database
+from data_handler import UserDataHandler
+from write_behind import WriteBehindQueue
+
+
+class FlakyHandler(UserDataHandler):
+    """指定的使用者前 failures[user_id] 次寫入失敗"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failures = {}
+        self.calls = []
+
+    def ingest_backend_data(self, user_id, backend_response, as_of=None):
+        self.calls.append(user_id)
+        if self.failures.get(user_id, 0) > 0:
+            self.failures[user_id] -= 1
+            raise RuntimeError(f'cannot write {user_id}')
+        return super().ingest_backend_data(user_id, backend_response, as_of=as_of)
+
+
+@pytest.fixture
+def flaky(tmp_path):
+    handler = FlakyHandler(str(tmp_path / 'user_data.db'))
+    yield handler
+    handler.close()
+
+
+def make_queue(handler, tmp_path, **options):
+    return WriteBehindQueue(handler, journal_dir=str(tmp_path / 'journal'), flush_interval=3600, **options)
+
+
+def journal_records(tmp_path):
+    records = []
+    for path in glob.glob(str(tmp_path / 'journal' / '*.journal')):
+        with open(path, encoding='utf-8') as handle:
+            records.extend(json.loads(line) for line in handle)
+    return records
+
+
+def test_failed_user_does_not_block_the_rest(flaky, tmp_path):
+    queue = make_queue(flaky, tmp_path, max_attempts=2)
+    try:
+        flaky.failures['bad'] = 10
+        queue.submit('good', {'leave_days': 12})
+        queue.submit('bad', {'leave_days': 3})
+
+        assert queue.flush() == {'users': 1, 'rows': 1, 'failed': 1, 'dead_lettered': 0}
+        assert flaky.get_user_data('good', 'leave')['value'] == 12.0
+        # 只有失敗的使用者留在佇列與 journal
+        assert [record['user_id'] for record in journal_records(tmp_path)] == ['bad']
+        assert journal_records(tmp_path)[0]['attempts'] == 1
+        assert queue.pending('good') is None
+
+        flaky.calls.clear()
+        assert queue.flush() == {'users': 0, 'rows': 0, 'failed': 1, 'dead_lettered': 1}
+        assert flaky.calls == ['bad']
+        assert queue.pending('bad') is None
+        assert journal_records(tmp_path) == []
+
+        with open(queue.dead_letter_path, encoding='utf-8') as handle:
+            dead, = [json.loads(line) for line in handle]
+        assert (dead['user_id'], dead['fields'], dead['attempts']) == ('bad', {'leave_days': 3}, 2)
+        assert dead['error'] == 'cannot write bad'
+
+        stats = queue.stats()
+        assert (stats['flushed_users'], stats['item_failures'], stats['retried'], stats['dead_lettered']) == (1, 2, 1, 1)
+        assert stats['consecutive_failures'] == 0
+    finally:
+        queue.close()
+
+
+def test_locked_database_keeps_the_queue(tmp_path):
+    db_path = str(tmp_path / 'user_data.db')
+    handler = UserDataHandler(db_path, busy_timeout=50)
+    queue = make_queue(handler, tmp_path)
+    try:
+        queue.submit('u1', {'leave_days': 12})
+        queue.submit('u2', {'salary': 30000})
+        with lock_database(db_path):
+            assert queue.flush() == {'users': 0, 'rows': 0, 'failed': 2, 'dead_lettered': 0}
+        # 沒有寫入的資料仍在佇列與 journal 中，也不計入嘗試次數
+        records = journal_records(tmp_path)
+        assert sorted((record['user_id'], record['attempts']) for record in records) == [('u1', 0), ('u2', 0)]
+        stats = queue.stats()
+        assert (stats['consecutive_failures'], stats['item_failures']) == (1, 0)
+
+        assert queue.flush() == {'users': 2, 'rows': 2, 'failed': 0, 'dead_lettered': 0}
+        assert handler.get_user_data('u1', 'leave')['value'] == 12.0
+        assert journal_records(tmp_path) == []
+        assert queue.stats()['consecutive_failures'] == 0
+    finally:
+        queue.close()
+        handler.close()
+
+
+def test_missing_results_are_not_discarded(flaky, tmp_path):
+    queue = make_queue(flaky, tmp_path)
+    original = flaky.ingest_backend_batch
+    try:
+        # 只回報第一位使用者的結果
+        flaky.ingest_backend_batch = lambda items, chunk_size=500: original(items[:1], chunk_size)
+        queue.submit('u1', {'leave_days': 12})
+        queue.submit('u2', {'leave_days': 3})
+        assert queue.flush()['failed'] == 1
+        assert [record['user_id'] for record in journal_records(tmp_path)] == ['u2']
+        del flaky.ingest_backend_batch
+        assert queue.flush()['users'] == 1
+        assert flaky.get_user_data('u2', 'leave')['value'] == 3.0
+    finally:
+        queue.close()
+
+
+def test_retry_succeeds_with_newer_values(flaky, tmp_path):
+    queue = make_queue(flaky, tmp_path)
+    try:
+        flaky.failures['u1'] = 1
+        queue.submit('u1', {'leave_days': 12, 'salary': 30000})
+        assert queue.flush()['failed'] == 1
+        queue.submit('u1', {'leave_days': 10})
+        assert queue.pending('u1')['fields'] == {'leave_days': 10, 'salary': 30000}
+
+        assert queue.flush() == {'users': 1, 'rows': 2, 'failed': 0, 'dead_lettered': 0}
+        data = flaky.get_user_data('u1')
+        assert (data['leave']['value'], data['salary']['value']) == (10.0, 30000.0)
+    finally:
+        queue.close()
+    assert not os.path.exists(queue.dead_letter_path)
+
+
+def test_retry_does_not_overwrite_a_later_deduction(flaky, tmp_path):
+    queue = make_queue(flaky, tmp_path)
+    try:
+        flaky.failures['u1'] = 1
+        queue.submit('u1', {'leave_days': 12})
+        queue.flush()
+        # 重試之前扣除特休：佇列中的 12 比扣除後的值舊，不應該覆蓋
+        flaky.ingest_backend_data('u1', {'leave_days': 12})
+        flaky.record_leave('u1', 'annual_leave', '2025-10-01', '2025-10-01', 2)
+        queue.flush()
+        assert flaky.get_user_data('u1', 'leave')['value'] == 10.0
+    finally:
+        queue.close()
+
+
+def test_replaying_a_committed_journal_keeps_later_writes(handler, tmp_path):
+    # 模擬 commit 之後、刪除段落之前程序就結束：journal 中還留著已寫入的舊值
+    queue = make_queue(handler, tmp_path)
+    queue.submit('u1', {'leave_days': 12, 'meal_allowance': 100})
+    line = journal_records(tmp_path)[0]
+    queue.close()
+    handler.record_leave('u1', 'annual_leave', '2025-10-01', '2025-10-01', 2)
+    with open(tmp_path / 'journal' / 'wb-0-000001.journal', 'w', encoding='utf-8') as handle:
+        handle.write(json.dumps(line) + '\n')
+
+    queue = make_queue(handler, tmp_path)
+    try:
+        assert queue.stats()['recovered'] == 1
+        data = handler.get_user_data('u1')
+        assert data['leave']['value'] == 10.0
+        assert data['meal']['value'] == 100.0
+        assert journal_records(tmp_path) == []
+    finally:
+        queue.close()
+
+
+def test_as_of_is_checked_per_field(handler):
+    handler.ingest_backend_data('u1', {'leave_days': 12, 'salary': 30000})
+    as_of = handler.get_user_data('u1', 'leave')['updated_at']
+    handler.record_leave('u1', 'annual_leave', '2025-10-01', '2025-10-01', 2)
+    result = handler.ingest_backend_data('u1', {'leave_days': 12, 'salary': 35000}, as_of=as_of)
+    assert result['changed_fields'] == ['salary']
+    assert handler.get_user_data('u1', 'leave')['value'] == 10.0
+
+    results = handler.ingest_backend_batch([{'user_id': 'u1', 'extracted_data': {}, 'as_of': 5}])
+    assert results[0]['error'] == 'as_of must be a timestamp string'
@@ -0,0 +1,74 @@
+"""單一 writer process 的 IPC 往返"""
+import threading
+
+import pytest
+
+from db_writer import RemoteWriteHandler, WriterProcess
+
+
+@pytest.fixture
+def writer(tmp_path, monkeypatch):
+    # start() 會設定環境變數，測試結束後還原
+    monkeypatch.setenv('DB_WRITER_ADDRESS', '')
+    monkeypatch.setenv('DB_WRITER_AUTHKEY', '')
+    process = WriterProcess(str(tmp_path / 'user_data.db'), batch_wait=0.001).start()
+    yield process
+    process.stop()
+
+
+@pytest.fixture
+def remote(writer, tmp_path):
+    handler = RemoteWriteHandler(writer.address, writer.authkey, timeout=10, db_path=str(tmp_path / 'user_data.db'))
+    yield handler
+    handler.close()
+
+
+def test_writes_round_trip_through_the_writer(remote, writer):
+    result = remote.ingest_backend_data('u1', {'leave_days': 12})
+    assert result['seeded'] is True
+    assert 'leave' in result['changed_fields']
+    assert result['current_data']['leave']['value'] == 12.0
+    # worker 直接從 SQLite 讀到 writer commit 的資料
+    assert remote.get_user_data('u1', 'leave')['value'] == 12.0
+
+    leave = remote.record_leave('u1', 'annual_leave', '2025-10-01', '2025-10-01', 2)
+    assert leave['remaining_leave_days'] == 10.0
+
+    results = remote.ingest_backend_batch([
+        {'user_id': 'u2', 'extracted_data': {'salary': 40000}},
+        {'user_id': '', 'extracted_data': {}},
+    ])
+    assert [r['success'] for r in results] == [True, False]
+
+    status = remote.writer_status()
+    assert status['pid'] == writer._process.pid
+    assert status['connections'] >= 1
+
+
+def test_value_errors_cross_the_process_boundary(remote):
+    with pytest.raises(ValueError):
+        remote.ingest_backend_data('u1', {'next_bonus_date': 'someday'})
+    # 失敗的呼叫不影響之後的寫入
+    assert remote.ingest_backend_data('u1', {'leave_days': 3})['current_data']['leave']['value'] == 3.0
+
+
+def test_commits_are_broadcast_to_listeners(remote, writer, tmp_path):
+    other = RemoteWriteHandler(writer.address, writer.authkey, timeout=10, db_path=str(tmp_path / 'user_data.db'))
+    received = threading.Event()
+    events = []
+
+    def on_change(user_id, changes):
+        events.append((user_id, [change['data_type'] for change in changes]))
+        received.set()
+
+    other.add_change_listener(on_change)
+    try:
+        # 連上 writer 之後才會收到廣播
+        other.writer_status()
+        remote.ingest_backend_data('u1', {'leave_days': 12, 'salary': 30000})
+        # 另一個 worker 的寫入也會通知這個 worker 的 listener
+        assert received.wait(5)
+        assert events[0][0] == 'u1'
+        assert set(events[0][1]) >= {'leave', 'salary'}
+    finally:
+        other.close()
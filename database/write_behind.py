@@ -0,0 +1,412 @@
+"""
+LLM 回調的 write-behind 佇列：驗證並寫入 journal 後立即回應，背景合併更新再批次寫入 SQLite
+
+    queue = WriteBehindQueue(db_handler, journal_dir='write_behind_journal')
+    queue.submit('user_123', {'leave_days': 12})   # 已寫入 journal，尚未寫入資料庫
+    queue.flush()                                  # 立即寫入 (例如扣除特休之前)
+    queue.close()                                  # 停止接收並寫完所有待寫資料
+
+- 同一 (user_id, 欄位) 只保留最後一個值
+- 待寫欄位數達 max_batch，或最舊的一筆已等待 flush_interval 秒時，以一個交易寫入
+- 每位使用者的資料各自寫入 (單筆失敗不影響其他人)；失敗的資料放回佇列重試，
+  連續失敗 max_attempts 次後移到 journal 目錄的 dead_letter.jsonl，不再重試
+- journal 以段落檔 (JSON Lines) 保存；flush 後重試的資料重新寫入目前的段落，再刪除已封存的段落。
+  程序異常結束時，下次啟動會重播還留著的段落
+- 寫入時帶上送進佇列的時間 (as_of)：資料庫中比它新的欄位 (例如之後扣除的特休) 不會被覆蓋，
+  所以重試、或重播已 commit 但尚未刪除的段落，都不會蓋掉之後的寫入
+- 掛在 UserDataHandler 的 pending reader 上，get_user_data / get_users_data 會看到尚未寫入的值
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from data_handler import DATA_MAPPING, DATE_UNIT, UserDataHandler, normalize_date, now_timestamp
+from metrics import registry
+
+try:
+    import fcntl
+except ImportError:  # Windows：沒有 flock，假設只有一個程序使用同一個 journal 目錄
+    fcntl = None
+
+JOURNAL_SUFFIX = '.journal'
+DEAD_LETTER_FILE = 'dead_letter.jsonl'
+VALUE_TYPES = (str, int, float, bool)
+
+
+def _try_lock(handle) -> bool:
+    """以非阻塞的 flock 鎖住 journal 檔；其他還活著的程序持有的檔案會鎖定失敗"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def validate_update(user_id: Any, extracted_data: Any) -> Dict[str, Any]:
+    """檢查回調內容，回傳會寫入的欄位 (未知欄位與 None 略過，與 ingest_backend_data 相同)"""
+    if not isinstance(user_id, str) or not user_id:
+        raise ValueError('user_id is required')
+    if not isinstance(extracted_data, dict):
+        raise ValueError('extracted_data must be an object')
+    fields = {}
+    for key, value in extracted_data.items():
+        if key not in DATA_MAPPING or value is None:
+            continue
+        if not isinstance(value, VALUE_TYPES):
+            raise ValueError(f'{key} must be a string or number')
+        # 日期格式錯誤要在回應前發現，否則每次 flush 都會失敗
+        if DATA_MAPPING[key][1] == DATE_UNIT:
+            value = normalize_date(value)
+        fields[key] = value
+    return fields
+
+
+class WriteBehindQueue:
+    """
+    handler 只需要 ingest_backend_batch 與 set_pending_reader，
+    UserDataHandler、RemoteWriteHandler 與 ShardedUserDataHandler 都可以使用
+    """
+
+    def __init__(self, handler: UserDataHandler, journal_dir: str = 'write_behind_journal',
+                 max_batch: int = 500, flush_interval: float = 1.0, fsync: bool = False,
+                 max_attempts: int = 5, logger: Optional[logging.Logger] = None):
+        self.handler = handler
+        self.journal_dir = journal_dir
+        self.dead_letter_path = os.path.join(journal_dir, DEAD_LETTER_FILE)
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        # fsync=False 時只保證程序當掉不遺失；True 時連斷電也不遺失，但每次 submit 多一次磁碟同步
+        self.fsync = fsync
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        # user_id -> {'fields': {欄位: 值}, 'queued_at': 最後一次送入的時間, 'attempts': 已失敗的次數}
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._pending_rows = 0
+        self._oldest: Optional[float] = None
+        # 正在寫入的那一批；commit 完成前讀取也要看得到
+        self._flushing: Dict[str, Dict[str, Any]] = {}
+        # 已封存、等這批資料 commit 後刪除的 journal 段落
+        self._sealed: List[Tuple[Any, str]] = []
+        self._journal = None
+        self._journal_path = None
+        self._segment = 0
+        self._closed = False
+        self._counters = {
+            'submitted': 0, 'coalesced': 0, 'flushes': 0, 'flushed_users': 0,
+            'flushed_rows': 0, 'failures': 0, 'consecutive_failures': 0, 'recovered': 0,
+            'item_failures': 0, 'retried': 0, 'dead_lettered': 0
+        }
+        self.last_flush: Optional[Dict[str, Any]] = None
+
+        os.makedirs(journal_dir, exist_ok=True)
+        self._recover()
+        self._open_segment()
+        handler.set_pending_reader(self.pending)
+        if self._pending:
+            try:
+                self.flush('recovery')
+            except Exception as e:
+                self.logger.error(f"Write-behind recovery flush failed, will retry: {e}")
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    # === journal ===
+    def _open_segment(self) -> None:
+        self._segment += 1
+        path = os.path.join(self.journal_dir, f'wb-{os.getpid()}-{self._segment:06d}{JOURNAL_SUFFIX}')
+        handle = open(path, 'a', encoding='utf-8')
+        _try_lock(handle)
+        self._journal, self._journal_path = handle, path
+
+    def _recover(self) -> None:
+        """把前一次執行 (或已結束的其他 worker) 留下的 journal 段落放回佇列"""
+        paths = sorted(glob.glob(os.path.join(self.journal_dir, f'*{JOURNAL_SUFFIX}')), key=os.path.getmtime)
+        for path in paths:
+            handle = open(path, 'r+', encoding='utf-8')
+            if not _try_lock(handle):
+                handle.close()
+                continue
+            entries = 0
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 寫到一半就中斷的最後一行
+                    continue
+                self._merge(record['user_id'], record['fields'], record['queued_at'], record.get('attempts', 0))
+                entries += 1
+            if entries:
+                self._sealed.append((handle, path))
+                self._counters['recovered'] += entries
+                self.logger.info(f"Write-behind: recovered {entries} queued updates from {path}")
+            else:
+                handle.close()
+                os.remove(path)
+
+    def _append_journal(self, record: Dict[str, Any]) -> None:
+        """寫入目前的 journal 段落 (呼叫者持有 lock)"""
+        self._journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _dead_letter(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        failed_at = now_timestamp()
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as handle:
+            for user_id, entry in entries.items():
+                handle.write(json.dumps({'user_id': user_id, **entry, 'failed_at': failed_at}, ensure_ascii=False) + '\n')
+            handle.flush()
+            os.fsync(handle.fileno())
+        for user_id, entry in entries.items():
+            self.logger.error(f"Write-behind: gave up on {user_id} after {entry['attempts']} attempts "
+                              f"({entry['error']}), moved to {self.dead_letter_path}")
+
+    @staticmethod
+    def _discard(segments: List[Tuple[Any, str]], remove: bool) -> None:
+        for handle, path in segments:
+            handle.close()
+            if remove:
+                os.remove(path)
+
+    # === 佇列 ===
+    def _merge(self, user_id: str, fields: Dict[str, Any], queued_at: str, attempts: int = 0) -> int:
+        """併入待寫資料 (呼叫者持有 lock)，回傳被覆蓋的欄位數"""
+        entry = self._pending.get(user_id)
+        if entry is None:
+            entry = self._pending[user_id] = {'fields': {}, 'queued_at': queued_at, 'attempts': 0}
+        replaced = sum(1 for key in fields if key in entry['fields'])
+        entry['fields'].update(fields)
+        entry['queued_at'] = queued_at
+        entry['attempts'] = max(entry['attempts'], attempts)
+        self._pending_rows += len(fields) - replaced
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        return replaced
+
+    def submit(self, user_id: str, extracted_data: Dict[str, Any]) -> Dict[str, Any]:
+        """驗證並寫入 journal 後放進佇列；內容不合法時拋出 ValueError"""
+        fields = validate_update(user_id, extracted_data)
+        queued_at = now_timestamp()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Write-behind queue is closed')
+            self._append_journal({'user_id': user_id, 'fields': fields, 'queued_at': queued_at})
+            first = self._oldest is None
+            replaced = self._merge(user_id, fields, queued_at)
+            self._counters['submitted'] += 1
+            self._counters['coalesced'] += replaced
+            pending_rows = self._pending_rows
+            # 佇列由空轉為非空時讓背景執行緒開始計時，達到 max_batch 時立即寫入
+            if first or pending_rows >= self.max_batch:
+                self._wakeup.notify()
+        registry.inc('write_behind_submitted_total')
+        if replaced:
+            registry.inc('write_behind_coalesced_total', amount=replaced)
+        return {
+            'updated_count': len(fields),
+            'queued_fields': sorted(DATA_MAPPING[key][0] for key in fields),
+            'queued_at': queued_at,
+            'pending_rows': pending_rows
+        }
+
+    def pending(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """給 UserDataHandler 的 pending reader：這位使用者尚未 commit 的欄位"""
+        with self._lock:
+            flushing = self._flushing.get(user_id)
+            queued = self._pending.get(user_id)
+            if flushing is None and queued is None:
+                return None
+            if flushing is None or queued is None:
+                entry = flushing or queued
+                return {'fields': dict(entry['fields']), 'queued_at': entry['queued_at']}
+            return {'fields': {**flushing['fields'], **queued['fields']}, 'queued_at': queued['queued_at']}
+
+    def _requeue(self, user_id: str, entry: Dict[str, Any]) -> None:
+        """把沒有寫入的資料放回佇列 (呼叫者持有 lock)；flush 期間送進來的值比較新，優先保留"""
+        newer = self._pending.get(user_id)
+        self._pending[user_id] = entry if newer is None else {
+            'fields': {**entry['fields'], **newer['fields']},
+            'queued_at': newer['queued_at'],
+            'attempts': entry['attempts']
+        }
+
+    def flush(self, trigger: str = 'manual') -> Dict[str, Any]:
+        """
+        把目前佇列中的資料在一個交易內寫入，每位使用者各自成功或失敗
+        寫入失敗的使用者放回佇列 (超過 max_attempts 次移到 dead letter)；整個呼叫失敗時全部放回佇列並拋出例外
+        交易沒有完成 (retryable) 或沒有回報結果的使用者視為沒有寫入，放回佇列且不計入嘗試次數
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return {'users': 0, 'rows': 0, 'failed': 0, 'dead_lettered': 0}
+                batch = self._pending
+                self._pending, self._pending_rows, self._oldest = {}, 0, None
+                self._flushing = batch
+                sealed = self._sealed + [(self._journal, self._journal_path)]
+                self._sealed = []
+                self._open_segment()
+
+            started = time.perf_counter()
+            users = list(batch)
+            try:
+                # 整批一個交易 (每位使用者各自一個 SAVEPOINT)；單一 writer 模式下只是一次 IPC 呼叫
+                items = [{'user_id': user_id, 'extracted_data': batch[user_id]['fields'],
+                          'as_of': batch[user_id]['queued_at']} for user_id in users]
+                results = self.handler.ingest_backend_batch(items, chunk_size=len(items))
+            except Exception:
+                with self._lock:
+                    for user_id, entry in batch.items():
+                        self._requeue(user_id, entry)
+                    self._pending_rows = sum(len(entry['fields']) for entry in self._pending.values())
+                    self._oldest = time.monotonic()
+                    self._flushing = {}
+                    self._sealed = sealed + self._sealed
+                    self._counters['failures'] += 1
+                    self._counters['consecutive_failures'] += 1
+                registry.inc('write_behind_flushes_total', {'trigger': trigger, 'status': 'error'})
+                raise
+            elapsed = time.perf_counter() - started
+
+            retry, dead, stalled = {}, {}, 0
+            by_index = {result['index']: result for result in results if isinstance(result, dict)}
+            for index, user_id in enumerate(users):
+                result = by_index.get(index)
+                if result is not None and result['success']:
+                    continue
+                if result is None or result.get('retryable'):
+                    # 資料本身沒有問題 (例如資料庫被鎖住)，封存的段落刪除前先放回佇列
+                    retry[user_id] = batch[user_id]
+                    stalled += 1
+                    continue
+                entry = {**batch[user_id], 'attempts': batch[user_id]['attempts'] + 1}
+                if entry['attempts'] >= self.max_attempts:
+                    dead[user_id] = {**entry, 'error': result['error']}
+                else:
+                    retry[user_id] = entry
+            failed = len(retry) + len(dead)
+            flushed_users = len(batch) - failed
+            flushed_rows = sum(len(batch[user_id]['fields']) for user_id in users
+                               if user_id not in retry and user_id not in dead)
+            changed = sum(len(result['changed_fields']) for result in by_index.values() if result['success'])
+
+            if dead:
+                # 寫入 dead letter 之後才刪除封存的段落；寫入失敗時保留，下次啟動重播
+                self._dead_letter(dead)
+            with self._lock:
+                for user_id, entry in retry.items():
+                    self._requeue(user_id, entry)
+                    # 封存的段落接著就會刪除，重試的資料 (含合併後較新的值) 重新寫入目前的段落
+                    self._append_journal({'user_id': user_id, **self._pending[user_id]})
+                if retry:
+                    self._pending_rows = sum(len(entry['fields']) for entry in self._pending.values())
+                    if self._oldest is None:
+                        self._oldest = time.monotonic()
+                self._flushing = {}
+                self._counters['flushes'] += 1
+                self._counters['flushed_users'] += flushed_users
+                self._counters['flushed_rows'] += flushed_rows
+                self._counters['item_failures'] += failed - stalled
+                self._counters['retried'] += len(retry)
+                self._counters['dead_lettered'] += len(dead)
+                if stalled:
+                    self._counters['failures'] += 1
+                    self._counters['consecutive_failures'] += 1
+                else:
+                    self._counters['consecutive_failures'] = 0
+            self._discard(sealed, remove=True)
+
+        if failed:
+            self.logger.warning(f"Write-behind flush ({trigger}): {failed} of {len(batch)} users failed, "
+                                f"{len(retry)} will be retried")
+            if failed > stalled:
+                registry.inc('write_behind_item_failures_total', amount=failed - stalled)
+        if dead:
+            registry.inc('write_behind_dead_lettered_total', amount=len(dead))
+        self.last_flush = {
+            'trigger': trigger,
+            'users': flushed_users,
+            'rows': flushed_rows,
+            'changed_rows': changed,
+            'failed_users': failed,
+            'took_ms': round(elapsed * 1000, 2),
+            'at': now_timestamp()
+        }
+        status = 'error' if stalled else 'partial' if failed else 'ok'
+        registry.inc('write_behind_flushes_total', {'trigger': trigger, 'status': status})
+        registry.observe('write_behind_flush_duration_seconds', {'trigger': trigger}, elapsed)
+        self.logger.debug(f"Write-behind flush ({trigger}): {flushed_users} users, {flushed_rows} rows, "
+                          f"{changed} changed")
+        return {'users': flushed_users, 'rows': flushed_rows, 'failed': failed, 'dead_lettered': len(dead)}
+
+    def _due(self) -> Optional[str]:
+        if not self._pending:
+            return None
+        if self._pending_rows >= self.max_batch:
+            return 'size'
+        if time.monotonic() - self._oldest >= self.flush_interval:
+            return 'time'
+        return None
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                trigger = self._due()
+                while not self._closed and trigger is None:
+                    timeout = None if self._oldest is None else max(0.0, self._oldest + self.flush_interval - time.monotonic())
+                    self._wakeup.wait(timeout)
+                    trigger = self._due()
+                if self._closed:
+                    return
+            try:
+                self.flush(trigger)
+            except Exception as e:
+                self.logger.error(f"Write-behind flush failed, will retry: {e}")
+                time.sleep(self.flush_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': True,
+                'pending_users': len(self._pending),
+                'pending_rows': self._pending_rows,
+                'flushing_users': len(self._flushing),
+                'oldest_pending_seconds': round(time.monotonic() - self._oldest, 3) if self._oldest else 0,
+                'max_batch': self.max_batch,
+                'flush_interval': self.flush_interval,
+                'fsync': self.fsync,
+                'max_attempts': self.max_attempts,
+                'journal_dir': self.journal_dir,
+                'dead_letter_path': self.dead_letter_path,
+                **self._counters,
+                'last_flush': self.last_flush
+            }
+
+    def close(self) -> None:
+        """停止接收新資料，等背景執行緒結束後寫完剩下的資料；寫入失敗時 journal 保留到下次啟動"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify_all()
+        self._thread.join()
+        try:
+            self.flush('shutdown')
+        except Exception as e:
+            self.logger.error(f"Write-behind drain failed, updates kept in {self.journal_dir}: {e}")
+        with self._lock:
+            drained = not self._pending
+            self._discard(self._sealed, remove=False)
+            self._sealed = []
+            self._discard([(self._journal, self._journal_path)], remove=drained)
+        self.handler.set_pending_reader(None)